@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+熱門端點負載測試
+以多個執行緒同時呼叫已登入使用者最常用的端點 (/api/me、/api/usage-status、/api/user/files)，
+回報各端點的吞吐量與 p50/p99 延遲，用於比較調整前後的差異
+(只使用標準函式庫，可直接對本機或遠端服務執行)
+"""
+
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ["/api/me", "/api/usage-status", "/api/user/files?limit=20"]
+
+
+def request_json(url, payload=None, token=None):
+    """送出請求，回傳 (HTTP 狀態碼, 回應內容)"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8") if payload is not None else None,
+        headers=headers,
+        method="POST" if payload is not None else "GET"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, b""
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def login(base_url):
+    """建立測試帳號並登入，回傳 access token"""
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    password = "bench-password"
+    request_json(f"{base_url}/api/register", {"email": email, "password": password})
+    status, body = request_json(f"{base_url}/api/login", {"email": email, "password": password})
+    if status != 200:
+        return None
+    return json.loads(body)["access_token"]
+
+
+def run_benchmark(base_url, concurrency, total_requests):
+    token = login(base_url)
+    if not token:
+        print("❌ 建立測試帳號或登入失敗")
+        return
+
+    for endpoint in ENDPOINTS:
+        url = f"{base_url}{endpoint}"
+        request_json(url, token=token)  # 預熱 (快取、連線池)
+
+        def call_once(_):
+            started_at = time.perf_counter()
+            status, _ = request_json(url, token=token)
+            return status, time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call_once, range(total_requests)))
+        elapsed = time.perf_counter() - started_at
+
+        latencies = [latency for status, latency in results if status == 200]
+        failures = len(results) - len(latencies)
+        line = f"{endpoint:<28} {len(latencies) / elapsed:8.1f} req/s"
+        if latencies:
+            line += (f"   p50 {percentile(latencies, 0.5) * 1000:7.1f} ms"
+                     f"   p99 {percentile(latencies, 0.99) * 1000:7.1f} ms")
+        if failures:
+            line += f"   ⚠️  失敗 {failures}"
+        print(line)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("使用方法:")
+        print("  python bench_endpoints.py <API 網址> [並行數] [每個端點的請求數]")
+        print("  python bench_endpoints.py http://localhost:8000 50 2000")
+        return
+
+    base_url = sys.argv[1].rstrip("/")
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    total_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    print(f"🚀 每個端點 {total_requests} 次請求，並行數 {concurrency}")
+    run_benchmark(base_url, concurrency, total_requests)
+
+
+if __name__ == "__main__":
+    main()
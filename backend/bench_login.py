@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+登入吞吐量測試
+以多個執行緒同時呼叫 /api/login，回報每秒登入數與延遲分布
+(只使用標準函式庫，可直接對本機或遠端服務執行)
+
+登入端點有速率限制 (同一 IP 每分鐘 20 次)，測試前請在服務端設定 RATE_LIMIT_BYPASS_TOKEN，
+並以相同的環境變數執行此腳本，請求會帶上 X-RateLimit-Bypass 標頭略過限制
+"""
+
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+BYPASS_TOKEN = os.getenv("RATE_LIMIT_BYPASS_TOKEN", "")
+
+
+def post_json(url, payload):
+    """送出 JSON POST 請求，回傳 HTTP 狀態碼"""
+    headers = {"Content-Type": "application/json"}
+    if BYPASS_TOKEN:
+        headers["X-RateLimit-Bypass"] = BYPASS_TOKEN
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers=headers,
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def run_benchmark(base_url, concurrency, total_requests):
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    password = "bench-password"
+    if not BYPASS_TOKEN:
+        print("⚠️  未設定 RATE_LIMIT_BYPASS_TOKEN，超過登入速率限制的請求會回應 429")
+    status = post_json(f"{base_url}/api/register", {"email": email, "password": password})
+    if status != 200:
+        print(f"❌ 建立測試帳號失敗 (HTTP {status})")
+        return
+
+    def login_once(_):
+        started_at = time.perf_counter()
+        status = post_json(f"{base_url}/api/login", {"email": email, "password": password})
+        return status, time.perf_counter() - started_at
+
+    print(f"🚀 {total_requests} 次登入，並行數 {concurrency}")
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(login_once, range(total_requests)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies = [latency for status, latency in results if status == 200]
+    errors = {}
+    for status, _ in results:
+        if status != 200:
+            errors[status] = errors.get(status, 0) + 1
+
+    print(f"✅ 成功: {len(latencies)} / {total_requests}")
+    if errors:
+        print(f"⚠️  失敗: {errors}")
+    if 429 in errors:
+        print("⚠️  部分請求被速率限制拒絕，結果不代表登入吞吐量；請設定 RATE_LIMIT_BYPASS_TOKEN 後重新執行")
+    print(f"⏱️  總耗時: {elapsed:.2f} 秒")
+    print(f"📈 吞吐量: {len(latencies) / elapsed:.1f} 次登入/秒")
+    if latencies:
+        print(f"📊 延遲 p50: {percentile(latencies, 0.5) * 1000:.0f} ms, "
+              f"p99: {percentile(latencies, 0.99) * 1000:.0f} ms")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("使用方法:")
+        print("  python bench_login.py <API 網址> [並行數] [請求數]")
+        print("  python bench_login.py http://localhost:8000 20 200")
+        return
+
+    base_url = sys.argv[1].rstrip("/")
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    total_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    run_benchmark(base_url, concurrency, total_requests)
+
+
+if __name__ == "__main__":
+    main()
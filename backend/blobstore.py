@@ -0,0 +1,134 @@
+"""
+內容定址儲存
+相同內容的檔案只保存一份，以 SHA-256 為儲存鍵 (blobs/ab/<sha256>.ext，見 storage.py)，
+並透過 stored_blobs.ref_count 記錄有多少檔案記錄引用它；引用數歸零時才刪除物件
+
+寫入分為兩步：stage_blob 將內容寫入儲存後端 (不涉及資料庫，上傳到物件儲存時不持有交易)，
+store_blob 再記錄引用。其餘函數只變更 session，由呼叫端決定何時 commit，以便與檔案記錄在同一交易中更新
+"""
+
+import hashlib
+import os
+from collections import Counter, defaultdict
+
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+
+from models import StoredBlob
+
+HASH_BLOCK_SIZE = 1024 * 1024  # 計算雜湊時每次讀取 1MB
+
+
+def blob_key(sha256: str, extension: str = "") -> str:
+    """內容雜湊對應的儲存鍵"""
+    return f"blobs/{sha256[:2]}/{sha256}{extension}"
+
+
+def hash_file(path: str) -> str:
+    """計算檔案 SHA-256 (阻塞呼叫)"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def acquire_blob(db, sha256: str) -> str:
+    """增加既有內容的引用數，回傳儲存鍵；內容不存在時回傳 None"""
+    result = db.execute(
+        update(StoredBlob)
+        .where(StoredBlob.sha256 == sha256)
+        .values(ref_count=StoredBlob.ref_count + 1)
+    )
+    if result.rowcount == 0:
+        return None
+    return db.query(StoredBlob.file_path).filter(StoredBlob.sha256 == sha256).scalar()
+
+
+def stage_blob(storage, sha256: str, src_path: str, extension: str = None) -> str:
+    """將剛上傳的本機檔案寫入內容定址的儲存鍵並移除 src_path，回傳鍵 (阻塞呼叫)
+
+    相同內容寫入同一個鍵，重複寫入無副作用；物件儲存已有該鍵時略過上傳
+    """
+    if extension is None:
+        extension = os.path.splitext(src_path)[1]
+    key = blob_key(sha256, extension)
+    try:
+        if not storage.local and storage.exists(key):
+            os.remove(src_path)
+        else:
+            storage.put_file(key, src_path)
+    except BaseException:
+        if os.path.exists(src_path):
+            os.remove(src_path)
+        raise
+    return key
+
+
+def store_blob(db, storage, sha256: str, key: str, file_size: int) -> str:
+    """記錄已寫入 key 的內容 (見 stage_blob)，回傳記錄應引用的儲存鍵
+
+    內容已存在時沿用既有物件並刪除 key (兩者副檔名不同時)
+    """
+    existing_key = acquire_blob(db, sha256)
+    if existing_key == key:
+        return key
+    if existing_key and storage.exists(existing_key):
+        storage.delete(key)
+        return existing_key
+    if existing_key:
+        # 記錄存在但物件遺失，以新上傳的內容補回
+        db.query(StoredBlob).filter(StoredBlob.sha256 == sha256).update({"file_path": key})
+        return key
+
+    try:
+        with db.begin_nested():
+            db.add(StoredBlob(sha256=sha256, file_path=key, file_size=file_size, ref_count=1))
+    except IntegrityError:
+        # 其他請求同時存入了相同內容
+        existing_key = acquire_blob(db, sha256)
+        if existing_key != key:
+            storage.delete(key)
+        return existing_key
+    return key
+
+
+def release_blob(db, storage, sha256: str) -> bool:
+    """減少內容引用數，歸零時刪除物件；回傳是否已刪除"""
+    db.execute(
+        update(StoredBlob)
+        .where(StoredBlob.sha256 == sha256)
+        .values(ref_count=StoredBlob.ref_count - 1)
+    )
+    key = db.query(StoredBlob.file_path).filter(StoredBlob.sha256 == sha256).scalar()
+    result = db.execute(
+        delete(StoredBlob).where(StoredBlob.sha256 == sha256, StoredBlob.ref_count <= 0)
+    )
+    if result.rowcount == 1 and key:
+        return bool(storage.delete(key))
+    return False
+
+
+def release_blobs(db, hashes) -> list:
+    """批次減少多個內容的引用數 (同一內容可出現多次)，刪除引用數歸零的記錄
+
+    不刪除物件，回傳應刪除的儲存鍵，由呼叫端在 commit 後刪除
+    """
+    counts = Counter(hashes)
+    if not counts:
+        return []
+    groups = defaultdict(list)  # 減少量 -> 內容雜湊 (通常只有 1，一次 UPDATE)
+    for sha256, amount in counts.items():
+        groups[amount].append(sha256)
+    for amount, group in groups.items():
+        db.execute(
+            update(StoredBlob)
+            .where(StoredBlob.sha256.in_(group))
+            .values(ref_count=StoredBlob.ref_count - amount)
+        )
+    result = db.execute(
+        delete(StoredBlob)
+        .where(StoredBlob.sha256.in_(list(counts)), StoredBlob.ref_count <= 0)
+        .returning(StoredBlob.file_path)
+    )
+    return [path for path, in result]
@@ -0,0 +1,95 @@
+"""
+有上限的 TTL/LRU 快取
+- 讀取時檢查過期 (O(1))，不需定期掃描整個快取
+- 超過容量時淘汰最久未使用的項目
+- 記錄命中/未命中次數
+- get_or_set 合併同一 key 的並發計算 (single-flight)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """執行緒安全的 TTL + LRU 快取"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (過期時間, value)
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> 計算中的鎖
+
+    def get(self, key, default=None):
+        """取得快取值，不存在或已過期時回傳 default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """寫入快取，超過容量時淘汰最久未使用的項目"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory, ttl: float = None):
+        """取得快取值，不存在時以 factory() 計算並寫入；同一 key 同時只計算一次，其他呼叫端等待結果"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # 等待期間其他呼叫端可能已完成計算
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            try:
+                value = factory()
+                self.set(key, value, ttl)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def delete(self, key):
+        """使快取項目失效"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """快取統計"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
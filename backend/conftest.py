@@ -0,0 +1,27 @@
+"""
+pytest 共用設定
+測試資料庫與儲存目錄須在任何測試模組匯入 main (或 storage、database) 之前決定，
+集中在此設定一次，測試結果不受收集順序影響
+"""
+
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+
+TEST_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ['STORAGE_LOCAL_ROOT'] = os.path.join(TEST_DIR, "user_files")
+
+
+@pytest.fixture
+def session_factory():
+    """每個測試使用獨立的空白 SQLite 資料庫 (不經過 main)，回傳 sessionmaker"""
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(dir=TEST_DIR), 'isolated.db')}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
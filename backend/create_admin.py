@@ -8,7 +8,6 @@ import os
 import sys
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 from models import User, Base
 
@@ -22,8 +21,8 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./test.db')
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# 密碼加密設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密碼加密設定 (與 API 使用相同的 bcrypt 工作因子)
+from passwords import pwd_context
 
 def get_password_hash(password):
     """加密密碼"""
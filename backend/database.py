@@ -0,0 +1,258 @@
+"""
+資料庫連線設定
+依 DB_ENV (development / production) 套用連線池預設值，個別參數可再以環境變數覆寫：
+- DB_POOL_SIZE / DB_MAX_OVERFLOW: 每個 worker 行程的常駐與額外連線數
+  (同步與非同步 engine 各自一組；uvicorn --workers 4 時總連線數最多為
+   4 × 2 × (pool_size + max_overflow)，另加排程 leader 持有的一條專用連線，需小於資料庫上限)
+- DB_POOL_TIMEOUT:       等待可用連線的秒數，逾時拋出例外而不是無限等待
+- DB_POOL_RECYCLE:       連線使用超過此秒數後重建 (避免被資料庫或代理端關閉)
+- DB_POOL_PRE_PING:      借出前先 ping (每次借出多一次往返，預設關閉，以 pool_recycle 取代)
+- DB_STATEMENT_TIMEOUT_MS: PostgreSQL 單一 SQL 執行上限 (0 表示不限制)
+- SQLITE_BUSY_TIMEOUT_MS:  SQLite 等待寫入鎖的毫秒數
+
+SQLite (預設 sqlite:///./test.db) 啟用 WAL 與 synchronous=NORMAL，讀取不會被寫入阻擋
+
+另建立同一資料庫的非同步 engine (PostgreSQL 使用 asyncpg，SQLite 使用 aiosqlite)，
+供 async 端點在事件迴圈上等待資料庫，不佔用執行緒池；既有的同步 ORM 函數可透過
+AsyncSession.run_sync() 重複使用
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./test.db')
+# 處理 Render.com 的 DATABASE_URL 格式
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+DB_ENV = os.getenv('DB_ENV', 'development')
+
+# 同步 driver -> 非同步 driver
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+
+# 各環境的連線池預設值
+POOL_PROFILES = {
+    "development": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "statement_timeout_ms": 0
+    },
+    # 小型託管 PostgreSQL：4 個 worker × 2 個 engine (同步 + 非同步) × (2 + 1) = 24 條連線
+    "production": {
+        "pool_size": 2,
+        "max_overflow": 1,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "statement_timeout_ms": 30000
+    }
+}
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+
+def database_settings(env: str = DB_ENV) -> dict:
+    """目前環境的連線池設定 (環境變數優先於預設值)"""
+    profile = POOL_PROFILES.get(env, POOL_PROFILES["development"])
+    return {
+        "env": env,
+        "pool_size": int(os.getenv('DB_POOL_SIZE', profile["pool_size"])),
+        "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', profile["max_overflow"])),
+        "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', profile["pool_timeout"])),
+        "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', profile["pool_recycle"])),
+        "pool_pre_ping": os.getenv('DB_POOL_PRE_PING', '0') == '1',
+        "statement_timeout_ms": int(os.getenv('DB_STATEMENT_TIMEOUT_MS', profile["statement_timeout_ms"]))
+    }
+
+
+class PoolMonitor:
+    """連線池統計：借出次數、等待時間、逾時與連線持有時間"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.hold_seconds_total = 0.0
+        self.max_hold_seconds = 0.0
+        self.on_wait = None  # 每次取得連線時以等待秒數呼叫 (例如記錄到延遲分布指標)
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+        if self.on_wait is not None:
+            self.on_wait(seconds)
+
+    def attach(self, engine):
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                self.connects += 1
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            connection_record.info["checked_out_at"] = time.perf_counter()
+            with self._lock:
+                self.checkouts += 1
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            started = connection_record.info.pop("checked_out_at", None)
+            with self._lock:
+                self.checkins += 1
+                if started is not None:
+                    held = time.perf_counter() - started
+                    self.hold_seconds_total += held
+                    self.max_hold_seconds = max(self.max_hold_seconds, held)
+
+        @event.listens_for(engine, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            with self._lock:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            checkouts = self.checkouts
+            return {
+                "connects": self.connects,
+                "checkouts": checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_seconds_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_hold_ms": round(self.hold_seconds_total / self.checkins * 1000, 3) if self.checkins else 0.0,
+                "max_hold_ms": round(self.max_hold_seconds * 1000, 3)
+            }
+
+
+pool_monitor = PoolMonitor()
+async_pool_monitor = PoolMonitor()
+
+
+class _MonitoredPoolMixin:
+    """記錄等待可用連線的時間"""
+    monitor = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.monitor.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        self.monitor.record_wait(time.perf_counter() - started)
+        return connection
+
+
+class MonitoredQueuePool(_MonitoredPoolMixin, QueuePool):
+    monitor = pool_monitor
+
+
+class MonitoredAsyncQueuePool(_MonitoredPoolMixin, AsyncAdaptedQueuePool):
+    monitor = async_pool_monitor
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+def _pool_options(settings: dict, poolclass) -> dict:
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings["pool_size"],
+        "max_overflow": settings["max_overflow"],
+        "pool_timeout": settings["pool_timeout"],
+        "pool_recycle": settings["pool_recycle"],
+        "pool_pre_ping": settings["pool_pre_ping"]
+    }
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def create_db_engine(url: str = DATABASE_URL, settings: dict = None):
+    """依資料庫類型與環境設定建立 engine"""
+    settings = settings or database_settings()
+    parsed = make_url(url)
+    if _is_memory_sqlite(parsed):
+        # 記憶體資料庫只能共用單一連線，不套用連線池設定
+        return create_engine(url)
+
+    options = _pool_options(settings, MonitoredQueuePool)
+    if parsed.get_backend_name() == "postgresql" and settings["statement_timeout_ms"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings['statement_timeout_ms']}"}
+
+    engine = create_engine(url, **options)
+    if parsed.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    pool_monitor.attach(engine)
+    return engine
+
+
+def async_database_url(url: str = DATABASE_URL) -> str:
+    """將同步連線字串轉為對應的非同步 driver"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"不支援非同步連線的資料庫: {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def create_async_db_engine(url: str = DATABASE_URL, settings: dict = None):
+    """建立非同步 engine (連線池設定與同步 engine 相同，各自計算連線數)"""
+    settings = settings or database_settings()
+    parsed = make_url(url)
+    async_url = async_database_url(url)
+    if _is_memory_sqlite(parsed):
+        return create_async_engine(async_url)
+
+    options = _pool_options(settings, MonitoredAsyncQueuePool)
+    if parsed.get_backend_name() == "postgresql" and settings["statement_timeout_ms"]:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(settings["statement_timeout_ms"])}}
+
+    async_engine = create_async_engine(async_url, **options)
+    if parsed.get_backend_name() == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    async_pool_monitor.attach(async_engine.sync_engine)
+    return async_engine
+
+
+engine = create_db_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_db_engine()
+# commit 後不使物件過期，回應時讀取屬性不需再查詢 (非同步 session 也不允許隱含的延遲載入)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
+async def get_async_db():
+    """FastAPI dependency：非同步 session (第一次查詢時才借出連線)"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,151 @@
+"""
+檔案內容回應 (影片播放與下載)
+- Range: 單一區段 (bytes=a-b / a- / -n) 回應 206，超出檔案範圍回應 416；
+  多段 Range 或格式錯誤時忽略 Range 回傳完整內容 (RFC 9110 允許)
+- If-Range: 與 ETag 不符 (內容已變更) 時忽略 Range，回傳完整內容
+- If-None-Match: 符合 ETag 時回應 304，不傳送內容
+- 本機檔案：伺服器支援 ASGI http.response.zerocopysend 擴充時，直接交給伺服器以 sendfile 傳送
+  (資料不經過 Python)；否則以 os.pread 於執行緒分段讀取
+- 物件儲存：以 Range GET 只下載需要的區段並轉送
+"""
+
+import os
+
+import anyio
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response
+
+from storage import READ_CHUNK_SIZE, content_disposition
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 起點超出檔案大小"""
+
+
+def parse_range(header: str, size: int):
+    """解析 Range 標頭，回傳 (start, length)；不使用 Range (無標頭、多段或格式錯誤) 時回傳 None"""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # 最後 N 個位元組
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start = max(0, size - suffix)
+            return start, size - start
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1) - start + 1
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    """If-None-Match (弱比較) / If-Range (強比較) 是否符合目前的 ETag"""
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    if not weak and etag.startswith("W/"):
+        return False
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+class ObjectResponse(Response):
+    """傳送儲存物件的 [start, start + length) 區段"""
+
+    chunk_size = READ_CHUNK_SIZE
+
+    def __init__(self, storage, key: str, start: int, length: int, status_code: int = 200,
+                 headers: dict = None, media_type: str = None):
+        self.storage = storage
+        self.key = key
+        self.start = start
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**(headers or {}), "content-length": str(length)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self.storage.local:
+            await self._send_file(scope, send)
+        else:
+            chunks = self.storage.read_range(self.key, self.start, self.length)
+            async for chunk in iterate_in_threadpool(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_file(self, scope, send):
+        fd = await anyio.to_thread.run_sync(os.open, self.storage.path(self.key), os.O_RDONLY)
+        try:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({
+                    "type": ZEROCOPY_EXTENSION, "file": fd,
+                    "offset": self.start, "count": self.length, "more_body": False
+                })
+                return
+            offset, end = self.start, self.start + self.length
+            while offset < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": offset < end})
+            if offset < end:
+                # 傳送期間檔案被截短，結束回應 (用戶端會因長度不足而重試)
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+def serve_object(request, storage, key: str, size: int, etag: str, media_type: str, filename: str,
+                 inline: bool = True, headers: dict = None) -> Response:
+    """依條件式與 Range 標頭回傳 200 / 206 / 304 / 416"""
+    headers = {**(headers or {}), "accept-ranges": "bytes"}
+    if etag:
+        headers["etag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = content_disposition(filename, "inline" if inline else "attachment")
+    if_range = request.headers.get("if-range")
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        if if_range is None or etag_matches(if_range, etag, weak=False):
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        byte_range = None
+    if byte_range and if_range is not None and not etag_matches(if_range, etag, weak=False):
+        byte_range = None  # 內容已變更，回傳完整的新內容
+
+    if byte_range is None:
+        return ObjectResponse(storage, key, 0, size, headers=headers, media_type=media_type)
+    start, length = byte_range
+    headers["content-range"] = f"bytes {start}-{start + length - 1}/{size}"
+    return ObjectResponse(storage, key, start, length, status_code=206, headers=headers, media_type=media_type)
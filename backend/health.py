@@ -0,0 +1,144 @@
+"""
+健康檢查
+- ReadinessCheck: 資料庫 ping，結果快取數秒且有逾時，探測請求不會各自打到資料庫
+- HealthSampler:  背景執行緒以固定間隔收集系統指標 (記憶體、磁碟、連線池、佇列)，
+                  /health/details 只讀取最近一次的取樣結果
+
+可透過環境變數設定：
+- HEALTH_SAMPLE_INTERVAL: 系統指標取樣間隔秒數
+- READINESS_CACHE_TTL:    資料庫 ping 結果的快取秒數
+- READINESS_TIMEOUT:      資料庫 ping 逾時秒數
+"""
+
+import os
+import shutil
+import threading
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+
+from sqlalchemy import text
+
+HEALTH_SAMPLE_INTERVAL = float(os.getenv('HEALTH_SAMPLE_INTERVAL', '15'))
+READINESS_CACHE_TTL = float(os.getenv('READINESS_CACHE_TTL', '5'))
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '2'))
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessCheck:
+    """快取的資料庫 ping；同時只有一個 ping 進行，其他呼叫端沿用上次結果"""
+
+    def __init__(self, engine, ttl: float = READINESS_CACHE_TTL, timeout: float = READINESS_TIMEOUT):
+        self.engine = engine
+        self.ttl = ttl
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="readiness")
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._result = {"ready": False, "error": "尚未檢查"}
+
+    def _ping(self):
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    def check(self) -> dict:
+        """回傳 {"ready": bool, "latency_ms"|"error": ..., "checked_at": ...}"""
+        if time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        if not self._lock.acquire(blocking=False):
+            # 其他請求正在 ping
+            return self._result
+        try:
+            started = time.perf_counter()
+            future = self._executor.submit(self._ping)
+            try:
+                future.result(timeout=self.timeout)
+                result = {"ready": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+            except FutureTimeoutError:
+                result = {"ready": False, "error": f"資料庫回應逾時 ({self.timeout:g} 秒)"}
+            except Exception as e:
+                result = {"ready": False, "error": str(e) or e.__class__.__name__}
+            result["checked_at"] = datetime.utcnow().isoformat()
+            self._result = result
+            self._checked_at = time.monotonic()
+            return result
+        finally:
+            self._lock.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HealthSampler:
+    """背景定期執行已註冊的指標函數，保存最近一次的結果"""
+
+    def __init__(self, interval: float = HEALTH_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.probes = {}
+        self.snapshot = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_probe(self, name: str, fn):
+        """註冊指標，fn() 回傳可序列化為 JSON 的資料"""
+        self.probes[name] = fn
+
+    def sample(self) -> dict:
+        """執行所有指標函數 (單一指標失敗只記錄錯誤)"""
+        snapshot = {}
+        for name, fn in self.probes.items():
+            try:
+                snapshot[name] = fn()
+            except Exception as e:
+                snapshot[name] = {"error": str(e) or e.__class__.__name__}
+        snapshot["sampled_at"] = datetime.utcnow().isoformat()
+        self.snapshot = snapshot
+        return snapshot
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="health-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("健康指標取樣失敗")
+            self._stop.wait(self.interval)
+
+
+def disk_usage(path: str) -> dict:
+    """目錄所在磁碟的使用量 (statvfs，不走訪目錄；檔案數與總大小見 user_storage)"""
+    if not os.path.exists(path):
+        return {}
+    disk = shutil.disk_usage(path)
+    return {
+        "disk": {
+            "total_mb": disk.total // 1024 // 1024,
+            "free_mb": disk.free // 1024 // 1024,
+            "percent": round(disk.used / disk.total * 100, 1) if disk.total else 0.0
+        }
+    }
+
+
+def pool_stats(engine) -> dict:
+    """SQLAlchemy 連線池狀態"""
+    pool = engine.pool
+    stats = {"class": pool.__class__.__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
@@ -0,0 +1,91 @@
+"""
+JSON 端點的 HTTP 快取 (弱 ETag 與 304 Not Modified)
+- ETagMiddleware: 對設定的路徑，GET 回應 200 且為 JSON 時附上弱 ETag，
+  If-None-Match 相符時改回 304 不傳內容，並依路徑加上 Cache-Control 與 Vary: Authorization
+  (回應依使用者而不同，只允許瀏覽器私有快取，且換帳號登入時不會沿用其他使用者的快取)
+  - 端點已設定 ETag (由資料版本計算) 時沿用，否則以回應內容的雜湊計算
+- not_modified(): 端點可先以資料版本 (row version、max(updated_at)) 計算 ETag，
+  相符時直接回應 304，不必查詢與序列化完整資料
+
+瀏覽器的 fetch (預設 cache 模式) 收到 ETag 與 Cache-Control: no-cache 後，
+之後的請求會自動帶上 If-None-Match；伺服器回應 304 時 fetch 仍取得 200 與快取的內容，前端不需修改
+"""
+
+import hashlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+from downloads import etag_matches
+
+PRIVATE_REVALIDATE = "private, no-cache"  # 每次使用前向伺服器確認，內容未變時回應 304
+
+
+def weak_etag(*parts) -> str:
+    """由資料版本 (或回應內容) 計算弱 ETag"""
+    hasher = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else str(part).encode())
+        hasher.update(b"\x00")
+    return f'W/"{hasher.hexdigest()}"'
+
+
+def not_modified(request, etag: str, cache_control: str = PRIVATE_REVALIDATE):
+    """If-None-Match 與 etag 相符時回傳 304 回應，否則回傳 None"""
+    if not etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    return Response(status_code=304, headers={"etag": etag, "cache-control": cache_control, "vary": "Authorization"})
+
+
+class ETagMiddleware:
+    """為 JSON 回應加上弱 ETag 並處理 If-None-Match"""
+
+    def __init__(self, app, policies: dict):
+        self.app = app
+        self.policies = policies  # 路徑 -> Cache-Control
+
+    async def __call__(self, scope, receive, send):
+        policy = self.policies.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start = None
+        passthrough = False
+        chunks = []
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] != 200 or not headers.get("content-type", "").startswith("application/json"):
+                    # 錯誤、端點自行回應的 304 與串流 (NDJSON) 不處理
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(scope=start)
+            etag = headers.get("etag") or weak_etag(body)
+            headers["etag"] = etag
+            headers.setdefault("cache-control", policy)
+            headers.add_vary_header("Authorization")
+            if etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                del headers["content-type"]
+                await send({**start, "status": 304})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,192 @@
+"""
+AI 推論執行器
+在獨立行程執行 CPU 密集的模型推論，避免阻塞 uvicorn 事件迴圈
+每個推論行程各自以 Pipe 接收工作 (而非共用的 ProcessPoolExecutor)：
+逾時或崩潰時只終止並替換該行程，其他使用者執行中的推論不受影響
+
+可透過環境變數設定：
+- INFERENCE_WORKERS:              推論行程數
+- INFERENCE_MAX_PENDING:          排隊中的推論上限 (超過時呼叫端等待)
+- INFERENCE_TIMEOUT:              單一推論逾時秒數
+- INFERENCE_MAX_TASKS_PER_CHILD:  每個行程處理 N 個推論後回收重建
+"""
+
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+INFERENCE_MAX_PENDING = int(os.getenv('INFERENCE_MAX_PENDING', '8'))
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '600'))
+INFERENCE_MAX_TASKS_PER_CHILD = int(os.getenv('INFERENCE_MAX_TASKS_PER_CHILD', '50'))
+
+
+class InferenceTimeoutError(Exception):
+    """推論逾時"""
+
+
+class InferenceBusyError(Exception):
+    """推論佇列已滿"""
+
+
+def summarize_video(file_path: str, file_name: str) -> str:
+    """影片摘要模型 (於推論行程中執行)"""
+    # 這裡應該呼叫你的 AI model
+    # result = your_ai_model(file_path)
+    return f"這是影片 {file_name} 的 AI 摘要。影片內容分析完成，包含關鍵場景、重要對話和主要情節。"
+
+
+def render_presentation_video(pdf_path: str, video_path: str) -> str:
+    """PDF 轉影片模型 (於推論行程中執行)，回傳產出的影片路徑"""
+    # 這裡應該呼叫你的 AI model，並產生 video_path
+    # 這裡用一個現有的 mp4 檔案作為 demo
+    if os.path.exists("demo.mp4"):
+        shutil.copyfile("demo.mp4", video_path)
+    else:
+        # 創建一個假的影片檔案
+        with open(video_path, "wb") as f:
+            f.write(b"fake video content")
+    return video_path
+
+
+def _worker_main(conn):
+    """推論行程主迴圈：逐一接收 (fn, args) 並回傳 (成功與否, 結果或例外)，收到 None 時結束"""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args = task
+        try:
+            result = (True, fn(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # 結果或例外無法 pickle
+            conn.send((False, RuntimeError(f"推論結果無法傳回: {e!r}")))
+
+
+class _Worker:
+    """單一推論行程 (一次只執行一個工作)"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def call(self, fn, args, timeout: float):
+        """執行工作並等待結果；逾時拋出 InferenceTimeoutError，行程異常結束拋出 BrokenProcessPool"""
+        try:
+            self.conn.send((fn, args))
+            if not self.conn.poll(timeout):
+                raise InferenceTimeoutError(f"推論逾時 ({timeout:.0f} 秒)")
+            ok, value = self.conn.recv()
+        except (EOFError, OSError):
+            raise BrokenProcessPool(f"推論行程異常結束 (exit code {self.process.exitcode})")
+        finally:
+            self.tasks += 1
+        if not ok:
+            raise value
+        return value
+
+    def stop(self):
+        """通知行程結束 (閒置時使用)"""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        """立即終止行程 (逾時或崩潰時使用，不影響其他行程)"""
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class InferenceRunner:
+    """有界並行的推論執行器，支援逾時與 worker 行程回收"""
+
+    def __init__(
+        self,
+        max_workers: int = INFERENCE_WORKERS,
+        max_pending: int = INFERENCE_MAX_PENDING,
+        timeout: float = INFERENCE_TIMEOUT,
+        max_tasks_per_child: int = INFERENCE_MAX_TASKS_PER_CHILD
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)  # 執行中 + 排隊中
+        self._running = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._idle = []  # 閒置的推論行程 (重複使用，保留模型等已載入的狀態)
+        self._context = multiprocessing.get_context()
+        self.timeouts = 0
+        self.crashes = 0
+
+    def _acquire_worker(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        return _Worker(self._context)
+
+    def _release_worker(self, worker: _Worker):
+        if self.max_tasks_per_child and worker.tasks >= self.max_tasks_per_child:
+            worker.stop()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, fn, *args, timeout: float = None):
+        """在推論行程中執行 fn(*args) 並等待結果 (阻塞呼叫，請於背景 worker 中使用)"""
+        timeout = timeout or self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise InferenceBusyError("推論佇列已滿，請稍後再試")
+        try:
+            if not self._running.acquire(timeout=timeout):
+                raise InferenceBusyError("推論佇列已滿，請稍後再試")
+            try:
+                worker = self._acquire_worker()
+                try:
+                    result = worker.call(fn, args, timeout)
+                except InferenceTimeoutError:
+                    # 只終止執行此工作的行程，下次需要時再建立新行程
+                    self.timeouts += 1
+                    worker.kill()
+                    raise
+                except BrokenProcessPool:
+                    self.crashes += 1
+                    worker.kill()
+                    raise
+                except BaseException:
+                    # fn 本身拋出的例外：行程仍可重複使用
+                    self._release_worker(worker)
+                    raise
+                self._release_worker(worker)
+                return result
+            finally:
+                self._running.release()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """關閉閒置的推論行程 (執行中的工作由各自的呼叫端等待結束)"""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
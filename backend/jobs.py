@@ -0,0 +1,277 @@
+"""
+非同步工作佇列
+上傳端點只負責排入工作並立即回傳 job id，AI 處理交由背景 worker 執行
+
+後端可透過 JOB_QUEUE_BACKEND 切換：
+- memory:   行程內佇列 (預設，單一 worker)
+- database: 以 processing_jobs 表作為佇列，多個 uvicorn worker 可共同領取工作
+
+執行中的工作持有租約：worker 定期更新 heartbeat_at，超過 JOB_LEASE_SECONDS 未更新
+(行程當機或被終止) 的工作會重新排入佇列，由任一 worker 重新執行
+"""
+
+import abc
+import os
+import queue
+import socket
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from models import ProcessingJob
+from logs import log_context
+
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'memory')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))  # 每個行程的背景 worker 數
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))  # database 後端輪詢間隔 (秒)
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '30'))  # 更新租約與檢查逾時工作的間隔 (秒)
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))  # 超過此秒數未更新心跳的執行中工作重新排入
+
+logger = logging.getLogger(__name__)
+
+
+class BaseJobQueue(abc.ABC):
+    """工作佇列基底類別，負責工作的建立、領取、租約與狀態轉換"""
+
+    def __init__(self, session_factory, workers: int = JOB_WORKERS,
+                 heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_seconds = lease_seconds
+        self.handlers = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._active = set()  # 本行程執行中的 job id
+        self._active_lock = threading.Lock()
+
+    def register(self, job_type: str, handler):
+        """註冊工作處理函數，handler(job, db) 於背景 worker 中執行"""
+        self.handlers[job_type] = handler
+
+    def enqueue(self, db, user_id: int, file_id: int, job_type: str, job_id: str = None) -> ProcessingJob:
+        """建立工作並排入佇列 (job_id 可由呼叫端預先產生，與其他變更在同一交易寫入)"""
+        if job_type not in self.handlers:
+            raise ValueError(f"未註冊的工作類型: {job_type}")
+        job = ProcessingJob(
+            id=job_id or str(uuid.uuid4()),
+            user_id=user_id,
+            file_id=file_id,
+            job_type=job_type,
+            state='queued'
+        )
+        db.add(job)
+        db.commit()
+        self._notify(job.id)
+        return job
+
+    def start(self):
+        """啟動背景 worker"""
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """停止背景 worker"""
+        self._stop.set()
+        for _ in self._threads:
+            self._wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def depth(self) -> int:
+        """佇列中等待處理的工作數"""
+        db = self.session_factory()
+        try:
+            return db.query(ProcessingJob).filter(ProcessingJob.state == 'queued').count()
+        finally:
+            db.close()
+
+    @abc.abstractmethod
+    def _notify(self, job_id: str):
+        """通知 worker 有新工作"""
+
+    @abc.abstractmethod
+    def _wake(self):
+        """喚醒等待中的 worker (停止時使用)"""
+
+    @abc.abstractmethod
+    def _worker_loop(self):
+        """worker 執行緒主迴圈"""
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.warning("更新工作租約失敗: %s", e)
+
+    def _heartbeat(self):
+        """更新本行程執行中工作的心跳，並重新排入租約逾時的工作"""
+        db = self.session_factory()
+        try:
+            with self._active_lock:
+                active = list(self._active)
+            if active:
+                db.execute(
+                    update(ProcessingJob)
+                    .where(ProcessingJob.id.in_(active), ProcessingJob.state == 'running',
+                           ProcessingJob.worker_id == self.worker_id)
+                    .values(heartbeat_at=datetime.utcnow())
+                )
+                db.commit()
+            for job_id in self._requeue_stale(db):
+                self._notify(job_id)
+        finally:
+            db.close()
+
+    def _requeue_stale(self, db) -> list:
+        """將租約逾時 (例如 worker 當機) 的執行中工作重新排入佇列，回傳其 job id"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        stale = func.coalesce(ProcessingJob.heartbeat_at, ProcessingJob.started_at) < stale_before
+        job_ids = [job_id for (job_id,) in db.query(ProcessingJob.id).filter(ProcessingJob.state == 'running', stale)]
+        if not job_ids:
+            return []
+        db.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id.in_(job_ids), ProcessingJob.state == 'running', stale)
+            .values(state='queued', worker_id=None, heartbeat_at=None)
+        )
+        db.commit()
+        logger.warning("重新排入租約逾時的工作", extra={"job_ids": job_ids})
+        return job_ids
+
+    def _claim(self, db, job_id: str) -> bool:
+        """以條件式 UPDATE 領取工作，確保同一工作只會被一個 worker 執行"""
+        result = db.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, ProcessingJob.state == 'queued')
+            .values(state='running', worker_id=self.worker_id, started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def _execute(self, job_id: str):
+        """領取並執行單一工作 (日誌以 job-<id> 作為 request id)"""
+        with log_context(f"job-{job_id}"):
+            self._execute_job(job_id)
+
+    def _execute_job(self, job_id: str):
+        db = self.session_factory()
+        try:
+            if not self._claim(db, job_id):
+                return
+            with self._active_lock:
+                self._active.add(job_id)
+            job = db.get(ProcessingJob, job_id)
+            handler = self.handlers.get(job.job_type)
+            try:
+                if handler is None:
+                    raise ValueError(f"未註冊的工作類型: {job.job_type}")
+                handler(job, db)
+            except Exception as e:
+                db.rollback()
+                job = db.get(ProcessingJob, job_id)
+                job.error = str(e) or e.__class__.__name__
+                logger.exception("工作執行失敗", extra={"job_id": job_id, "job_type": job.job_type})
+            job.state = 'done'
+            job.finished_at = datetime.utcnow()
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("工作佇列錯誤", extra={"job_id": job_id})
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+            db.close()
+
+
+class InProcessJobQueue(BaseJobQueue):
+    """行程內佇列：以 queue.Queue 傳遞 job id"""
+
+    def __init__(self, session_factory, workers: int = JOB_WORKERS):
+        super().__init__(session_factory, workers)
+        self._queue = queue.Queue()
+
+    def start(self):
+        # 重新排入上次關閉前尚未執行的工作
+        db = self.session_factory()
+        try:
+            pending = db.query(ProcessingJob.id).filter(ProcessingJob.state == 'queued')\
+                .order_by(ProcessingJob.created_at).all()
+            for (job_id,) in pending:
+                self._queue.put(job_id)
+        except Exception:
+            logger.exception("載入待處理工作失敗")
+        finally:
+            db.close()
+        super().start()
+
+    def _notify(self, job_id: str):
+        self._queue.put(job_id)
+
+    def _wake(self):
+        self._queue.put(None)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                continue
+            self._execute(job_id)
+
+
+class DatabaseJobQueue(BaseJobQueue):
+    """資料庫佇列：各 worker 輪詢 processing_jobs 表領取工作，支援多行程部署"""
+
+    def __init__(self, session_factory, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL):
+        super().__init__(session_factory, workers)
+        self.poll_interval = poll_interval
+        self._event = threading.Event()
+
+    def _notify(self, job_id: str):
+        self._event.set()
+
+    def _wake(self):
+        self._event.set()
+
+    def _next_job_id(self):
+        db = self.session_factory()
+        try:
+            row = db.query(ProcessingJob.id).filter(ProcessingJob.state == 'queued')\
+                .order_by(ProcessingJob.created_at).first()
+            return row[0] if row else None
+        finally:
+            db.close()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._next_job_id()
+            except Exception as e:
+                logger.warning("輪詢工作佇列失敗: %s", e)
+                job_id = None
+            if job_id is None:
+                self._event.wait(self.poll_interval)
+                self._event.clear()
+                continue
+            self._execute(job_id)
+
+
+def create_job_queue(session_factory, backend: str = JOB_QUEUE_BACKEND):
+    """依設定建立工作佇列"""
+    if backend == 'memory':
+        return InProcessJobQueue(session_factory)
+    if backend == 'database':
+        return DatabaseJobQueue(session_factory)
+    raise ValueError(f"不支援的工作佇列後端: {backend}")
@@ -0,0 +1,208 @@
+"""
+結構化日誌
+- 每行一筆 JSON (LOG_FORMAT=json) 或一般文字 (LOG_FORMAT=text)，方便日誌系統解析
+- 請求執行緒只將記錄放入佇列 (QueueHandler)，由背景執行緒寫出；佇列已滿時丟棄並計數，不阻塞請求
+- DEBUG 記錄可依 LOG_DEBUG_SAMPLE_RATE 取樣；未啟用 DEBUG 時 logger.debug() 只做一次等級判斷
+- RequestIdMiddleware 由 X-Request-ID 標頭取得或產生 request id，同一請求內的記錄自動帶上；
+  背景工作以 log_context() 指定自己的 id
+
+可透過環境變數設定：
+- LOG_LEVEL:              根 logger 等級 (預設 INFO)
+- LOG_LEVELS:             個別 logger 等級，例如 "main=DEBUG,sqlalchemy.engine=INFO"
+- LOG_FORMAT:             json 或 text
+- LOG_DEBUG_SAMPLE_RATE:  DEBUG 記錄保留比例 (0~1，預設 1 全部保留)
+- LOG_QUEUE_SIZE:         日誌佇列上限
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+REQUEST_ID_HEADER = "x-request-id"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# LogRecord 內建屬性，其餘屬性 (logger 呼叫時的 extra=) 視為結構化欄位
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+_request_id = ContextVar("request_id", default=None)
+
+
+def get_request_id():
+    """目前請求 (或背景工作) 的 request id"""
+    return _request_id.get()
+
+
+@contextmanager
+def log_context(request_id: str = None):
+    """在區塊內使用指定的 request id (背景工作、排程使用)"""
+    token = _request_id.set(request_id or uuid.uuid4().hex)
+    try:
+        yield _request_id.get()
+    finally:
+        _request_id.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """在產生記錄的執行緒中加上 request id (進入佇列後就無法取得)"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """依比例保留 DEBUG 記錄，INFO 以上全部保留"""
+
+    def __init__(self, rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆記錄輸出為一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """一般文字格式 (開發時閱讀用)，結構化欄位附在訊息後"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = None
+        text = super().format(record)
+        fields = {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS and not key.startswith("_")}
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class DroppingQueueHandler(QueueHandler):
+    """佇列已滿時丟棄記錄 (計數) 而不阻塞呼叫端"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 在呼叫端完成訊息格式化 (參數可能在之後被修改)，例外堆疊轉為文字
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging():
+    """設定根 logger：佇列 handler + 背景寫出 (重複呼叫無作用)"""
+    global _handler, _listener
+    if _handler is not None:
+        return _handler
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter())
+    _handler.addFilter(ContextFilter())
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    for item in LOG_LEVELS.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    return _handler
+
+
+def dropped_records() -> int:
+    """因佇列已滿而丟棄的日誌數"""
+    return _handler.dropped if _handler is not None else 0
+
+
+class RequestIdMiddleware:
+    """為每個請求設定 request id，並以 X-Request-ID 回應標頭回傳"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER.encode():
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        token = _request_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
@@ -1,52 +1,228 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordBearer
 
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, Column, Integer, String, func
+from sqlalchemy import Column, Integer, String, func, true, update, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from passlib.context import CryptContext
+from sqlalchemy.orm import Session
 from jose import jwt, JWTError, ExpiredSignatureError
 import os
+import mimetypes
 import secrets
+import json
+import logging
+import time
 from dotenv import load_dotenv
-import shutil
+
+# 先載入 .env，以下模組在匯入時讀取環境變數
+load_dotenv()
+
 import uuid
-from models import User, UsageRecord, UserFile, Base  
+from models import User, UsageRecord, UserFile, ProcessingJob, UploadSession, StoredBlob, DailyUsageCounter, Base  
 from datetime import datetime, date, timedelta
 from fastapi import status
 import psutil
 from functools import lru_cache
+from contextlib import asynccontextmanager
+from jobs import create_job_queue
+from inference import InferenceRunner, summarize_video, render_presentation_video
+from uploads import ingest_upload, preallocate_file, link_file, detach_file, merge_ranges, received_bytes, write_chunk
+from blobstore import stage_blob, store_blob, acquire_blob, release_blob, hash_file
+from storage import create_storage, SIGNED_URL_PREFIX, STORAGE_PRESIGN_SECONDS
+from downloads import serve_object
+from httpcache import ETagMiddleware, PRIVATE_REVALIDATE, weak_etag, not_modified
+import anyio
+from sharedcache import SharedCache, create_cache_backend
+from tokens import get_token_version, bump_token_version
+from passwords import PasswordHasher
+from ratelimit import RateLimiter, parse_limits
+from scheduler import Scheduler, create_leader_lock
+from sweeper import Sweeper
+from health import ReadinessCheck, HealthSampler, pool_stats
+from pagination import select_fields, project, keyset, fetch_page, wants_ndjson, stream_ndjson
+from metrics import (
+    registry, MetricsMiddleware, instrument_engine, Histogram, CallbackMetric, SIZE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+)
+from quota import charge_storage, release_storage, get_storage_bytes, get_total_storage, get_user_storage_async, get_storage_version_async
+from usage import get_daily_usage, get_daily_usage_async, reserve_usage, refund_usage, daily_usage_summary, usage_day, TOTAL_SERVICE
+from database import (
+    DB_ENV, engine, SessionLocal, async_engine, get_async_db, database_settings, pool_monitor, async_pool_monitor
+)
+from logs import setup_logging, log_context, RequestIdMiddleware, dropped_records
+from dataclasses import dataclass
 
-load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./test.db')
 SECRET_KEY = os.getenv('SECRET_KEY', 'devsecret')
 ALGORITHM = 'HS256'
-DAILY_USAGE_LIMIT = 5  # 每日使用次數限制
+DAILY_USAGE_LIMIT = int(os.getenv('DAILY_USAGE_LIMIT', '5'))  # 每日使用次數限制
+STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', '0'))  # 每位使用者的儲存空間上限 (bytes，0 表示不限制)
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB (免費方案限制)
+MAX_PDF_FILE_SIZE = 20 * 1024 * 1024  # 20MB for PDF
 FILE_RETENTION_DAYS = 7  # 檔案保留天數
 FILE_EXPIRY_WARNING_HOURS = 24  # 檔案過期前警告時間 (小時)
+UPLOAD_SESSION_HOURS = 24  # 分塊上傳未完成的保留時間 (小時)
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 建議的分塊大小 (5MB)
+CLEANUP_INTERVAL_SECONDS = int(os.getenv('CLEANUP_INTERVAL_SECONDS', '300'))  # 過期檔案清理間隔
+CLEANUP_BATCH_SIZE = int(os.getenv('CLEANUP_BATCH_SIZE', '200'))  # 每批清理的記錄數
+CLEANUP_MAX_BATCHES = int(os.getenv('CLEANUP_MAX_BATCHES', '50'))  # 每次排程最多處理的批數，其餘留待下次
+RECONCILE_INTERVAL_SECONDS = int(os.getenv('RECONCILE_INTERVAL_SECONDS', '21600'))  # 儲存後端與資料庫對帳間隔
+FILE_CONTENT_MAX_AGE = 3600  # 檔案內容的瀏覽器快取秒數 (內容不變，過期後以 If-None-Match 重新驗證)
+STORAGE_REDIRECT_DOWNLOADS = os.getenv('STORAGE_REDIRECT_DOWNLOADS', '0') == '1'  # 物件儲存時以 307 導向預簽網址下載，不經過 API 轉送
 
-# 簡單的用戶快取
-user_cache = {}
-cache_timestamps = {}
+# 各服務的上傳限制
+UPLOAD_RULES = {
+    "video_abstract": {
+        "max_size": MAX_FILE_SIZE,
+        "accept": lambda content_type: content_type.startswith("video/"),
+        "type_error": "只允許上傳影片檔案",
+        "size_error": f"檔案過大，請上傳 {MAX_FILE_SIZE // 1024 // 1024}MB 以下的影片"
+    },
+    "ppt_to_video": {
+        "max_size": MAX_PDF_FILE_SIZE,
+        "accept": lambda content_type: content_type == "application/pdf",
+        "type_error": "只允許上傳 PDF 檔案",
+        "size_error": f"檔案過大，請上傳 {MAX_PDF_FILE_SIZE // 1024 // 1024}MB 以下的 PDF"
+    }
+}
+
+# 各端點的請求速率限制 (短期突發 + 長期持續)，同時依使用者與 IP 計算；格式為 名稱:次數/秒數 (見 ratelimit.parse_limits)
+RATE_LIMIT_RULES = {
+    # 直接上傳 (單一請求送出整個檔案)
+    "upload": parse_limits(os.getenv('RATE_LIMIT_UPLOAD', 'burst:3/60,sustained:20/3600')),
+    # 建立分塊上傳 (前端重試時可能重複建立，與上傳分開計算)
+    "upload_init": parse_limits(os.getenv('RATE_LIMIT_UPLOAD_INIT', 'burst:10/60,sustained:100/3600')),
+    "upload_chunk": parse_limits(os.getenv('RATE_LIMIT_UPLOAD_CHUNK', 'burst:120/60,sustained:3000/3600')),
+    "auth": parse_limits(os.getenv('RATE_LIMIT_AUTH', 'burst:20/60,sustained:200/3600'))
+}
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))  # 使用者快取上限
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))  # 使用者快取有效時間 (秒)
 
-# 處理 Render.com 的 DATABASE_URL 格式
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+TOKEN_VERSION_CACHE_TTL = int(os.getenv('TOKEN_VERSION_CACHE_TTL', '30'))  # token 版本快取有效時間 (秒)
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', '15'))  # 管理統計快照有效時間 (秒)
+USAGE_CACHE_TTL = int(os.getenv('USAGE_CACHE_TTL', '30'))  # 今日使用次數快取有效時間 (秒)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # 設定後 /metrics 需帶 Authorization: Bearer <METRICS_TOKEN>
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 快取層 (CACHE_BACKEND=mmap / redis 時由所有 worker 共用，見 sharedcache.py)
+shared_cache = SharedCache(create_cache_backend())
+# 使用者快取 (email -> UserSnapshot；共用後端以 JSON 保存，讀回時還原為 UserSnapshot)
+user_cache = shared_cache.namespace("user", USER_CACHE_TTL, USER_CACHE_SIZE, decode=lambda data: UserSnapshot(**data))
+# token 版本快取 (user_id -> version)，用於撤銷舊 token
+token_version_cache = shared_cache.namespace("token_version", TOKEN_VERSION_CACHE_TTL, USER_CACHE_SIZE)
+# 今日使用次數 ("user_id:日期" -> 次數)，扣除或退回額度時失效
+usage_cache = shared_cache.namespace("usage", USAGE_CACHE_TTL, USER_CACHE_SIZE)
+# 管理統計快照 (多個管理後台共用)
+stats_cache = shared_cache.namespace("stats", STATS_CACHE_TTL, 16)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
 Base.metadata.create_all(bind=engine)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
-app = FastAPI()
+# 背景工作佇列 (AI 處理不佔用請求)
+job_queue = create_job_queue(SessionLocal)
+# AI 推論行程池 (CPU 密集工作不佔用事件迴圈)
+inference_runner = InferenceRunner()
+# bcrypt 雜湊執行緒池 (登入尖峰不佔用請求 worker)
+password_hasher = PasswordHasher()
+# 請求速率限制 (在讀取請求內容與查詢資料庫之前拒絕)
+rate_limiter = RateLimiter(RATE_LIMIT_RULES)
+# 背景排程 (多個 worker 中只有 leader 執行)
+scheduler = Scheduler(create_leader_lock(engine))
+# 使用者檔案儲存 (本機目錄或 S3 相容物件儲存，見 storage.py)
+storage = create_storage(production=DB_ENV == "production")
+# 過期檔案批次清理與儲存後端對帳
+sweeper = Sweeper(storage)
+# 健康檢查：資料庫 ping 快取與背景取樣的系統指標
+readiness = ReadinessCheck(engine)
+health_sampler = HealthSampler()
+
+def memory_usage():
+    memory = psutil.virtual_memory()
+    return {
+        "percent": memory.percent,
+        "available_mb": memory.available // 1024 // 1024,
+        "total_mb": memory.total // 1024 // 1024
+    }
+
+def user_files_usage():
+    """儲存後端與磁碟使用量；檔案數與總大小讀取 user_storage 合計列 (各 worker 不必走訪整個 user_files)"""
+    db = SessionLocal()
+    try:
+        return {**storage.usage(), **get_total_storage(db)}
+    finally:
+        db.close()
+
+health_sampler.add_probe("memory_usage", memory_usage)
+health_sampler.add_probe("user_files", user_files_usage)
+health_sampler.add_probe("db_pool", lambda: pool_stats(engine))
+health_sampler.add_probe("job_queue", lambda: {"depth": job_queue.depth()})
+health_sampler.add_probe("database", readiness.check)
+
+# Prometheus 指標 (/metrics)
+UPLOAD_BYTES = Histogram(
+    "upload_bytes", "上傳大小 (位元組)", ("service", "mode"), buckets=SIZE_BUCKETS)
+UPLOAD_DURATION = Histogram(
+    "upload_duration_seconds", "接收上傳內容的時間 (秒)", ("service", "mode"))
+PASSWORD_HASH_WAIT = Histogram(
+    "password_hash_wait_seconds", "bcrypt 工作在執行緒池排隊的時間 (秒)")
+password_hasher.on_wait = PASSWORD_HASH_WAIT.observe
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "等待可用資料庫連線的時間 (秒)")
+pool_monitor.on_wait = DB_POOL_WAIT.observe
+
+CACHES = shared_cache.namespaces
+CallbackMetric("cache_hits_total", "快取命中次數",
+               lambda: {(name, ): cache.hits for name, cache in CACHES.items()}, ("cache",), type="counter")
+CallbackMetric("cache_misses_total", "快取未命中次數",
+               lambda: {(name, ): cache.misses for name, cache in CACHES.items()}, ("cache",), type="counter")
+CallbackMetric("cache_hit_ratio", "快取命中率",
+               lambda: {(name, ): cache.stats()["hit_ratio"] for name, cache in CACHES.items()}, ("cache",))
+CallbackMetric("cache_entries", "快取項目數 (mmap 為共用記憶體中的項目數)",
+               lambda: {(name, ): count for name, count in shared_cache.entry_counts().items()}, ("cache",))
+# 佇列深度取自背景取樣結果，抓取指標時不查詢資料庫
+CallbackMetric("job_queue_depth", "等待處理的背景工作數",
+               lambda: health_sampler.snapshot.get("job_queue", {}).get("depth"))
+CallbackMetric("password_hash_in_flight", "bcrypt 執行緒池中的工作數",
+               lambda: {("queued", ): password_hasher.queued, ("running", ): password_hasher.running}, ("state",))
+CallbackMetric("password_hash_rejected_total", "bcrypt 執行緒池滿載而拒絕的請求數",
+               lambda: password_hasher.rejected, type="counter")
+CallbackMetric("rate_limit_rejected_total", "因速率限制拒絕的請求數",
+               lambda: rate_limiter.rejected, type="counter")
+CallbackMetric("log_records_dropped_total", "日誌佇列已滿而丟棄的記錄數",
+               dropped_records, type="counter")
+CallbackMetric("db_pool_checked_out", "已借出的資料庫連線數",
+               lambda: pool_stats(engine).get("checkedout"))
+CallbackMetric("db_pool_timeouts_total", "等待資料庫連線逾時次數",
+               lambda: pool_monitor.timeouts, type="counter")
+CallbackMetric("file_sweep_files_per_second", "最近一次檔案清理的刪除速度 (files/sec)",
+               lambda: {(kind, ): report["files_per_sec"] for kind, report in sweeper.last_reports.items()}, ("kind",))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_queue.start()
+    scheduler.start()
+    health_sampler.start()
+    yield
+    health_sampler.stop()
+    scheduler.stop()
+    job_queue.stop()
+    readiness.shutdown()
+    inference_runner.shutdown()
+    password_hasher.shutdown()
+    shared_cache.close()
+    storage.close()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # 動態設定 CORS
 def get_cors_origins():
@@ -63,6 +239,21 @@ cors_origins = [
     "*"                               # Allow all origins in development
 ]
 
+# 讀取為主的 JSON 端點：弱 ETag 與 304 (僅瀏覽器私有快取，每次向伺服器確認)
+HTTP_CACHE_POLICIES = {
+    path: PRIVATE_REVALIDATE for path in (
+        "/api/me",
+        "/api/usage-status",
+        "/api/user/files",
+        "/api/admin/user-count",
+        "/api/admin/user-total",
+        "/api/admin/usage-statistics",
+        "/api/admin/daily-usage-summary",
+        "/api/admin/database-stats",
+    )
+}
+# 最內層：只緩衝端點產生的 JSON，CORS 等標頭由外層加上
+app.add_middleware(ETagMiddleware, policies=HTTP_CACHE_POLICIES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
@@ -72,6 +263,10 @@ app.add_middleware(
     expose_headers=["*"],
     max_age=86400,  # Cache preflight for 24 hours
 )
+# 記錄所有請求 (包含 CORS 預檢與錯誤回應)
+app.add_middleware(MetricsMiddleware)
+# 最外層：request id 供同一請求內的日誌關聯
+app.add_middleware(RequestIdMiddleware)
 
 def get_db():
     db = SessionLocal()
@@ -80,110 +275,221 @@ def get_db():
     finally:
         db.close()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict):
     # 加上過期時間 (24小時)
     expire = datetime.utcnow() + timedelta(hours=24)
     to_encode = data.copy()
     to_encode.update({"exp": expire})
     token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    print(f"[DEBUG] Created token for {data.get('sub', 'unknown')}: {token[:20]}...")
+    logger.debug("已簽發 token", extra={"user_id": data.get('uid'), "role": data.get('role')})
     return token
 
 def decode_access_token(token: str):
-    print(f"[DEBUG] decode_access_token called with token: {token[:20]}...")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"[DEBUG] Token decoded successfully: {payload}")
-        return payload
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError:
-        print("[DEBUG] Token expired")
+        logger.debug("token 已過期")
         raise HTTPException(status_code=401, detail='Token 已過期')
     except JWTError as e:
-        print(f"[DEBUG] JWT decode error: {str(e)}")
+        logger.debug("token 無效: %s", e)
         raise HTTPException(status_code=401, detail='Token 無效')
 
-def cleanup_cache():
-    """清理過期的快取項目（5分鐘過期）"""
-    current_time = datetime.utcnow()
-    expired_keys = []
-    
-    for email, timestamp in cache_timestamps.items():
-        if (current_time - timestamp).total_seconds() > 300:  # 5分鐘
-            expired_keys.append(email)
-    
-    for key in expired_keys:
-        user_cache.pop(key, None)
-        cache_timestamps.pop(key, None)
+@dataclass(frozen=True)
+class UserSnapshot:
+    """快取用的不可變使用者資料 (不持有 ORM session)"""
+    id: int
+    email: str
+    is_admin: bool
+    created_at: datetime = None
+
+    @classmethod
+    def from_user(cls, user: User):
+        return cls(id=user.id, email=user.email, is_admin=bool(user.is_admin), created_at=user.created_at)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    print(f"[DEBUG] get_current_user called with token: {token[:20]}...")
+def invalidate_user(email: str):
+    """使用者資料變更時使快取失效"""
+    user_cache.delete(email)
+
+def revoke_user_tokens(user: User, db: Session):
+    """遞增 token 版本並 commit，使該使用者所有既有 token 失效"""
+    bump_token_version(db, user.id)
+    db.commit()
+    token_version_cache.delete(user.id)
+    invalidate_user(user.email)
+
+def create_user_token(user: User, db: Session):
+    """產生帶有使用者 id、角色與 token 版本的 access token"""
+    return create_access_token({
+        "sub": user.email,
+        "uid": user.id,
+        "role": "admin" if user.is_admin else "user",
+        "ver": get_token_version(db, user.id)
+    })
+
+async def check_token_version(payload: dict, db: AsyncSession):
+    """檢查 token 版本是否仍有效 (經由快取，未命中時才查詢資料庫)"""
+    user_id = payload.get('uid')
+    if user_id is None:
+        return  # 舊格式 token
+    version = await token_version_cache.aget(user_id)
+    if version is None:
+        version = await db.run_sync(get_token_version, user_id)
+        await token_version_cache.aset(user_id, version)
+    if payload.get('ver') != version:
+        raise HTTPException(status_code=401, detail='Token 已失效，請重新登入')
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """驗證 token 並回傳使用者快照 (本機快取命中時不借出資料庫連線，也不經過執行緒池；需查詢 redis 時於執行緒池進行)"""
     try:
         payload = decode_access_token(token)
-        print(f"[DEBUG] Token decoded successfully, payload: {payload}")
         email = payload.get('sub')
         if not email:
-            print("[DEBUG] No email found in token payload")
+            logger.debug("token 缺少 sub")
             raise HTTPException(status_code=401, detail='Token 格式錯誤')
-        
-        print(f"[DEBUG] Looking for user with email: {email}")
-        # 定期清理快取
-        cleanup_cache()
+        await check_token_version(payload, db)
         
         # 檢查快取
-        if email in user_cache:
-            print(f"[DEBUG] User found in cache: {email}")
-            return user_cache[email]
+        cached_user = await user_cache.aget(email)
+        if cached_user is not None:
+            logger.debug("使用者快取命中", extra={"user_id": cached_user.id})
+            return cached_user
         
-        user = db.query(User).filter_by(email=email).first()
+        user = (await db.execute(select(User).filter_by(email=email))).scalars().first()
         if not user:
-            print(f"[DEBUG] User not found in database: {email}")
+            logger.info("token 對應的使用者不存在", extra={"user_id": payload.get('uid')})
             raise HTTPException(status_code=401, detail='使用者不存在')
         
-        print(f"[DEBUG] User found in database: {email}, is_admin: {user.is_admin}")
-        # 存入快取（5分鐘過期）
-        user_cache[email] = user
-        cache_timestamps[email] = datetime.utcnow()
-        return user
+        logger.debug("使用者自資料庫載入", extra={"user_id": user.id})
+        # 存入快取 (不可變快照)
+        snapshot = UserSnapshot.from_user(user)
+        await user_cache.aset(email, snapshot)
+        return snapshot
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[DEBUG] Unexpected error in get_current_user: {str(e)}")
+        logger.exception("驗證使用者時發生未預期的錯誤")
         raise HTTPException(status_code=401, detail=f'驗證失敗: {str(e)}')
 
+async def require_admin(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """管理員權限檢查：以 token 內簽章的使用者 id 與角色授權，不查詢使用者資料表"""
+    payload = decode_access_token(token)
+    email = payload.get('sub')
+    if not email:
+        raise HTTPException(status_code=401, detail='Token 格式錯誤')
+    
+    if 'uid' not in payload or 'role' not in payload:
+        # 舊格式 token，回退為查詢使用者
+        user = await get_current_user(token, db)
+        if not user.is_admin:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
+        return user
+    
+    await check_token_version(payload, db)
+    if payload['role'] != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
+    return UserSnapshot(id=payload['uid'], email=email, is_admin=True)
+
+def peek_token_claims(request: Request) -> dict:
+    """讀取 Authorization 標頭中 token 的 claims，無效時回傳空 dict (不查詢資料庫)"""
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return {}
+    try:
+        return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return {}
+
+def token_version_current(claims: dict) -> bool:
+    """token 版本是否仍有效 (經由快取，未命中時查詢資料庫；阻塞呼叫，供同步 dependency 使用)"""
+    user_id = claims.get('uid')
+    if user_id is None:
+        return False
+    version = token_version_cache.get(user_id)
+    if version is None:
+        db = SessionLocal()
+        try:
+            version = get_token_version(db, user_id)
+        finally:
+            db.close()
+        token_version_cache.set(user_id, version)
+    return claims.get('ver') == version
+
+def rate_limited(endpoint: str):
+    """速率限制 dependency：依使用者 id (由 token 取得) 與來源 IP 計算，超過時回應 429"""
+    def dependency(request: Request, response: Response):
+        if rate_limiter.bypassed(request.headers.get("x-ratelimit-bypass")):
+            return
+        claims = peek_token_claims(request)
+        if claims.get('role') == 'admin' and token_version_current(claims):
+            # 管理員不受限；已降級或撤銷 (token 版本已遞增) 的 token 不適用
+            return
+        identities = [f"ip:{request.client.host if request.client else 'unknown'}"]
+        if claims.get('uid') is not None:
+            identities.append(f"user:{claims['uid']}")
+        result = rate_limiter.hit(endpoint, identities)
+        if result is None:
+            return
+        if not result.allowed:
+            raise HTTPException(status_code=429, detail='請求過於頻繁，請稍後再試', headers=result.headers())
+        response.headers.update(result.headers())
+    return dependency
+
+def usage_cache_key(user_id: int) -> str:
+    return f"{user_id}:{usage_day().isoformat()}"
+
+def invalidate_usage(user_id: int):
+    """使用次數變更 (扣除或退回) 後使快取失效"""
+    usage_cache.delete(usage_cache_key(user_id))
+
 def check_daily_usage_limit(user: User, db: Session):
-    """檢查使用者今日使用次數是否超過限制，管理者不受限"""
+    """檢查使用者今日使用次數是否超過限制，管理者不受限 (僅供接收檔案前提早拒絕，實際扣除見 record_usage)"""
     if user.is_admin:
         return True
-    today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    today_usage = db.query(UsageRecord).filter(
-        UsageRecord.user_id == user.id,
-        UsageRecord.usage_date >= today_start,
-        UsageRecord.usage_date <= today_end
-    ).count()
+    today_usage = usage_cache.get_or_set(usage_cache_key(user.id), lambda: get_daily_usage(db, user.id))
     return today_usage < DAILY_USAGE_LIMIT
 
+async def get_today_usage_async(user_id: int, db: AsyncSession):
+    """今日使用次數 (經由快取；查詢 redis 於執行緒池進行，不阻塞事件迴圈)"""
+    key = usage_cache_key(user_id)
+    today_usage = await usage_cache.aget(key)
+    if today_usage is None:
+        today_usage = await get_daily_usage_async(db, user_id)
+        await usage_cache.aset(key, today_usage)
+    return today_usage
+
+async def check_daily_usage_limit_async(user: UserSnapshot, db: AsyncSession):
+    """check_daily_usage_limit 的非同步版本"""
+    return user.is_admin or await get_today_usage_async(user.id, db) < DAILY_USAGE_LIMIT
+
 def record_usage(user: User, service_type: str, db: Session):
-    """記錄使用者使用服務，管理者不記錄"""
+    """檢查額度並記錄使用者使用服務 (不 commit，與工作建立在同一交易)，超過限制時回傳 False；管理者不記錄"""
     if user.is_admin:
-        return
-    usage_record = UsageRecord(
-        user_id=user.id,
-        service_type=service_type,
-        usage_date=datetime.utcnow()
+        return True
+    return reserve_usage(db, user.id, service_type, DAILY_USAGE_LIMIT)
+
+def storage_quota(user: User):
+    """使用者的儲存空間上限，未設定或管理者時回傳 None (不限制)"""
+    if user.is_admin or STORAGE_QUOTA_BYTES <= 0:
+        return None
+    return STORAGE_QUOTA_BYTES
+
+def storage_quota_exceeded():
+    return HTTPException(
+        status_code=413,
+        detail=f"儲存空間已達上限({STORAGE_QUOTA_BYTES // 1024 // 1024}MB)，請刪除部分檔案後再試"
     )
-    db.add(usage_record)
-    db.commit()
 
-def create_file_record(user: User, file_name: str, file_path: str, file_type: str, file_size: int, db: Session):
-    """創建檔案記錄"""
+def check_storage_quota(user: User, file_size: int, db: Session):
+    """檢查加入 file_size 後是否超過儲存空間上限 (僅讀取合計一列，供保存檔案前提早拒絕，實際扣除見 create_file_record)"""
+    quota = storage_quota(user)
+    return quota is None or get_storage_bytes(db, user.id) + file_size <= quota
+
+def create_file_record(user: User, file_name: str, file_path: str, file_type: str, file_size: int, db: Session, content_hash: str = None):
+    """創建檔案記錄並計入使用者的儲存空間 (同一交易)，超過儲存空間上限時拋出 413"""
+    if not charge_storage(db, user.id, file_type, file_size, storage_quota(user)):
+        # 並發上傳已用完額度；已移入 blobs 的新內容由對帳清除 (見 sweeper.py)
+        db.rollback()
+        raise storage_quota_exceeded()
     expires_at = datetime.utcnow() + timedelta(days=FILE_RETENTION_DAYS)
     file_record = UserFile(
         user_id=user.id,
@@ -191,32 +497,36 @@ def create_file_record(user: User, file_name: str, file_path: str, file_type: st
         file_path=file_path,
         file_type=file_type,
         file_size=file_size,
-        expires_at=expires_at
+        expires_at=expires_at,
+        content_hash=content_hash
     )
     db.add(file_record)
     db.commit()
     return file_record
 
-def cleanup_expired_files(db: Session):
-    """清理過期檔案"""
-    now = datetime.utcnow()
-    expired_files = db.query(UserFile).filter(
-        UserFile.expires_at < now,
-        UserFile.status != 'expired'
-    ).all()
+def cleanup_expired_files(db: Session, batch_size: int = CLEANUP_BATCH_SIZE, max_batches: int = None):
+    """分批清理過期檔案，回傳處理的記錄數 (keyset 分批、每批一次 commit，實體檔案並行刪除，見 sweeper.py)"""
+    return sweeper.sweep_expired(db, batch_size, max_batches).rows
+
+def release_file_storage(file_record: UserFile, db: Session):
+    """釋放檔案記錄引用的儲存物件 (上傳內容與背景工作產出)，由呼叫端 commit"""
+    if file_record.status == 'expired':
+        return  # 過期時已釋放
+    release_storage(db, [(file_record.user_id, file_record.file_type, file_record.file_size)])
+    if file_record.content_hash:
+        release_blob(db, storage, file_record.content_hash)
+    else:
+        storage.delete(file_record.file_path)
     
-    for file_record in expired_files:
-        try:
-            # 刪除實體檔案
-            if os.path.exists(file_record.file_path):
-                os.remove(file_record.file_path)
-            
-            # 更新資料庫狀態
-            file_record.status = 'expired'
-            db.commit()
-            print(f"已刪除過期檔案: {file_record.file_name}")
-        except Exception as e:
-            print(f"刪除檔案失敗 {file_record.file_name}: {e}")
+    job_results = db.query(ProcessingJob.result_path, ProcessingJob.result_hash).filter(
+        ProcessingJob.file_id == file_record.id,
+        ProcessingJob.result_path.isnot(None)
+    ).all()
+    for result_path, result_hash in job_results:
+        if result_hash:
+            release_blob(db, storage, result_hash)
+        else:
+            storage.delete(result_path)
 
 def get_expiring_files(db: Session, hours: int = FILE_EXPIRY_WARNING_HOURS):
     """獲取即將過期的檔案"""
@@ -245,36 +555,77 @@ class ResetPasswordRequest(BaseModel):
     token: str
     password: str
 
-class FileInfo(BaseModel):
-    id: int
+class UploadInitRequest(BaseModel):
     file_name: str
-    file_type: str
     file_size: int
-    status: str
-    created_at: datetime
-    expires_at: datetime
-    analysis_result: str = None
+    content_type: str
+    service_type: str  # 'video_abstract' 或 'ppt_to_video'
+
+# 列表端點可用 fields= 選擇的欄位
+USER_FILE_FIELDS = {
+    "id": UserFile.id,
+    "file_name": UserFile.file_name,
+    "file_type": UserFile.file_type,
+    "file_size": UserFile.file_size,
+    "status": UserFile.status,
+    "created_at": UserFile.created_at,
+    "expires_at": UserFile.expires_at,
+    "analysis_result": UserFile.analysis_result
+}
+USER_FIELDS = {
+    "id": User.id,
+    "email": User.email,
+    "is_admin": User.is_admin,
+    "created_at": User.created_at
+}
 
-@app.post('/api/register')
+def paginated_list(request: Request, response: Response, db: Session, build_query, columns: dict, limit: int = None):
+    """回傳 JSON 陣列 (下一頁 cursor 於 X-Next-Cursor 標頭)，Accept: application/x-ndjson 時改為串流"""
+    names = list(columns)
+    if wants_ndjson(request):
+        return stream_ndjson(SessionLocal, build_query, names, limit)
+    items, next_cursor = fetch_page(build_query(db), names, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+async def paginated_list_async(request: Request, response: Response, db: AsyncSession, build_query, columns: dict, limit: int = None):
+    """paginated_list 的非同步版本 (查詢在事件迴圈上等待，不佔用執行緒池)"""
+    names = list(columns)
+    if wants_ndjson(request):
+        return stream_ndjson(SessionLocal, build_query, names, limit)
+    items, next_cursor = await db.run_sync(lambda session: fetch_page(build_query(session), names, limit))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+@app.post('/api/register', dependencies=[Depends(rate_limited("auth"))])
 def register(req: RegisterRequest, db: Session = Depends(get_db)):
+    # 一般 def 端點：同步 ORM 與等待 bcrypt 都在 Starlette 執行緒池中進行，不阻塞事件迴圈
     if db.query(User).filter_by(email=req.email).first():
         raise HTTPException(status_code=400, detail='Email 已註冊')
-    user = User(email=req.email, hashed_password=get_password_hash(req.password))
+    user = User(email=req.email, hashed_password=password_hasher.hash(req.password))
     db.add(user)
     db.commit()
     return {"msg": "註冊成功"}
 
-@app.post('/api/login')
+@app.post('/api/login', dependencies=[Depends(rate_limited("auth"))])
 def login(req: LoginRequest, db: Session = Depends(get_db)):
-    print(f"[DEBUG] Login attempt for email: {req.email}")
     user = db.query(User).filter_by(email=req.email).first()
-    if not user or not verify_password(req.password, user.hashed_password):
-        print(f"[DEBUG] Login failed for email: {req.email}")
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = password_hasher.verify_and_update(req.password, user.hashed_password)
+    if not valid:
+        logger.info("登入失敗", extra={"email": req.email})
         raise HTTPException(status_code=401, detail='帳號或密碼錯誤')
+    if new_hash:
+        # BCRYPT_ROUNDS 已變更，以新的工作因子重新雜湊
+        user.hashed_password = new_hash
+        db.commit()
     
     # 直接返回用戶信息，避免額外的 API 調用
-    token = create_access_token({"sub": user.email})
-    print(f"[DEBUG] Login successful for email: {req.email}, token: {token[:20]}...")
+    token = create_user_token(user, db)
+    logger.info("登入成功", extra={"user_id": user.id})
     return {
         "access_token": token, 
         "token_type": "bearer",
@@ -285,7 +636,7 @@ def login(req: LoginRequest, db: Session = Depends(get_db)):
     }
 
 # 新增忘記密碼 API
-@app.post('/api/forgot-password')
+@app.post('/api/forgot-password', dependencies=[Depends(rate_limited("auth"))])
 def forgot_password(req: ForgotPasswordRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter_by(email=req.email).first()
     if not user:
@@ -294,292 +645,688 @@ def forgot_password(req: ForgotPasswordRequest, db: Session = Depends(get_db)):
     user.reset_token = reset_token
     db.commit()
     # 寄送 email，開發模式直接回傳 token
-    print(f"[開發模式] 密碼重設 token: {reset_token}")
+    logger.debug("[開發模式] 已產生密碼重設 token", extra={"user_id": user.id})
     return {"detail": "重設信已寄出（開發模式下 token 直接顯示）", "reset_token": reset_token}
 
 # 新增重設密碼 API
-@app.post('/api/reset-password')
+@app.post('/api/reset-password', dependencies=[Depends(rate_limited("auth"))])
 def reset_password(req: ResetPasswordRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter_by(reset_token=req.token).first()
     if not user:
         raise HTTPException(status_code=400, detail='Token 無效')
-    user.hashed_password = get_password_hash(req.password)
+    user.hashed_password = password_hasher.hash(req.password)
     user.reset_token = None
-    db.commit()
+    revoke_user_tokens(user, db)
     return {"msg": "密碼已重設"}
 
 @app.get('/api/me')
-def get_me(current_user: User = Depends(get_current_user)):
-    print(f"[DEBUG] /api/me called successfully for user: {current_user.email}")
+def get_me(request: Request, response: Response, current_user: UserSnapshot = Depends(get_current_user)):
+    etag = weak_etag("me", current_user.email, current_user.is_admin)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response.headers["ETag"] = etag
     return {"email": current_user.email, "is_admin": current_user.is_admin}
 
 @app.get('/api/usage-status')
-def get_usage_status(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_usage_status(
+    request: Request,
+    response: Response,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     """獲取使用者今日使用狀態"""
-    today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
+    today_usage = await get_today_usage_async(current_user.id, db)
+    quota = storage_quota(current_user)
     
-    today_usage = db.query(UsageRecord).filter(
-        UsageRecord.user_id == current_user.id,
-        UsageRecord.usage_date >= today_start,
-        UsageRecord.usage_date <= today_end
-    ).count()
+    # 以今日次數與儲存空間合計列的版本作為 ETag；未變更時回應 304，不查詢各類型用量與序列化
+    storage_version = await get_storage_version_async(db, current_user.id)
+    etag = weak_etag("usage", current_user.id, usage_day(), today_usage, DAILY_USAGE_LIMIT, quota, *storage_version)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        await db.rollback()
+        return cached
+    response.headers["ETag"] = etag
+    
+    storage = await get_user_storage_async(db, current_user.id)
     
     return {
         "today_usage": today_usage,
         "daily_limit": DAILY_USAGE_LIMIT,
-        "remaining": max(0, DAILY_USAGE_LIMIT - today_usage)
+        "remaining": max(0, DAILY_USAGE_LIMIT - today_usage),
+        "storage": {
+            **storage,
+            "quota_bytes": quota,
+            "remaining_bytes": max(0, quota - storage["bytes"]) if quota is not None else None
+        }
     }
     
-@app.post("/api/video-abstract")
+def observe_upload(service: str, mode: str, size: int, started: float):
+    """記錄上傳大小與接收時間"""
+    UPLOAD_BYTES.observe(size, service=service, mode=mode)
+    UPLOAD_DURATION.observe(time.perf_counter() - started, service=service, mode=mode)
+
+def persist_upload(user: UserSnapshot, upload, key: str, job_type: str):
+    """記錄已寫入儲存的內容 (相同內容只保存一份)、創建檔案記錄 (狀態為 processing) 並排入背景工作
+
+    阻塞呼叫，於執行緒池以同步 session 執行：store_blob 與失敗時的清理會存取儲存後端 (物件儲存為網路請求)，
+    排入後使用次數快取失效也可能經過 redis，不能放在 AsyncSession.run_sync (於事件迴圈上執行) 中
+    """
+    db = SessionLocal()
+    try:
+        file_path = store_blob(db, storage, upload.sha256, key, upload.file_size)
+        file_record = create_file_record(
+            user=user,
+            file_name=upload.file_name,
+            file_path=file_path,
+            file_type=job_type,
+            file_size=upload.file_size,
+            db=db,
+            content_hash=upload.sha256
+        )
+        return enqueue_file_job(user, file_record, job_type, db)
+    finally:
+        db.close()
+
+async def accept_upload(request: Request, current_user: UserSnapshot, db: AsyncSession, job_type: str):
+    """串流上傳端點的共用流程 (查詢經由非同步 session，儲存與快取 I/O 於執行緒池，不阻塞事件迴圈)"""
+    # 檢查使用次數限制 (在接收檔案內容之前)
+    if not await check_daily_usage_limit_async(current_user, db):
+        raise HTTPException(status_code=429, detail=f"今日使用次數已達上限({DAILY_USAGE_LIMIT}次)，請明天再試")
+    # 接收前檔案大小未知，至少需要剩餘 1 byte；保存前再以實際大小檢查
+    if not await db.run_sync(lambda session: check_storage_quota(current_user, 1, session)):
+        raise storage_quota_exceeded()
+    await db.rollback()  # 接收檔案期間不持有連線
+    
+    # 1. 串流接收並暫存檔案 (檢查類型、超過大小立即中止、計算雜湊)
+    started = time.perf_counter()
+    upload = await ingest_upload(request, files_dir=storage.spool_dir, **UPLOAD_RULES[job_type])
+    observe_upload(job_type, "stream", upload.file_size, started)
+    if not await db.run_sync(lambda session: check_storage_quota(current_user, upload.file_size, session)):
+        os.remove(upload.file_path)
+        raise storage_quota_exceeded()
+    await db.rollback()
+    
+    # 2. 寫入儲存後端 (物件儲存以 multipart upload 上傳，期間不持有連線)
+    key = await anyio.to_thread.run_sync(stage_blob, storage, upload.sha256, upload.file_path)
+    
+    # 3. 保存檔案記錄並排入背景工作，立即回傳 job id
+    return await anyio.to_thread.run_sync(persist_upload, current_user, upload, key, job_type)
+
+@app.post("/api/video-abstract", status_code=202, dependencies=[Depends(rate_limited("upload"))])
 async def video_abstract(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # 檢查使用次數限制
+    return await accept_upload(request, current_user, db, "video_abstract")
+
+
+@app.post("/api/ppt-to-video", status_code=202, dependencies=[Depends(rate_limited("upload"))])
+async def ppt_to_video(
+    request: Request,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await accept_upload(request, current_user, db, "ppt_to_video")
+
+def get_upload_session(upload_id: str, current_user: UserSnapshot, db: Session, for_update: bool = False):
+    """取得使用者的分塊上傳工作階段"""
+    query = db.query(UploadSession).filter(
+        UploadSession.id == upload_id,
+        UploadSession.user_id == current_user.id
+    )
+    if for_update:
+        query = query.with_for_update()
+    session = query.first()
+    if not session or session.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=404, detail='上傳不存在或已過期')
+    return session
+
+def upload_session_status(session: UploadSession):
+    """分塊上傳進度"""
+    ranges = json.loads(session.received_ranges or '[]')
+    received = received_bytes(ranges)
+    return {
+        "upload_id": session.id,
+        "file_name": session.file_name,
+        "total_size": session.total_size,
+        "received_ranges": ranges,
+        "received_bytes": received,
+        "complete": received == session.total_size,
+        "status": session.status,
+        "job_id": session.job_id,
+        "expires_at": session.expires_at.isoformat()
+    }
+
+@app.post('/api/uploads', status_code=201, dependencies=[Depends(rate_limited("upload_init"))])
+def initiate_upload(req: UploadInitRequest, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
+    """建立可續傳的分塊上傳，回傳 upload id"""
+    rules = UPLOAD_RULES.get(req.service_type)
+    if not rules:
+        raise HTTPException(status_code=400, detail='不支援的服務類型')
     if not check_daily_usage_limit(current_user, db):
         raise HTTPException(status_code=429, detail=f"今日使用次數已達上限({DAILY_USAGE_LIMIT}次)，請明天再試")
+    if not rules["accept"](req.content_type):
+        raise HTTPException(status_code=400, detail=rules["type_error"])
+    if req.file_size <= 0 or req.file_size > rules["max_size"]:
+        raise HTTPException(status_code=400, detail=rules["size_error"])
+    if not check_storage_quota(current_user, req.file_size, db):
+        raise storage_quota_exceeded()
     
-    # 1. 檢查檔案類型
-    if not file.content_type or not file.content_type.startswith("video/"):
-        raise HTTPException(status_code=400, detail="只允許上傳影片檔案")
-    
-    # 2. 檢查檔案大小
-    file.file.seek(0, os.SEEK_END)
-    size = file.file.tell()
-    file.file.seek(0)
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail=f"檔案過大，請上傳 {MAX_FILE_SIZE // 1024 // 1024}MB 以下的影片")
-    
-    # 3. 創建檔案目錄
-    files_dir = os.path.join(os.getcwd(), "user_files")
-    os.makedirs(files_dir, exist_ok=True)
-    
-    # 4. 生成唯一檔案名並保存
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(files_dir, unique_filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # 5. 創建檔案記錄
-    file_record = create_file_record(
-        user=current_user,
-        file_name=file.filename,
-        file_path=file_path,
-        file_type="video_abstract",
-        file_size=size,
-        db=db
+    upload_id = str(uuid.uuid4())
+    # 分塊寫入本機暫存檔 (同一上傳的分塊需送到同一節點，或將 spool 目錄放在共用磁碟)
+    temp_path = os.path.join(storage.spool_dir, "uploads", f"{upload_id}.part")
+    preallocate_file(temp_path, req.file_size)
+    
+    session = UploadSession(
+        id=upload_id,
+        user_id=current_user.id,
+        file_name=req.file_name,
+        content_type=req.content_type,
+        service_type=req.service_type,
+        total_size=req.file_size,
+        temp_path=temp_path,
+        received_ranges='[]',
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_HOURS)
     )
+    db.add(session)
+    db.commit()
     
-    try:
-        # 6. 呼叫 AI model 分析（這裡用假資料）
-        # result = your_ai_model(file_path)
-        result = f"這是影片 {file.filename} 的 AI 摘要。影片內容分析完成，包含關鍵場景、重要對話和主要情節。"
-        
-        # 7. 更新檔案記錄
-        file_record.analysis_result = result
-        file_record.status = 'completed'
-        db.commit()
-        
-        # 8. 記錄使用次數
-        record_usage(current_user, "video_abstract", db)
-        
-        return {
-            "result": result,
-            "file_id": file_record.id,
-            "expires_at": file_record.expires_at.isoformat(),
-            "retention_days": FILE_RETENTION_DAYS
-        }
-    except Exception as e:
-        # 如果處理失敗，清理檔案
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        db.delete(file_record)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f'處理失敗: {str(e)}')
+    result = upload_session_status(session)
+    result["chunk_size"] = UPLOAD_CHUNK_SIZE
+    return result
 
-
-@app.post("/api/ppt-to-video")
-async def ppt_to_video(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@app.put('/api/uploads/{upload_id}', dependencies=[Depends(rate_limited("upload_chunk"))])
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # 檢查使用次數限制
+    """上傳一個分塊 (請求內容為原始位元組)，直接寫入預配置檔案的 offset 位置"""
+    session = await db.run_sync(lambda sync_db: get_upload_session(upload_id, current_user, sync_db))
+    if session.status != 'uploading':
+        raise HTTPException(status_code=409, detail='上傳已完成，不可再寫入分塊')
+    if offset < 0 or offset >= session.total_size:
+        raise HTTPException(status_code=400, detail='offset 超出檔案範圍')
+    temp_path, total_size, service_type = session.temp_path, session.total_size, session.service_type
+    await db.rollback()  # 接收分塊期間不持有交易
+    
+    started = time.perf_counter()
+    written = await write_chunk(request, temp_path, offset, total_size)
+    observe_upload(service_type, "chunk", written, started)
+    
+    def record_chunk(sync_db: Session):
+        session = get_upload_session(upload_id, current_user, sync_db, for_update=True)
+        if session.status != 'uploading':
+            raise HTTPException(status_code=409, detail='上傳已完成，不可再寫入分塊')
+        if written:
+            ranges = merge_ranges(json.loads(session.received_ranges or '[]'), offset, offset + written)
+            session.received_ranges = json.dumps(ranges)
+        sync_db.commit()
+        return upload_session_status(session)
+    return await db.run_sync(record_chunk)
+
+@app.get('/api/uploads/{upload_id}')
+def get_upload_status(upload_id: str, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
+    """查詢已接收的區段，用於中斷後續傳"""
+    return upload_session_status(get_upload_session(upload_id, current_user, db))
+
+@app.post('/api/uploads/{upload_id}/complete', status_code=202)
+def complete_upload(upload_id: str, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
+    """完成分塊上傳，將組合好的檔案交給既有的處理流程 (重複呼叫時回傳同一工作)"""
+    session = get_upload_session(upload_id, current_user, db)
+    if session.status != 'uploading':
+        return completed_upload_job(session, current_user, db)
+    status_info = upload_session_status(session)
+    if not status_info["complete"]:
+        raise HTTPException(status_code=409, detail=f'檔案尚未上傳完成 ({status_info["received_bytes"]}/{session.total_size} bytes)')
     if not check_daily_usage_limit(current_user, db):
         raise HTTPException(status_code=429, detail=f"今日使用次數已達上限({DAILY_USAGE_LIMIT}次)，請明天再試")
+    if not check_storage_quota(current_user, session.total_size, db):
+        raise storage_quota_exceeded()
     
-    # 1. 檢查檔案類型
-    if not file.content_type or file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="只允許上傳 PDF 檔案")
-    
-    # 2. 檢查檔案大小
-    file.file.seek(0, os.SEEK_END)
-    size = file.file.tell()
-    file.file.seek(0)
-    max_size = 20 * 1024 * 1024  # 20MB for PDF
-    if size > max_size:
-        raise HTTPException(status_code=400, detail="檔案過大，請上傳 20MB 以下的 PDF")
-    
-    # 3. 創建檔案目錄
-    files_dir = os.path.join(os.getcwd(), "user_files")
-    os.makedirs(files_dir, exist_ok=True)
-    
-    # 4. 保存 PDF 檔案
-    pdf_filename = f"{uuid.uuid4()}.pdf"
-    pdf_path = os.path.join(files_dir, pdf_filename)
-    
-    with open(pdf_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # 5. 創建檔案記錄
-    file_record = create_file_record(
-        user=current_user,
-        file_name=file.filename,
-        file_path=pdf_path,
-        file_type="ppt_to_video",
-        file_size=size,
-        db=db
+    # 以條件式 UPDATE 取得完成權，並發的 complete 只有一個會通過
+    claimed = db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.status == 'uploading')
+        .values(status='completing')
     )
+    db.commit()
+    if claimed.rowcount != 1:
+        db.refresh(session)
+        return completed_upload_job(session, current_user, db)
     
+    # 計算內容雜湊並寫入內容定址儲存 (上傳期間不持有交易)
+    file_name, service_type, file_size = session.file_name, session.service_type, session.total_size
+    temp_path = session.temp_path
+    key = file_record = None
     try:
-        # 6. AI model 生成影片（這裡用假影片）
-        video_filename = f"{uuid.uuid4()}.mp4"
-        video_path = os.path.join(files_dir, video_filename)
+        content_hash = hash_file(temp_path)
+        db.rollback()
+        # 移入儲存的是暫存檔的硬連結，排入工作前暫存檔都保留，失敗時可直接重試
+        key = stage_blob(storage, content_hash, link_file(temp_path), extension=os.path.splitext(file_name)[1])
+        file_path = store_blob(db, storage, content_hash, key, file_size)
+        session.status = 'completed'
         
-        # 這裡應該呼叫你的 AI model，並產生 video_path
-        # 這裡用一個現有的 mp4 檔案作為 demo
-        if os.path.exists("demo.mp4"):
-            shutil.copyfile("demo.mp4", video_path)
+        file_record = create_file_record(
+            user=current_user,
+            file_name=file_name,
+            file_path=file_path,
+            file_type=service_type,
+            file_size=file_size,
+            db=db,
+            content_hash=content_hash
+        )
+        # 工作與 job_id 在同一交易寫入，之後的重複呼叫可取得同一工作
+        session.job_id = str(uuid.uuid4())
+        result = enqueue_file_job(current_user, file_record, service_type, db, job_id=session.job_id)
+    except Exception:
+        reopen_upload(upload_id, key, file_record, db)
+        raise
+    os.remove(temp_path)
+    return result
+
+def reopen_upload(upload_id: str, key: str, file_record: UserFile, db: Session):
+    """完成失敗時恢復為可重試的上傳：釋放已建立的檔案記錄 (儲存空間與內容引用) 與未被引用的新內容，狀態改回 uploading"""
+    db.rollback()
+    session = db.get(UploadSession, upload_id)
+    if session is None or session.job_id:
+        return  # 工作已排入 (例外發生在排入之後)，重複呼叫會回傳該工作
+    if file_record is not None and db.get(UserFile, file_record.id) is not None:
+        discard_file_record(file_record, db)
+    if key and storage.local and not db.query(StoredBlob.sha256).filter(StoredBlob.file_path == key).first():
+        # 新內容的引用已隨交易回復；物件仍是本次移入的連結 (並發上傳相同內容時會被取代) 才刪除，
+        # 其餘情況 (物件儲存) 由對帳清除
+        try:
+            if os.path.samefile(storage.path(key), session.temp_path):
+                storage.delete(key)
+        except (OSError, ValueError):
+            pass
+    try:
+        if os.path.exists(session.temp_path):
+            detach_file(session.temp_path)  # 不再與已移入儲存的內容共用，之後的分塊寫入不影響其他記錄
         else:
-            # 創建一個假的影片檔案
-            with open(video_path, "wb") as f:
-                f.write(b"fake video content")
+            preallocate_file(session.temp_path, session.total_size)
+            session.received_ranges = '[]'
+    except OSError as e:
+        logger.warning("恢復分塊上傳暫存檔失敗 %s: %s", upload_id, e)
+        session.received_ranges = '[]'
+    session.status = 'uploading'
+    session.job_id = None
+    db.commit()
+
+def completed_upload_job(session: UploadSession, current_user: UserSnapshot, db: Session):
+    """已完成 (或正在完成) 的分塊上傳：回傳既有工作的資訊"""
+    if session.job_id:
+        job, file_record = get_user_job(session.job_id, current_user, db)
+        return job_response(job, file_record)
+    if session.status == 'completing':
+        raise HTTPException(status_code=409, detail='上傳正在完成中，請稍後再試')
+    raise HTTPException(status_code=404, detail='上傳不存在或已過期')
+
+def cleanup_stale_uploads(db: Session, batch_size: int = CLEANUP_BATCH_SIZE, max_batches: int = None):
+    """分批清理過期未完成的分塊上傳，回傳處理的數量"""
+    now = datetime.utcnow()
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        stale_sessions = db.query(UploadSession.id, UploadSession.temp_path).filter(
+            UploadSession.expires_at < now
+        ).limit(batch_size).all()
+        if not stale_sessions:
+            break
+        for session in stale_sessions:
+            try:
+                if os.path.exists(session.temp_path):
+                    os.remove(session.temp_path)
+            except OSError as e:
+                logger.warning("清理分塊上傳失敗 %s: %s", session.id, e)
+        db.execute(delete(UploadSession).where(UploadSession.id.in_([session.id for session in stale_sessions])))
+        db.commit()
+        processed += len(stale_sessions)
+        batches += 1
+    return processed
+
+def run_scheduled_cleanup():
+    """排程工作：清理過期檔案與未完成的分塊上傳"""
+    with log_context(f"cleanup-{uuid.uuid4().hex[:12]}"):
+        db = SessionLocal()
+        try:
+            return cleanup_expired_files(db, max_batches=CLEANUP_MAX_BATCHES) + \
+                cleanup_stale_uploads(db, max_batches=CLEANUP_MAX_BATCHES)
+        finally:
+            db.close()
+
+def run_scheduled_reconcile():
+    """排程工作：對帳 user_files 與資料庫 (遺失實體檔案的記錄、沒有記錄引用的檔案)"""
+    with log_context(f"reconcile-{uuid.uuid4().hex[:12]}"):
+        db = SessionLocal()
+        try:
+            report = sweeper.reconcile(db, CLEANUP_BATCH_SIZE)
+            return report.missing_rows + report.orphan_files
+        finally:
+            db.close()
+
+scheduler.add_task("cleanup", CLEANUP_INTERVAL_SECONDS, run_scheduled_cleanup)
+scheduler.add_task("reconcile", RECONCILE_INTERVAL_SECONDS, run_scheduled_reconcile)
+
+def discard_file_record(file_record: UserFile, db: Session):
+    """捨棄尚未排入處理的檔案記錄與檔案"""
+    db.rollback()
+    release_file_storage(file_record, db)
+    db.delete(file_record)
+    db.commit()
+
+def enqueue_file_job(user: User, file_record: UserFile, job_type: str, db: Session, job_id: str = None):
+    """扣除使用次數並將已保存的檔案排入背景處理 (同一交易)，回傳工作資訊"""
+    try:
+        reserved = record_usage(user, job_type, db)
+        if reserved:
+            job = job_queue.enqueue(db, user_id=user.id, file_id=file_record.id, job_type=job_type, job_id=job_id)
+    except Exception as e:
+        # 排入失敗，清理檔案
+        discard_file_record(file_record, db)
+        raise HTTPException(status_code=500, detail=f'處理失敗: {str(e)}')
+    if not reserved:
+        # 並發請求已用完今日額度
+        logger.info("今日額度已用完，捨棄上傳", extra={"user_id": user.id, "job_type": job_type})
+        discard_file_record(file_record, db)
+        raise HTTPException(status_code=429, detail=f"今日使用次數已達上限({DAILY_USAGE_LIMIT}次)，請明天再試")
+    if not user.is_admin:
+        invalidate_usage(user.id)
+    
+    logger.info("已排入背景工作", extra={
+        "user_id": user.id, "job_id": job.id, "job_type": job_type,
+        "file_id": file_record.id, "file_size": file_record.file_size
+    })
+    return job_response(job, file_record)
+
+def job_response(job: ProcessingJob, file_record: UserFile):
+    """排入工作後回傳給用戶端的資訊"""
+    return {
+        "job_id": job.id,
+        "file_id": file_record.id,
+        "status": file_record.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result",
+        "expires_at": file_record.expires_at.isoformat(),
+        "retention_days": FILE_RETENTION_DAYS
+    }
+
+def fail_file_job(user: User, job: ProcessingJob, file_record: UserFile, db: Session, temp_paths: list = ()):
+    """工作失敗時退回使用次數、釋放檔案並將記錄標記為過期"""
+    db.rollback()
+    for path in temp_paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+    if file_record.status != 'expired' and not user.is_admin:
+        refund_usage(db, user.id, job.job_type, job.created_at.date())
+    release_file_storage(file_record, db)
+    file_record.status = 'expired'
+    db.commit()
+    if not user.is_admin:
+        invalidate_usage(user.id)
+
+def find_reusable_result(file_record: UserFile, db: Session):
+    """尋找相同內容、相同服務且已完成的結果 (analysis_result, result_hash)"""
+    if not file_record.content_hash:
+        return None
+    return db.query(UserFile.analysis_result, ProcessingJob.result_hash).join(
+        ProcessingJob, ProcessingJob.file_id == UserFile.id
+    ).filter(
+        UserFile.content_hash == file_record.content_hash,
+        UserFile.file_type == file_record.file_type,
+        UserFile.status == 'completed',
+        UserFile.id != file_record.id,
+        ProcessingJob.error.is_(None)
+    ).order_by(UserFile.created_at.desc()).first()
+
+def process_video_abstract_job(job: ProcessingJob, db: Session):
+    """背景執行影片摘要"""
+    file_record = db.get(UserFile, job.file_id)
+    user = db.get(User, job.user_id)
+    try:
+        reusable = find_reusable_result(file_record, db)
+        if reusable and reusable.analysis_result:
+            # 相同內容已分析過，直接沿用結果
+            result = reusable.analysis_result
+        else:
+            # 於推論行程池執行 AI model 分析 (物件儲存時先下載到本機暫存檔)
+            with storage.local_path(file_record.file_path) as source_path:
+                result = inference_runner.run(summarize_video, source_path, file_record.file_name)
         
-        # 7. 更新檔案記錄
-        file_record.analysis_result = f"已生成影片: {video_filename}"
+        # 更新檔案記錄
+        file_record.analysis_result = result
         file_record.status = 'completed'
         db.commit()
+    except Exception:
+        fail_file_job(user, job, file_record, db)
+        raise
+
+def process_ppt_to_video_job(job: ProcessingJob, db: Session):
+    """背景執行 PDF 轉影片"""
+    file_record = db.get(UserFile, job.file_id)
+    user = db.get(User, job.user_id)
+    video_path = None
+    try:
+        reusable = find_reusable_result(file_record, db)
+        result_path = acquire_blob(db, reusable.result_hash) if reusable and reusable.result_hash else None
+        if result_path and storage.exists(result_path):
+            # 相同內容已生成過影片，直接引用既有結果
+            job.result_path = result_path
+            job.result_hash = reusable.result_hash
+            file_record.analysis_result = reusable.analysis_result
+        else:
+            if result_path:
+                db.rollback()
+            video_path = os.path.join(storage.spool_dir, f"{uuid.uuid4()}.mp4")
+            
+            # 於推論行程池執行 AI model 生成影片
+            with storage.local_path(file_record.file_path) as source_path:
+                inference_runner.run(render_presentation_video, source_path, video_path)
+            
+            # 存入內容定址儲存
+            result_hash = hash_file(video_path)
+            video_size = os.path.getsize(video_path)
+            key = stage_blob(storage, result_hash, video_path)
+            job.result_path = store_blob(db, storage, result_hash, key, video_size)
+            job.result_hash = result_hash
+            file_record.analysis_result = f"已生成影片: {os.path.basename(job.result_path)}"
         
-        # 8. 記錄使用次數
-        record_usage(current_user, "ppt_to_video", db)
-        
-        # 9. 回傳影片檔案
-        return FileResponse(
-            video_path, 
-            media_type="video/mp4", 
+        # 更新檔案記錄
+        file_record.status = 'completed'
+        db.commit()
+    except Exception:
+        fail_file_job(user, job, file_record, db, temp_paths=[video_path])
+        raise
+
+job_queue.register("video_abstract", process_video_abstract_job)
+job_queue.register("ppt_to_video", process_ppt_to_video_job)
+
+def get_user_job(job_id: str, current_user: UserSnapshot, db: Session):
+    """取得工作與對應檔案記錄 (僅限擁有者或管理員)"""
+    job = db.get(ProcessingJob, job_id)
+    if not job or (job.user_id != current_user.id and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail='工作不存在')
+    file_record = db.get(UserFile, job.file_id)
+    if not file_record:
+        raise HTTPException(status_code=404, detail='檔案不存在')
+    return job, file_record
+
+@app.get('/api/jobs/{job_id}')
+def get_job_status(job_id: str, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
+    """查詢背景工作狀態，狀態沿用檔案記錄的 processing / completed / expired"""
+    job, file_record = get_user_job(job_id, current_user, db)
+    return {
+        "job_id": job.id,
+        "file_id": file_record.id,
+        "job_type": job.job_type,
+        "status": file_record.status,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result_url": f"/api/jobs/{job.id}/result"
+    }
+
+def storage_response(request: Request, key: str, media_type: str, filename: str, content_hash: str = None,
+                     inline: bool = False, headers: dict = None):
+    """回傳儲存物件 (Range/If-Range、ETag/If-None-Match，見 downloads.py)；物件儲存可設定為導向預簽網址 (阻塞呼叫)"""
+    if not storage.local and STORAGE_REDIRECT_DOWNLOADS:
+        return RedirectResponse(storage.presigned_url(key, filename, media_type), status_code=307, headers=headers)
+    info = storage.stat(key)
+    if info is None:
+        raise HTTPException(status_code=410, detail='檔案已過期')
+    # 內容定址的物件以內容雜湊作為強 ETag
+    etag = f'"{content_hash or info.etag}"'
+    return serve_object(request, storage, key, info.size, etag, media_type, filename, inline, headers)
+
+@app.get('/api/jobs/{job_id}/result')
+def get_job_result(
+    job_id: str,
+    request: Request,
+    presign: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """下載背景工作結果；presign=1 時改為回傳有時效的下載網址 (可直接交給 <video> 或下載連結)"""
+    job, file_record = get_user_job(job_id, current_user, db)
+    if file_record.status == 'processing':
+        raise HTTPException(status_code=409, detail='工作處理中，請稍後再試')
+    if file_record.status != 'completed':
+        raise HTTPException(status_code=410, detail=job.error or '檔案已過期')
+    
+    if job.job_type == "ppt_to_video":
+        if not job.result_path:
+            raise HTTPException(status_code=410, detail='檔案已過期')
+        if presign:
+            url = storage.presigned_url(job.result_path, "ai_presentation.mp4", "video/mp4")
+            if url is None:
+                raise HTTPException(status_code=404, detail='此檔案無法產生下載網址')
+            return {
+                "url": url,
+                "expires_in": STORAGE_PRESIGN_SECONDS,
+                "file_id": file_record.id,
+                "expires_at": file_record.expires_at.isoformat()
+            }
+        return storage_response(
+            request,
+            job.result_path,
+            media_type="video/mp4",
             filename="ai_presentation.mp4",
+            content_hash=job.result_hash,
             headers={
                 "X-File-ID": str(file_record.id),
                 "X-Expires-At": file_record.expires_at.isoformat(),
                 "X-Retention-Days": str(FILE_RETENTION_DAYS)
             }
         )
-    except Exception as e:
-        # 如果處理失敗，清理檔案
-        for path in [pdf_path, video_path]:
-            if os.path.exists(path):
-                os.remove(path)
-        db.delete(file_record)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f'處理失敗: {str(e)}')
+    
+    return {
+        "result": file_record.analysis_result,
+        "file_id": file_record.id,
+        "expires_at": file_record.expires_at.isoformat(),
+        "retention_days": FILE_RETENTION_DAYS
+    }
+
+@app.get(SIGNED_URL_PREFIX + '/{key:path}')
+def download_signed(key: str, expires: int, sig: str, request: Request, filename: str = None):
+    """以預簽網址下載本機儲存的檔案 (不需登入，以簽章與期限驗證；支援 Range)"""
+    # 只提供簽章涵蓋的正規化鍵 (絕對路徑、.. 與未正規化的鍵一律拒絕)
+    key = storage.signed_key(key, expires, sig, filename) if storage.local else None
+    if key is None:
+        raise HTTPException(status_code=403, detail='下載連結無效或已過期')
+    filename = filename or os.path.basename(key)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return storage_response(request, key, media_type, filename)
+
+def stats_snapshot(value) -> tuple:
+    """管理統計快照：(ETag, 可直接輸出的 JSON 內容)；ETag 只在計算快照時由內容產生一次"""
+    content = jsonable_encoder(value)
+    return weak_etag(json.dumps(content, sort_keys=True, separators=(",", ":"))), content
+
+def cached_stats(request: Request, key: str, compute, fresh: bool = False):
+    """回傳快取的管理統計；If-None-Match 與快照的 ETag 相符時回應 304，不查詢也不序列化"""
+    if fresh:
+        snapshot = stats_snapshot(compute())
+        stats_cache.set(key, snapshot)
+    else:
+        snapshot = stats_cache.get_or_set(key, lambda: stats_snapshot(compute()))
+    etag, content = snapshot
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return JSONResponse(content, headers={"ETag": etag})
 
 @app.get('/api/admin/user-count')
-def admin_user_count(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = decode_access_token(token)
-        email = payload.get('sub')
-        user = db.query(User).filter_by(email=email).first()
-        if not user or not user.is_admin:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
-        # 今年的第一天
-        year = datetime.now().year
-        start = datetime(year, 1, 1)
-        count = db.query(User).filter(User.created_at >= start).count()
-        return {"count": count}
-    except JWTError:
-        raise HTTPException(status_code=401, detail='Token 無效')
+def admin_user_count(request: Request, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    # 今年的第一天
+    year = datetime.now().year
+    start = datetime(year, 1, 1)
+    return cached_stats(request, f"user_count:{year}", lambda: {
+        "count": db.query(User).filter(User.created_at >= start).count()
+    })
 
 @app.get('/api/admin/user-total')
-def admin_user_total(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = decode_access_token(token)
-        email = payload.get('sub')
-        user = db.query(User).filter_by(email=email).first()
-        if not user or not user.is_admin:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
-        count = db.query(User).count()
-        return {"count": count}
-    except JWTError:
-        raise HTTPException(status_code=401, detail='Token 無效')
+def admin_user_total(request: Request, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    return cached_stats(request, "user_total", lambda: {"count": db.query(User).count()})
 
 @app.get('/api/admin/user-list')
-def admin_user_list(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = decode_access_token(token)
-        email = payload.get('sub')
-        user = db.query(User).filter_by(email=email).first()
-        if not user or not user.is_admin:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
-        users = db.query(User).all()
-        return [{"id": u.id, "email": u.email, "created_at": str(u.created_at)} for u in users]
-    except JWTError:
-        raise HTTPException(status_code=401, detail='Token 無效')
+def admin_user_list(
+    request: Request,
+    response: Response,
+    cursor: str = None,
+    limit: int = None,
+    fields: str = None,
+    current_user: UserSnapshot = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """使用者列表 (keyset 分頁，依註冊時間由新到舊)"""
+    columns = select_fields(fields, USER_FIELDS, default=["id", "email", "created_at"])
+    def build_query(session):
+        return keyset(project(session, columns, User.created_at, User.id), User.created_at, User.id, cursor)
+    return paginated_list(request, response, db, build_query, columns, limit)
 
 @app.get('/api/admin/usage-statistics')
-def admin_usage_statistics(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """管理者查看所有使用者的使用統計"""
-    try:
-        payload = decode_access_token(token)
-        email = payload.get('sub')
-        user = db.query(User).filter_by(email=email).first()
-        if not user or not user.is_admin:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
-        
-        # 獲取所有使用者的使用統計
-        usage_stats = db.query(
-            User.id,
-            User.email,
-            func.count(UsageRecord.id).label('total_usage'),
-            func.count(UsageRecord.id).filter(UsageRecord.service_type == 'video_abstract').label('video_usage'),
-            func.count(UsageRecord.id).filter(UsageRecord.service_type == 'ppt_to_video').label('ppt_usage')
-        ).outerjoin(UsageRecord, User.id == UsageRecord.user_id)\
-         .group_by(User.id, User.email)\
-         .all()
-        
-        # 獲取今日使用統計
-        today = date.today()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-        
-        today_stats = db.query(
-            User.id,
-            func.count(UsageRecord.id).label('today_usage')
-        ).outerjoin(UsageRecord, User.id == UsageRecord.user_id)\
-         .filter(UsageRecord.usage_date >= today_start, UsageRecord.usage_date <= today_end)\
-         .group_by(User.id)\
-         .all()
-        
-        today_usage_dict = {user_id: count for user_id, count in today_stats}
-        
-        result = []
-        for user_id, email, total_usage, video_usage, ppt_usage in usage_stats:
-            result.append({
-                "user_id": user_id,
-                "email": email,
-                "total_usage": total_usage,
-                "video_usage": video_usage,
-                "ppt_usage": ppt_usage,
-                "today_usage": today_usage_dict.get(user_id, 0)
-            })
-        
-        return result
-    except JWTError:
-        raise HTTPException(status_code=401, detail='Token 無效')
+def admin_usage_statistics(request: Request, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    """管理者查看所有使用者的使用統計 (短時間快取，所有 worker 共用)"""
+    return cached_stats(request, f"usage_statistics:{usage_day().isoformat()}", lambda: compute_usage_statistics(db))
+
+def compute_usage_statistics(db: Session):
+    """計算每個使用者的累計與今日使用次數"""
+    # 獲取所有使用者的使用統計
+    usage_stats = db.query(
+        User.id,
+        User.email,
+        func.coalesce(func.sum(DailyUsageCounter.count).filter(DailyUsageCounter.service_type == TOTAL_SERVICE), 0).label('total_usage'),
+        func.coalesce(func.sum(DailyUsageCounter.count).filter(DailyUsageCounter.service_type == 'video_abstract'), 0).label('video_usage'),
+        func.coalesce(func.sum(DailyUsageCounter.count).filter(DailyUsageCounter.service_type == 'ppt_to_video'), 0).label('ppt_usage')
+    ).outerjoin(DailyUsageCounter, User.id == DailyUsageCounter.user_id)\
+     .group_by(User.id, User.email)\
+     .all()
+    
+    # 獲取今日使用統計 (由每日計數表讀取)
+    today_stats = db.query(DailyUsageCounter.user_id, DailyUsageCounter.count).filter(
+        DailyUsageCounter.usage_date == usage_day(),
+        DailyUsageCounter.service_type == TOTAL_SERVICE
+    ).all()
+    
+    today_usage_dict = {user_id: count for user_id, count in today_stats}
+    
+    result = []
+    for user_id, email, total_usage, video_usage, ppt_usage in usage_stats:
+        result.append({
+            "user_id": user_id,
+            "email": email,
+            "total_usage": total_usage,
+            "video_usage": video_usage,
+            "ppt_usage": ppt_usage,
+            "today_usage": today_usage_dict.get(user_id, 0)
+        })
+    
+    return result
 
 @app.get('/')
 def root():
@@ -597,41 +1344,45 @@ def root():
         }
     }
 
+@app.get('/livez')
+def liveness_check():
+    """存活檢查：行程可回應即為存活 (不存取資料庫或系統資訊)"""
+    return {"status": "alive"}
+
+@app.get('/readyz')
+def readiness_check():
+    """就緒檢查：資料庫可連線 (結果快取數秒)，無法連線時回應 503"""
+    result = readiness.check()
+    if not result["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "database": result})
+    return {"status": "ready", "database": result}
+
+@app.get('/health/details')
+def health_details():
+    """系統指標：記憶體、user_files 磁碟使用量、連線池與佇列深度 (背景定期取樣)"""
+    snapshot = health_sampler.snapshot or health_sampler.sample()
+    return {"status": "healthy", "sample_interval_seconds": health_sampler.interval, **snapshot}
+
 @app.get('/health')
 def health_check():
-    """健康檢查端點 - 包含記憶體使用情況"""
-    try:
-        memory = psutil.virtual_memory()
-        
-        # 執行檔案清理
-        db = next(get_db())
-        try:
-            cleanup_expired_files(db)
-        except Exception as e:
-            print(f"檔案清理失敗: {e}")
-        finally:
-            db.close()
-        
-        return {
-            "status": "healthy",
-            "timestamp": datetime.utcnow().isoformat(),
-            "memory_usage": {
-                "percent": memory.percent,
-                "available_mb": memory.available // 1024 // 1024,
-                "total_mb": memory.total // 1024 // 1024
-            },
-            "free_tier_info": {
-                "max_file_size_mb": MAX_FILE_SIZE // 1024 // 1024,
-                "daily_usage_limit": DAILY_USAGE_LIMIT,
-                "file_retention_days": FILE_RETENTION_DAYS
-            }
-        }
-    except Exception as e:
-        return {
-            "status": "healthy",
-            "timestamp": datetime.utcnow().isoformat(),
-            "error": "無法獲取記憶體資訊"
+    """健康檢查端點 - 包含記憶體使用情況 (讀取背景取樣結果，不存取資料庫)"""
+    return {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "memory_usage": health_sampler.snapshot.get("memory_usage", {}),
+        "free_tier_info": {
+            "max_file_size_mb": MAX_FILE_SIZE // 1024 // 1024,
+            "daily_usage_limit": DAILY_USAGE_LIMIT,
+            "file_retention_days": FILE_RETENTION_DAYS
         }
+    }
+
+@app.get('/metrics')
+def metrics(request: Request):
+    """Prometheus 指標 (文字格式)"""
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail='無效的指標存取權杖')
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get('/api/test-cors')
 def test_cors():
@@ -654,50 +1405,103 @@ def set_admin_user(email: str, db: Session = Depends(get_db)):
         return {"message": f"使用者 {email} 已經是管理員了"}
     
     user.is_admin = True
-    db.commit()
+    revoke_user_tokens(user, db)
     return {"message": f"成功將 {email} 設定為管理員"}
 
 @app.get('/api/admin/list-users')
-def list_users(db: Session = Depends(get_db)):
+def list_users(request: Request, response: Response, cursor: str = None, limit: int = None, fields: str = None, db: Session = Depends(get_db)):
     """列出所有使用者 (僅用於初始設定)"""
     # 注意：這個端點應該在設定完成後移除
-    users = db.query(User).all()
-    return [
-        {
-            "id": user.id,
-            "email": user.email,
-            "is_admin": user.is_admin,
-            "created_at": user.created_at.isoformat()
-        }
-        for user in users
-    ]
+    columns = select_fields(fields, USER_FIELDS)
+    def build_query(session):
+        return keyset(project(session, columns, User.created_at, User.id), User.created_at, User.id, cursor)
+    return paginated_list(request, response, db, build_query, columns, limit)
 
 
 
 @app.get('/api/user/files')
-def get_user_files(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """獲取使用者的檔案列表"""
-    files = db.query(UserFile).filter(
-        UserFile.user_id == current_user.id,
-        UserFile.status != 'expired'
-    ).order_by(UserFile.created_at.desc()).all()
-    
-    return [
-        FileInfo(
-            id=file.id,
-            file_name=file.file_name,
-            file_type=file.file_type,
-            file_size=file.file_size,
-            status=file.status,
-            created_at=file.created_at,
-            expires_at=file.expires_at,
-            analysis_result=file.analysis_result
+async def get_user_files(
+    request: Request,
+    response: Response,
+    cursor: str = None,
+    limit: int = None,
+    fields: str = None,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """獲取使用者的檔案列表 (keyset 分頁，fields= 選擇欄位)"""
+    columns = select_fields(fields, USER_FILE_FIELDS)
+    # 以檔案數與 max(updated_at) 作為列表版本；未變更時回應 304，不查詢與序列化列表
+    file_count, last_updated = (await db.execute(
+        select(func.count(UserFile.id), func.max(UserFile.updated_at)).where(
+            UserFile.user_id == current_user.id,
+            UserFile.status != 'expired'
         )
-        for file in files
-    ]
+    )).one()
+    etag = weak_etag("files", current_user.id, file_count, last_updated, request.url.query, request.headers.get("accept"))
+    cached = not_modified(request, etag)
+    if cached is not None:
+        await db.rollback()
+        return cached
+    response.headers["ETag"] = etag
+    def build_query(session):
+        query = project(session, columns, UserFile.created_at, UserFile.id).filter(
+            UserFile.user_id == current_user.id,
+            UserFile.status != 'expired'
+        )
+        return keyset(query, UserFile.created_at, UserFile.id, cursor)
+    return await paginated_list_async(request, response, db, build_query, columns, limit)
+
+@app.api_route('/api/user/files/{file_id}/content', methods=["GET", "HEAD"])
+async def get_user_file_content(
+    file_id: int,
+    request: Request,
+    original: bool = False,
+    download: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """播放或下載檔案內容：PDF 轉影片為生成的影片 (original=1 時為原始上傳)，其餘為上傳的檔案
+
+    支援 Range/If-Range (影片拖曳只傳送需要的區段) 與 ETag/If-None-Match (重複觀看回應 304)
+    """
+    # 擁有權與狀態條件同 idx_files_user_status (user_id, status)，單一查詢完成；其他使用者的檔案一律 404
+    # (已知 id 時資料庫以主鍵取出單列再套用條件，比走複合索引更直接)
+    row = (await db.execute(
+        select(
+            UserFile.file_name, UserFile.file_path, UserFile.file_type, UserFile.status, UserFile.content_hash,
+            ProcessingJob.result_path, ProcessingJob.result_hash
+        )
+        .outerjoin(ProcessingJob, (ProcessingJob.file_id == UserFile.id) & ProcessingJob.result_path.isnot(None))
+        .where(
+            UserFile.user_id == current_user.id,
+            UserFile.status.in_(('processing', 'completed')),
+            UserFile.id == file_id
+        )
+        .limit(1)
+    )).first()
+    await db.rollback()  # 傳送內容期間不持有連線
+    if not row:
+        raise HTTPException(status_code=404, detail='檔案不存在')
+    
+    if original or row.file_type != "ppt_to_video":
+        key, content_hash, filename = row.file_path, row.content_hash, row.file_name
+        media_type = mimetypes.guess_type(row.file_name)[0] or "application/octet-stream"
+    elif row.result_path:
+        key, content_hash, media_type = row.result_path, row.result_hash, "video/mp4"
+        filename = f"{os.path.splitext(row.file_name)[0]}.mp4"
+    elif row.status == 'processing':
+        raise HTTPException(status_code=409, detail='工作處理中，請稍後再試')
+    else:
+        raise HTTPException(status_code=410, detail='檔案已過期')
+    
+    return await anyio.to_thread.run_sync(lambda: storage_response(
+        request, key, media_type, filename, content_hash, inline=not download,
+        headers={"Cache-Control": f"private, max-age={FILE_CONTENT_MAX_AGE}"}
+    ))
 
 @app.get('/api/user/files/expiring')
-def get_user_expiring_files(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_expiring_files(current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
     """獲取特定用戶即將過期的檔案"""
     now = datetime.utcnow()
     warning_time = now + timedelta(hours=FILE_EXPIRY_WARNING_HOURS)
@@ -721,7 +1525,7 @@ def get_user_expiring_files(current_user: User = Depends(get_current_user), db:
     ]
 
 @app.delete('/api/user/files/{file_id}')
-def delete_user_file(file_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_user_file(file_id: int, current_user: UserSnapshot = Depends(get_current_user), db: Session = Depends(get_db)):
     """刪除使用者檔案"""
     file_record = db.query(UserFile).filter(
         UserFile.id == file_id,
@@ -732,11 +1536,11 @@ def delete_user_file(file_id: int, current_user: User = Depends(get_current_user
         raise HTTPException(status_code=404, detail='檔案不存在')
     
     try:
-        # 刪除實體檔案
-        if os.path.exists(file_record.file_path):
-            os.remove(file_record.file_path)
+        # 釋放實體檔案
+        release_file_storage(file_record, db)
         
         # 刪除資料庫記錄
+        db.query(ProcessingJob).filter(ProcessingJob.file_id == file_record.id).delete()
         db.delete(file_record)
         db.commit()
         
@@ -745,135 +1549,167 @@ def delete_user_file(file_id: int, current_user: User = Depends(get_current_user
         raise HTTPException(status_code=500, detail=f'刪除失敗: {str(e)}')
 
 @app.post('/api/admin/cleanup-files')
-def cleanup_files_endpoint(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """清理過期檔案 (僅管理員)"""
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail='無權限')
-    
-    cleanup_expired_files(db)
-    return {"message": "過期檔案清理完成"}
+def cleanup_files_endpoint(reconcile: bool = False, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    """清理過期檔案 (僅管理員)；reconcile=1 時一併對帳 user_files 與資料庫"""
+    report = sweeper.sweep_expired(db, CLEANUP_BATCH_SIZE)
+    uploads_cleaned = cleanup_stale_uploads(db)
+    result = {
+        "message": "過期檔案清理完成",
+        "files_cleaned": report.rows,
+        "uploads_cleaned": uploads_cleaned,
+        "sweep": report.as_dict()
+    }
+    if reconcile:
+        result["reconcile"] = sweeper.reconcile(db, CLEANUP_BATCH_SIZE).as_dict()
+    return result
 
 @app.get('/api/admin/daily-usage-summary')
-def admin_daily_usage_summary(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """管理者查看今日使用摘要"""
-    try:
-        payload = decode_access_token(token)
-        email = payload.get('sub')
-        user = db.query(User).filter_by(email=email).first()
-        if not user or not user.is_admin:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='無權限')
-        
-        today = date.today()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-        
-        # 今日總使用次數
-        total_today_usage = db.query(UsageRecord).filter(
-            UsageRecord.usage_date >= today_start,
-            UsageRecord.usage_date <= today_end
-        ).count()
-        
-        # 今日各服務使用次數
-        video_today = db.query(UsageRecord).filter(
-            UsageRecord.service_type == 'video_abstract',
-            UsageRecord.usage_date >= today_start,
-            UsageRecord.usage_date <= today_end
-        ).count()
-        
-        ppt_today = db.query(UsageRecord).filter(
-            UsageRecord.service_type == 'ppt_to_video',
-            UsageRecord.usage_date >= today_start,
-            UsageRecord.usage_date <= today_end
-        ).count()
-        
-        # 活躍使用者數（今日有使用的使用者）
-        active_users = db.query(UsageRecord.user_id).filter(
-            UsageRecord.usage_date >= today_start,
-            UsageRecord.usage_date <= today_end
-        ).distinct().count()
-        
+def admin_daily_usage_summary(request: Request, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    """管理者查看今日使用摘要 (短時間快取)"""
+    today = usage_day()
+    
+    def compute():
+        # 由每日計數表一次取得各服務次數與活躍使用者數
+        summary = daily_usage_summary(db, today)
+        empty = {"count": 0, "users": 0}
         return {
             "date": today.isoformat(),
-            "total_usage": total_today_usage,
-            "video_usage": video_today,
-            "ppt_usage": ppt_today,
-            "active_users": active_users
+            "total_usage": summary.get(TOTAL_SERVICE, empty)["count"],
+            "video_usage": summary.get('video_abstract', empty)["count"],
+            "ppt_usage": summary.get('ppt_to_video', empty)["count"],
+            # 活躍使用者數（今日有使用的使用者）
+            "active_users": summary.get(TOTAL_SERVICE, empty)["users"]
         }
-    except JWTError:
-        raise HTTPException(status_code=401, detail='Token 無效')
+    return cached_stats(request, f"daily_usage_summary:{today.isoformat()}", compute)
 
 @app.get('/api/admin/database-stats')
-def get_database_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """獲取資料庫統計資訊"""
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="需要管理員權限")
-    
+def get_database_stats(request: Request, fresh: bool = False, current_user: UserSnapshot = Depends(require_admin), db: Session = Depends(get_db)):
+    """獲取資料庫統計資訊 (短時間快取，fresh=1 時重新計算)"""
     try:
-        # 使用者統計
-        total_users = db.query(User).count()
-        admin_users = db.query(User).filter(User.is_admin == True).count()
-        regular_users = total_users - admin_users
-        
-        # 檔案統計
-        total_files = db.query(UserFile).count()
-        processing_files = db.query(UserFile).filter(UserFile.status == 'processing').count()
-        completed_files = db.query(UserFile).filter(UserFile.status == 'completed').count()
-        expired_files = db.query(UserFile).filter(UserFile.status == 'expired').count()
-        
-        # 使用記錄統計
-        total_usage_records = db.query(UsageRecord).count()
-        video_abstract_usage = db.query(UsageRecord).filter(UsageRecord.service_type == 'video_abstract').count()
-        ppt_to_video_usage = db.query(UsageRecord).filter(UsageRecord.service_type == 'ppt_to_video').count()
-        
-        # 最近24小時的活動
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_files = db.query(UserFile).filter(UserFile.created_at >= yesterday).count()
-        recent_usage = db.query(UsageRecord).filter(UsageRecord.usage_date >= yesterday).count()
-        
-        return {
-            "database_stats": {
-                "users": {
-                    "total": total_users,
-                    "admin": admin_users,
-                    "regular": regular_users
-                },
-                "files": {
-                    "total": total_files,
-                    "processing": processing_files,
-                    "completed": completed_files,
-                    "expired": expired_files
-                },
-                "usage_records": {
-                    "total": total_usage_records,
-                    "video_abstract": video_abstract_usage,
-                    "ppt_to_video": ppt_to_video_usage
-                },
-                "recent_activity": {
-                    "files_last_24h": recent_files,
-                    "usage_last_24h": recent_usage
-                }
-            }
-        }
+        # 多個管理後台同時查詢時只計算一次
+        return cached_stats(request, "database_stats", lambda: compute_database_stats(db), fresh=fresh)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取統計資訊失敗: {str(e)}")
 
+def compute_database_stats(db: Session):
+    """以單一查詢計算資料庫統計 (每個資料表一個條件式彙總子查詢)"""
+    # 最近24小時的活動
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    
+    # 使用者統計
+    user_stats = db.query(
+        func.count(User.id).label('total'),
+        func.count(User.id).filter(User.is_admin == True).label('admin')
+    ).subquery()
+    
+    # 檔案統計
+    file_stats = db.query(
+        func.count(UserFile.id).label('total'),
+        func.count(UserFile.id).filter(UserFile.status == 'processing').label('processing'),
+        func.count(UserFile.id).filter(UserFile.status == 'completed').label('completed'),
+        func.count(UserFile.id).filter(UserFile.status == 'expired').label('expired'),
+        func.count(UserFile.id).filter(UserFile.created_at >= yesterday).label('recent')
+    ).subquery()
+    
+    # 使用記錄統計
+    usage_stats = db.query(
+        func.count(UsageRecord.id).label('total'),
+        func.count(UsageRecord.id).filter(UsageRecord.service_type == 'video_abstract').label('video_abstract'),
+        func.count(UsageRecord.id).filter(UsageRecord.service_type == 'ppt_to_video').label('ppt_to_video'),
+        func.count(UsageRecord.id).filter(UsageRecord.usage_date >= yesterday).label('recent')
+    ).subquery()
+    
+    users, files, usage = (user_stats.c, file_stats.c, usage_stats.c)
+    row = db.query(
+        users.total, users.admin,
+        files.total, files.processing, files.completed, files.expired, files.recent,
+        usage.total, usage.video_abstract, usage.ppt_to_video, usage.recent
+    ).select_from(user_stats).join(file_stats, true()).join(usage_stats, true()).one()
+    (total_users, admin_users,
+     total_files, processing_files, completed_files, expired_files, recent_files,
+     total_usage_records, video_abstract_usage, ppt_to_video_usage, recent_usage) = row
+    
+    return {
+        "database_stats": {
+            "users": {
+                "total": total_users,
+                "admin": admin_users,
+                "regular": total_users - admin_users
+            },
+            "files": {
+                "total": total_files,
+                "processing": processing_files,
+                "completed": completed_files,
+                "expired": expired_files
+            },
+            "usage_records": {
+                "total": total_usage_records,
+                "video_abstract": video_abstract_usage,
+                "ppt_to_video": ppt_to_video_usage
+            },
+            "recent_activity": {
+                "files_last_24h": recent_files,
+                "usage_last_24h": recent_usage
+            }
+        },
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+@app.get('/api/admin/scheduler-stats')
+def get_scheduler_stats(current_user: UserSnapshot = Depends(require_admin)):
+    """背景排程狀態與清理進度 (含最近一次清理與對帳的 files/sec)"""
+    return {**scheduler.stats(), "sweeper": sweeper.stats()}
+
+@app.get('/api/admin/pool-stats')
+def get_pool_stats(current_user: UserSnapshot = Depends(require_admin)):
+    """資料庫連線池設定、目前狀態與借出/等待統計"""
+    return {
+        "backend": engine.dialect.name,
+        "settings": database_settings(),
+        "pool": pool_stats(engine),
+        "usage": pool_monitor.stats(),
+        "async": {
+            "backend": async_engine.dialect.driver,
+            "pool": pool_stats(async_engine.sync_engine),
+            "usage": async_pool_monitor.stats()
+        }
+    }
+
+@app.get('/api/admin/cache-stats')
+def get_cache_stats(current_user: UserSnapshot = Depends(require_admin)):
+    """獲取快取統計資訊 (命中率等)"""
+    return {
+        "shared_cache": shared_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "rate_limit_rejected": rate_limiter.rejected
+    }
+
 @app.get('/api/admin/recent-uploads')
 def get_recent_uploads(
     limit: int = 20,
-    current_user: User = Depends(get_current_user), 
+    include_result: bool = False,
+    current_user: UserSnapshot = Depends(require_admin), 
     db: Session = Depends(get_db)
 ):
-    """獲取最近上傳的檔案列表"""
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="需要管理員權限")
-    
+    """獲取最近上傳的檔案列表 (單一 JOIN 查詢，include_result=1 時才載入分析結果)"""
     try:
-        recent_files = db.query(UserFile).order_by(UserFile.created_at.desc()).limit(limit).all()
+        columns = [
+            UserFile.id, UserFile.file_name, UserFile.file_type, UserFile.file_size,
+            UserFile.status, UserFile.created_at, UserFile.expires_at, User.email
+        ]
+        if include_result:
+            columns.append(UserFile.analysis_result)
+        recent_files = db.query(*columns)\
+            .outerjoin(User, User.id == UserFile.user_id)\
+            .order_by(UserFile.created_at.desc())\
+            .limit(limit)\
+            .all()
         
         file_list = []
         for file in recent_files:
-            user = db.query(User).filter(User.id == file.user_id).first()
-            file_list.append({
+            item = {
                 "id": file.id,
                 "file_name": file.file_name,
                 "file_type": file.file_type,
@@ -881,9 +1717,11 @@ def get_recent_uploads(
                 "status": file.status,
                 "created_at": file.created_at.isoformat(),
                 "expires_at": file.expires_at.isoformat(),
-                "user_email": user.email if user else "Unknown",
-                "analysis_result": file.analysis_result
-            })
+                "user_email": file.email or "Unknown"
+            }
+            if include_result:
+                item["analysis_result"] = file.analysis_result
+            file_list.append(item)
         
         return {"recent_uploads": file_list}
     except Exception as e:
@@ -892,44 +1730,36 @@ def get_recent_uploads(
 @app.get('/api/admin/user-activity/{user_email}')
 def get_user_activity(
     user_email: str,
-    current_user: User = Depends(get_current_user), 
+    files_cursor: str = None,
+    usage_cursor: str = None,
+    limit: int = None,
+    fields: str = None,
+    current_user: UserSnapshot = Depends(require_admin), 
     db: Session = Depends(get_db)
 ):
-    """獲取特定使用者的活動記錄"""
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="需要管理員權限")
-    
+    """獲取特定使用者的活動記錄 (檔案與使用記錄各自以 keyset 分頁)"""
     try:
-        user = db.query(User).filter(User.email == user_email).first()
+        user = db.query(User.id, User.email, User.is_admin, User.created_at).filter(User.email == user_email).first()
         if not user:
             raise HTTPException(status_code=404, detail="使用者不存在")
         
         # 獲取使用者的檔案
-        user_files = db.query(UserFile).filter(UserFile.user_id == user.id).order_by(UserFile.created_at.desc()).all()
+        file_columns = select_fields(fields, USER_FILE_FIELDS)
+        files_query = project(db, file_columns, UserFile.created_at, UserFile.id).filter(UserFile.user_id == user.id)
+        files_list, next_files_cursor = fetch_page(
+            keyset(files_query, UserFile.created_at, UserFile.id, files_cursor), list(file_columns), limit
+        )
         
         # 獲取使用者的使用記錄
-        usage_records = db.query(UsageRecord).filter(UsageRecord.user_id == user.id).order_by(UsageRecord.usage_date.desc()).all()
-        
-        files_list = []
-        for file in user_files:
-            files_list.append({
-                "id": file.id,
-                "file_name": file.file_name,
-                "file_type": file.file_type,
-                "file_size": file.file_size,
-                "status": file.status,
-                "created_at": file.created_at.isoformat(),
-                "expires_at": file.expires_at.isoformat(),
-                "analysis_result": file.analysis_result
-            })
+        usage_columns = {"id": UsageRecord.id, "service_type": UsageRecord.service_type, "usage_date": UsageRecord.usage_date}
+        usage_query = project(db, usage_columns, UsageRecord.usage_date, UsageRecord.id).filter(UsageRecord.user_id == user.id)
+        usage_list, next_usage_cursor = fetch_page(
+            keyset(usage_query, UsageRecord.usage_date, UsageRecord.id, usage_cursor), list(usage_columns), limit
+        )
         
-        usage_list = []
-        for record in usage_records:
-            usage_list.append({
-                "id": record.id,
-                "service_type": record.service_type,
-                "usage_date": record.usage_date.isoformat()
-            })
+        # 總數 (不載入資料列)
+        total_files = db.query(func.count(UserFile.id)).filter(UserFile.user_id == user.id).scalar()
+        total_usage = db.query(func.count(UsageRecord.id)).filter(UsageRecord.user_id == user.id).scalar()
         
         return {
             "user_info": {
@@ -940,8 +1770,10 @@ def get_user_activity(
             },
             "files": files_list,
             "usage_records": usage_list,
-            "total_files": len(files_list),
-            "total_usage": len(usage_list)
+            "total_files": total_files,
+            "total_usage": total_usage,
+            "next_files_cursor": next_files_cursor,
+            "next_usage_cursor": next_usage_cursor
         }
     except HTTPException:
         raise
@@ -951,42 +1783,51 @@ def get_user_activity(
 @app.get('/api/admin/verify-upload/{file_id}')
 def verify_file_upload(
     file_id: int,
-    current_user: User = Depends(get_current_user), 
+    include_result: bool = False,
+    current_user: UserSnapshot = Depends(require_admin), 
     db: Session = Depends(get_db)
 ):
-    """驗證特定檔案的上傳狀態"""
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="需要管理員權限")
-    
+    """驗證特定檔案的上傳狀態 (檔案與使用者以單一 JOIN 查詢取得)"""
     try:
-        file_record = db.query(UserFile).filter(UserFile.id == file_id).first()
+        columns = [
+            UserFile.id, UserFile.file_name, UserFile.file_path, UserFile.file_type, UserFile.file_size,
+            UserFile.status, UserFile.created_at, UserFile.expires_at, UserFile.user_id, User.email
+        ]
+        if include_result:
+            columns.append(UserFile.analysis_result)
+        file_record = db.query(*columns)\
+            .outerjoin(User, User.id == UserFile.user_id)\
+            .filter(UserFile.id == file_id)\
+            .first()
         if not file_record:
             raise HTTPException(status_code=404, detail="檔案記錄不存在")
         
-        user = db.query(User).filter(User.id == file_record.user_id).first()
+        # 檢查檔案是否實際存在於儲存後端
+        stored = storage.stat(file_record.file_path)
+        file_exists = stored is not None
         
-        # 檢查檔案是否實際存在於檔案系統
-        file_exists = os.path.exists(file_record.file_path)
+        file_info = {
+            "id": file_record.id,
+            "file_name": file_record.file_name,
+            "file_path": file_record.file_path,
+            "file_type": file_record.file_type,
+            "file_size": file_record.file_size,
+            "status": file_record.status,
+            "created_at": file_record.created_at.isoformat(),
+            "expires_at": file_record.expires_at.isoformat()
+        }
+        if include_result:
+            file_info["analysis_result"] = file_record.analysis_result
         
         return {
-            "file_info": {
-                "id": file_record.id,
-                "file_name": file_record.file_name,
-                "file_path": file_record.file_path,
-                "file_type": file_record.file_type,
-                "file_size": file_record.file_size,
-                "status": file_record.status,
-                "created_at": file_record.created_at.isoformat(),
-                "expires_at": file_record.expires_at.isoformat(),
-                "analysis_result": file_record.analysis_result
-            },
+            "file_info": file_info,
             "user_info": {
-                "id": user.id,
-                "email": user.email
+                "id": file_record.user_id,
+                "email": file_record.email
             },
             "verification": {
                 "file_exists_in_fs": file_exists,
-                "file_size_matches": file_exists and os.path.getsize(file_record.file_path) == file_record.file_size if file_exists else False,
+                "file_size_matches": file_exists and stored.size == file_record.file_size,
                 "is_expired": datetime.utcnow() > file_record.expires_at,
                 "days_until_expiry": (file_record.expires_at - datetime.utcnow()).days if datetime.utcnow() <= file_record.expires_at else 0
             }
@@ -0,0 +1,277 @@
+"""
+Prometheus 指標
+以 Prometheus 文字格式 (text/plain; version=0.0.4) 輸出，不需額外套件：
+- Counter / Gauge / Histogram: 程式內直接更新的指標 (支援標籤)
+- CallbackMetric: 輸出時才讀取的數值 (快取命中、佇列深度等既有統計)
+- MetricsMiddleware: ASGI 中介層，依路由樣板 (例如 /api/jobs/{job_id}) 記錄請求數與延遲
+- instrument_engine: SQLAlchemy 事件，記錄每個請求的查詢次數與查詢時間
+
+指標保存在各 worker 行程內；多個 uvicorn worker 時每次抓取只會取得其中一個行程的數值，
+需要彙整時請以 worker 各自的連接埠或 sidecar 抓取
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 延遲分布的預設區間 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每個請求的查詢次數區間
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# 上傳大小區間 (位元組)
+SIZE_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 20 * 1024 ** 2, 50 * 1024 ** 2)
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: dict = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    """收集所有指標並輸出為文字格式"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                # 單一指標失敗不影響其他指標
+                lines.append(f"# ERROR {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry: Registry = registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """只增不減的計數"""
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """可增可減的數值"""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """數值分布 (累積區間計數、總和與次數)"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry: Registry = registry):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # labels -> [各區間計數, 總和, 次數]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def collect(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(float(bound))})
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class CallbackMetric(_Metric):
+    """輸出時呼叫 fn() 取得數值；fn 回傳單一數值，或 {標籤值 tuple: 數值}"""
+
+    def __init__(self, name: str, documentation: str, fn, labelnames=(), type: str = "gauge", registry: Registry = registry):
+        super().__init__(name, documentation, labelnames, registry)
+        self.type = type
+        self.fn = fn
+
+    def collect(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is None:
+                continue
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+# HTTP 與資料庫指標
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP 請求數", ("method", "route", "status"))
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP 請求延遲 (秒)", ("method", "route"))
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "處理中的 HTTP 請求數")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "http_request_db_queries", "每個請求送出的 SQL 數", ("route",), buckets=QUERY_COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram(
+    "http_request_db_seconds", "每個請求的 SQL 執行時間總和 (秒)", ("route",))
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "單一 SQL 執行時間 (秒)", ("operation",))
+
+
+class _RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# 目前請求的查詢統計 (同步端點在執行緒池中執行時，context 會一併複製過去)
+_request_stats = ContextVar("request_stats", default=None)
+
+
+def route_template(scope) -> str:
+    """取得路由樣板，未比對到路由時統一為 unmatched (避免路徑參數造成標籤數量暴增)"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """記錄 HTTP 請求數、延遲與每個請求的查詢次數 (純 ASGI，不緩衝回應內容)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_PROGRESS.dec()
+            _request_stats.reset(token)
+            route = route_template(scope)
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+            HTTP_LATENCY.observe(elapsed, method=method, route=route)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route=route)
+            DB_TIME_PER_REQUEST.observe(stats.db_seconds, route=route)
+
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def instrument_engine(engine):
+    """以 SQLAlchemy 事件記錄查詢次數與時間 (背景執行緒的查詢只計入 db_query_duration_seconds)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        elapsed = time.perf_counter() - started
+        operation = statement.lstrip()[:6].upper()
+        if operation not in _OPERATIONS:
+            operation = "OTHER"
+        DB_QUERY_DURATION.observe(elapsed, operation=operation)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_started"):
+            conn.info["metrics_started"].pop()
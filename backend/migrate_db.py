@@ -7,9 +7,12 @@
 import sqlite3
 import os
 from datetime import datetime
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from models import Base
+from usage import backfill_usage_counters
+from quota import backfill_user_storage
 
 load_dotenv()
 
@@ -73,6 +76,57 @@ def migrate_database():
     finally:
         conn.close()
 
+def add_missing_columns():
+    """建立新資料表，並新增模型中已定義但既有資料表缺少的欄位 (SQLite 與 PostgreSQL)"""
+    try:
+        Base.metadata.create_all(bind=engine)
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    if column.default is not None and column.default.is_scalar:
+                        default = column.default.arg
+                        if isinstance(default, bool):
+                            default = str(default).upper()
+                        ddl += f" DEFAULT {default!r}" if isinstance(default, str) else f" DEFAULT {default}"
+                        if not column.nullable:
+                            ddl += " NOT NULL"
+                    conn.execute(text(ddl))
+                    print(f"✓ 已新增 {table.name}.{column.name} 欄位")
+    except Exception as e:
+        print(f"新增欄位時發生錯誤: {e}")
+
+def rebuild_usage_counters():
+    """由 usage_records 重建每日使用次數計數表"""
+    db = SessionLocal()
+    try:
+        count = backfill_usage_counters(db)
+        db.commit()
+        print(f"✓ 已重建 daily_usage_counters ({count} 列)")
+    except Exception as e:
+        db.rollback()
+        print(f"重建使用次數計數時發生錯誤: {e}")
+    finally:
+        db.close()
+
+def rebuild_user_storage():
+    """由 user_files 重建每位使用者的儲存空間統計"""
+    db = SessionLocal()
+    try:
+        count = backfill_user_storage(db)
+        db.commit()
+        print(f"✓ 已重建 user_storage ({count} 列)")
+    except Exception as e:
+        db.rollback()
+        print(f"重建儲存空間統計時發生錯誤: {e}")
+    finally:
+        db.close()
+
 def create_indexes():
     """創建優化索引"""
     db = SessionLocal()
@@ -136,4 +190,7 @@ def create_indexes():
 if __name__ == "__main__":
     print("開始執行資料庫遷移...")
     migrate_database()
+    add_missing_columns()
+    rebuild_usage_counters()
+    rebuild_user_storage()
     create_indexes() 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Date, DateTime, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, date
@@ -41,11 +41,76 @@ class UserFile(Base):
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     expires_at = Column(DateTime, nullable=False, index=True)  # 檔案過期時間
     analysis_result = Column(Text, nullable=True)  # 分析結果 (文字摘要)
+    content_hash = Column(String, nullable=True, index=True)  # 檔案內容 SHA-256 (內容定址儲存)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # 最後變更時間 (列表 ETag 版本)
     
     # 關聯到使用者
     user = relationship("User", back_populates="files")
 
+class ProcessingJob(Base):
+    __tablename__ = 'processing_jobs'
+    id = Column(String, primary_key=True)  # job id (uuid)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    file_id = Column(Integer, ForeignKey('user_files.id'), nullable=False, index=True)
+    job_type = Column(String, nullable=False)  # 'video_abstract' 或 'ppt_to_video'
+    state = Column(String, default='queued', index=True)  # 佇列狀態: 'queued', 'running', 'done'
+    worker_id = Column(String, nullable=True)  # 領取工作的 worker
+    result_path = Column(String, nullable=True)  # 產出檔案路徑 (例如生成的影片)
+    result_hash = Column(String, nullable=True, index=True)  # 產出檔案內容 SHA-256
+    error = Column(Text, nullable=True)  # 失敗原因
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # 執行中工作的最後心跳 (租約)
+    finished_at = Column(DateTime, nullable=True)
+
+class UploadSession(Base):
+    __tablename__ = 'upload_sessions'
+    id = Column(String, primary_key=True)  # upload id (uuid)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    file_name = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    service_type = Column(String, nullable=False)  # 'video_abstract' 或 'ppt_to_video'
+    total_size = Column(Integer, nullable=False)  # 檔案總大小 (bytes)
+    temp_path = Column(String, nullable=False)  # 預先配置的暫存檔路徑
+    received_ranges = Column(Text, default='[]')  # 已接收區段 JSON: [[start, end), ...]
+    status = Column(String, default='uploading', index=True)  # 'uploading', 'completing', 'completed'
+    job_id = Column(String, nullable=True)  # 完成後排入的工作 (重複呼叫 complete 時回傳同一工作)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # 未完成的上傳過期時間
+
+class StoredBlob(Base):
+    __tablename__ = 'stored_blobs'
+    sha256 = Column(String, primary_key=True)  # 內容雜湊
+    file_path = Column(String, nullable=False)  # 實體檔案路徑
+    file_size = Column(Integer, nullable=False)  # 檔案大小 (bytes)
+    ref_count = Column(Integer, nullable=False, default=0)  # 引用此內容的檔案記錄數
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class TokenVersion(Base):
+    __tablename__ = 'auth_token_versions'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)  # 遞增後舊 token 失效
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DailyUsageCounter(Base):
+    __tablename__ = 'daily_usage_counters'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    usage_date = Column(Date, primary_key=True)  # UTC 日期
+    service_type = Column(String, primary_key=True)  # 服務類型，'all' 為當日合計
+    count = Column(Integer, nullable=False, default=0)
+
+class UserStorage(Base):
+    __tablename__ = 'user_storage'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    file_type = Column(String, primary_key=True)  # 檔案類型，'all' 為合計
+    total_bytes = Column(BigInteger, nullable=False, default=0)  # 未過期檔案的大小總和 (bytes)
+    file_count = Column(Integer, nullable=False, default=0)  # 未過期檔案數
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # 添加複合索引以優化常用查詢
 Index('idx_usage_user_date', UsageRecord.user_id, UsageRecord.usage_date)
 Index('idx_files_user_status', UserFile.user_id, UserFile.status)
-Index('idx_files_expires', UserFile.expires_at, UserFile.status)
\ No newline at end of file
+Index('idx_files_expires', UserFile.expires_at, UserFile.status)
+Index('idx_files_hash_type_status', UserFile.content_hash, UserFile.file_type, UserFile.status)
+Index('idx_jobs_state_created', ProcessingJob.state, ProcessingJob.created_at)
+Index('idx_usage_counters_date', DailyUsageCounter.usage_date, DailyUsageCounter.service_type)
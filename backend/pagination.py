@@ -0,0 +1,117 @@
+"""
+列表分頁與欄位投影
+- keyset 分頁：依 (created_at, id) 由新到舊排序，cursor 記錄上一頁最後一筆，
+  下一頁以 WHERE 條件接續，不使用 OFFSET，查詢成本不隨頁數增加
+- fields= 只查詢需要的欄位，不建立 ORM 物件
+- Accept: application/x-ndjson 時以串流逐行輸出 (每行一筆 JSON)，記憶體用量不隨資料量成長
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import or_, and_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500  # 串流時每批從資料庫取得的列數
+
+_CURSOR_CREATED = "_cursor_created_at"
+_CURSOR_ID = "_cursor_id"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """將 (created_at, id) 編碼為不透明的 cursor 字串"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """解析 cursor，格式錯誤時回應 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="cursor 格式錯誤")
+
+
+def select_fields(fields: str, available: dict, default: list = None) -> dict:
+    """解析 fields= 參數 (逗號分隔)，回傳欄位名稱 -> 欄位；未指定時使用 default (或全部欄位)"""
+    if not fields:
+        names = default or list(available)
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支援的欄位: {', '.join(unknown)} (可用欄位: {', '.join(available)})"
+            )
+    return {name: available[name] for name in names}
+
+
+def project(db, columns: dict, created_column, id_column):
+    """只查詢指定欄位，並附帶分頁排序用的 (created_at, id)"""
+    return db.query(
+        *[column.label(name) for name, column in columns.items()],
+        created_column.label(_CURSOR_CREATED),
+        id_column.label(_CURSOR_ID)
+    )
+
+
+def keyset(query, created_column, id_column, cursor: str = None):
+    """依 (created_at, id) 由新到舊排序，並從 cursor 之後接續"""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_column < created_at,
+            and_(created_column == created_at, id_column < row_id)
+        ))
+    return query.order_by(created_column.desc(), id_column.desc())
+
+
+def serialize_row(row, names) -> dict:
+    """將投影查詢的結果列轉為 dict (datetime 轉為 ISO 格式)"""
+    item = {}
+    for name in names:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+
+def fetch_page(query, names, limit: int = None):
+    """取得一頁資料，回傳 (items, next_cursor)；沒有下一頁時 next_cursor 為 None"""
+    limit = min(max(1, limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, _CURSOR_CREATED), getattr(last, _CURSOR_ID))
+    return [serialize_row(row, names) for row in rows], next_cursor
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_ndjson(session_factory, build_query, names, limit: int = None) -> StreamingResponse:
+    """以 NDJSON 串流輸出查詢結果
+
+    build_query(db) 於串流產生時以獨立 session 執行 (請求的 session 在回應送出前即關閉)
+    """
+    def generate():
+        db = session_factory()
+        try:
+            query = build_query(db)
+            if limit:
+                query = query.limit(limit)
+            for row in query.yield_per(STREAM_BATCH_SIZE):
+                yield json.dumps(serialize_row(row, names), ensure_ascii=False) + "\n"
+        finally:
+            db.close()
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
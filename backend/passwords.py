@@ -0,0 +1,102 @@
+"""
+密碼雜湊執行器
+bcrypt 刻意設計為 CPU 密集運算，在請求 worker 上同步執行會讓大量登入拖慢其他端點。
+此模組將雜湊與驗證交給專用且有上限的執行緒池 (bcrypt 於 C 擴充中釋放 GIL)，
+並記錄佇列深度與等待時間。
+呼叫端為一般 (def) 端點：同步 ORM 查詢與等待雜湊結果都在 Starlette 執行緒池中進行，不阻塞事件迴圈
+
+可透過環境變數設定：
+- BCRYPT_ROUNDS:            bcrypt 工作因子，變更後使用者登入時自動以新因子重新雜湊
+- PASSWORD_HASH_WORKERS:    雜湊執行緒數
+- PASSWORD_HASH_MAX_QUEUE:  排隊上限，超過時回應 503
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', '64'))
+
+# 工作因子不等於 BCRYPT_ROUNDS 的雜湊會被視為需要更新
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+
+class PasswordHasher:
+    """在專用執行緒池中執行 bcrypt 雜湊與驗證"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.queued = 0  # 等待執行緒的工作數
+        self.running = 0  # 執行中的工作數
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0  # 累計排隊等待時間
+        self.run_seconds_total = 0.0  # 累計雜湊運算時間
+        self.on_wait = None  # 每次工作開始時以排隊秒數呼叫 (例如記錄到延遲分布指標)
+
+    def _track(self, fn, submitted_at: float):
+        def run(*args):
+            started_at = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_seconds_total += started_at - submitted_at
+            if self.on_wait is not None:
+                self.on_wait(started_at - submitted_at)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.run_seconds_total += time.perf_counter() - started_at
+        return run
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self.queued + self.running >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail='系統忙碌中，請稍後再試', headers={"Retry-After": "1"})
+            self.queued += 1
+        return self._executor.submit(self._track(fn, time.perf_counter()), *args)
+
+    def hash(self, password: str) -> str:
+        """產生密碼雜湊 (由執行緒池中的一般 def 端點呼叫，等待結果期間不佔用事件迴圈)"""
+        return self._submit(pwd_context.hash, password).result()
+
+    def verify_and_update(self, password: str, hashed_password: str):
+        """驗證密碼，工作因子變更時一併回傳新雜湊 (否則為 None)"""
+        return self._submit(pwd_context.verify_and_update, password, hashed_password).result()
+
+    def stats(self) -> dict:
+        """執行器統計"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_seconds_total / self.completed * 1000, 2) if self.completed else 0.0,
+                "avg_hash_ms": round(self.run_seconds_total / self.completed * 1000, 2) if self.completed else 0.0
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
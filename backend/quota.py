@@ -0,0 +1,163 @@
+"""
+每位使用者的儲存空間統計
+user_storage 以 (使用者, 檔案類型) 為主鍵保存未過期檔案的大小總和與檔案數，
+另以 file_type='all' 保存合計；檢查儲存空間額度只需讀取一列，不需 SUM(user_files.file_size)
+
+- charge_storage: 建立檔案記錄時遞增；指定上限時以單一條件式 UPDATE (total_bytes + size <= 上限)
+  同時完成檢查與遞增，並發上傳不會同時通過額度檢查
+- release_storage: 刪除或過期時遞減 (同一批以一次 executemany 完成，不會低於 0)
+
+大小以檔案記錄的 file_size 計算 (內容定址儲存共用的實體檔案仍分別計入各記錄)，
+函數只變更 session，由呼叫端 commit
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import update, delete, select, func, case, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from models import UserStorage, UserFile
+
+ALL_TYPES = 'all'  # 合計列的檔案類型
+
+
+def storage_statement(user_id: int):
+    """使用者各檔案類型的儲存空間 (同步與非同步 session 共用)"""
+    return select(UserStorage.file_type, UserStorage.total_bytes, UserStorage.file_count).where(
+        UserStorage.user_id == user_id
+    )
+
+
+def _summarize(rows) -> dict:
+    summary = {"bytes": 0, "file_count": 0, "by_type": {}}
+    for file_type, total_bytes, file_count in rows:
+        if file_type == ALL_TYPES:
+            summary["bytes"], summary["file_count"] = total_bytes, file_count
+        else:
+            summary["by_type"][file_type] = {"bytes": total_bytes, "file_count": file_count}
+    return summary
+
+
+def get_user_storage(db, user_id: int) -> dict:
+    """取得使用者的儲存空間 (合計與各檔案類型)"""
+    return _summarize(db.execute(storage_statement(user_id)).all())
+
+
+async def get_user_storage_async(db, user_id: int) -> dict:
+    """get_user_storage 的非同步版本 (AsyncSession)"""
+    return _summarize((await db.execute(storage_statement(user_id))).all())
+
+
+async def get_storage_version_async(db, user_id: int) -> tuple:
+    """儲存空間的版本 (合計列的位元組數、檔案數與 updated_at，主鍵查詢)；任何檔案類型變更都會一併更新合計列"""
+    row = (await db.execute(
+        select(UserStorage.total_bytes, UserStorage.file_count, UserStorage.updated_at).where(
+            UserStorage.user_id == user_id, UserStorage.file_type == ALL_TYPES
+        )
+    )).first()
+    return tuple(row) if row is not None else (0, 0, None)
+
+
+def get_total_storage(db) -> dict:
+    """所有使用者的檔案數與總大小 (合計列加總，供健康檢查；共用的實體檔案分別計入各記錄)"""
+    file_count, total_bytes, users = db.execute(
+        select(
+            func.coalesce(func.sum(UserStorage.file_count), 0),
+            func.coalesce(func.sum(UserStorage.total_bytes), 0),
+            func.count()
+        ).where(UserStorage.file_type == ALL_TYPES)
+    ).one()
+    return {"files": int(file_count), "size_mb": round(int(total_bytes) / 1024 / 1024, 2), "users": users}
+
+
+def get_storage_bytes(db, user_id: int) -> int:
+    """使用者目前使用的位元組數 (主鍵查詢)"""
+    return db.execute(
+        select(UserStorage.total_bytes).where(UserStorage.user_id == user_id, UserStorage.file_type == ALL_TYPES)
+    ).scalar() or 0
+
+
+def _add(db, user_id: int, file_type: str, size: int, quota: int = None) -> bool:
+    """遞增一個檔案；指定 quota 時只有加上後不超過 quota 才遞增，回傳是否成功"""
+    query = update(UserStorage).where(
+        UserStorage.user_id == user_id,
+        UserStorage.file_type == file_type
+    )
+    if quota is not None:
+        query = query.where(UserStorage.total_bytes + size <= quota)
+    result = db.execute(query.values(
+        total_bytes=UserStorage.total_bytes + size,
+        file_count=UserStorage.file_count + 1
+    ))
+    if result.rowcount == 1:
+        return True
+    if quota is not None:
+        exists = db.query(UserStorage.total_bytes).filter(
+            UserStorage.user_id == user_id,
+            UserStorage.file_type == file_type
+        ).first()
+        if exists or size > quota:
+            # 已達上限
+            return False
+    try:
+        with db.begin_nested():
+            db.add(UserStorage(user_id=user_id, file_type=file_type, total_bytes=size, file_count=1))
+    except IntegrityError:
+        # 其他請求同時建立了同一列
+        return _add(db, user_id, file_type, size, quota)
+    return True
+
+
+def charge_storage(db, user_id: int, file_type: str, size: int, quota: int = None) -> bool:
+    """記錄新增的檔案，超過儲存空間上限時回傳 False (不變更任何資料)"""
+    if not _add(db, user_id, ALL_TYPES, size, quota):
+        return False
+    _add(db, user_id, file_type, size)
+    return True
+
+
+def release_storage(db, entries):
+    """扣除刪除或過期的檔案；entries 為 (user_id, file_type, file_size)"""
+    totals = defaultdict(lambda: [0, 0])
+    for user_id, file_type, size in entries:
+        for key in ((user_id, ALL_TYPES), (user_id, file_type)):
+            totals[key][0] += size or 0
+            totals[key][1] += 1
+    if not totals:
+        return
+    table = UserStorage.__table__
+    db.execute(
+        table.update()
+        .where(table.c.user_id == bindparam("b_user_id"), table.c.file_type == bindparam("b_file_type"))
+        .values(
+            total_bytes=case((table.c.total_bytes > bindparam("b_bytes"), table.c.total_bytes - bindparam("b_bytes")), else_=0),
+            file_count=case((table.c.file_count > bindparam("b_count"), table.c.file_count - bindparam("b_count")), else_=0)
+        ),
+        [
+            {"b_user_id": user_id, "b_file_type": file_type, "b_bytes": size, "b_count": count}
+            for (user_id, file_type), (size, count) in totals.items()
+        ]
+    )
+
+
+def backfill_user_storage(db) -> int:
+    """由既有 user_files 重建儲存空間統計 (部署新表時執行一次)，回傳建立的列數"""
+    db.execute(delete(UserStorage))
+    rows = db.query(
+        UserFile.user_id,
+        UserFile.file_type,
+        func.coalesce(func.sum(UserFile.file_size), 0),
+        func.count(UserFile.id)
+    ).filter(UserFile.status != 'expired').group_by(UserFile.user_id, UserFile.file_type).all()
+
+    totals = {}
+    storage = []
+    for user_id, file_type, total_bytes, file_count in rows:
+        storage.append(UserStorage(user_id=user_id, file_type=file_type, total_bytes=total_bytes, file_count=file_count))
+        total = totals.setdefault(user_id, [0, 0])
+        total[0] += total_bytes
+        total[1] += file_count
+    for user_id, (total_bytes, file_count) in totals.items():
+        storage.append(UserStorage(user_id=user_id, file_type=ALL_TYPES, total_bytes=total_bytes, file_count=file_count))
+    db.add_all(storage)
+    return len(storage)
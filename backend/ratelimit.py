@@ -0,0 +1,197 @@
+"""
+請求速率限制
+以 token bucket 演算法限制每個身分 (使用者 / IP) 對各端點的請求速率：
+每個限制有容量 (允許的瞬間突發量) 與補充時間 (容量全部補滿所需秒數，即長期平均速率)，
+同一端點可同時設定短期突發與長期持續兩組限制
+
+儲存後端：
+- memory: 行程內 bucket (每個 uvicorn worker 各自計算)
+- redis:  Redis 協定相容的伺服器 (多 worker 共用)，以 Lua 腳本原子更新；需安裝 redis 套件
+
+可透過環境變數設定：
+- RATE_LIMIT_ENABLED:   是否啟用 (預設 1)
+- RATE_LIMIT_BACKEND:   memory (預設) 或 redis
+- RATE_LIMIT_REDIS_URL: redis 後端的連線網址
+- RATE_LIMIT_MAX_KEYS:  memory 後端保存的 bucket 上限
+- RATE_LIMIT_BYPASS_TOKEN: 設定後，帶 X-RateLimit-Bypass: <token> 的請求不受限制 (壓力測試用，預設不啟用)
+- 各端點的規則以 parse_limits() 的格式設定 (見 main.py 的 RATE_LIMIT_RULES)，例如 "burst:3/60,sustained:20/3600"
+"""
+
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from cache import TTLCache
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_BYPASS_TOKEN = os.getenv('RATE_LIMIT_BYPASS_TOKEN', '')
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Limit:
+    """token bucket 限制：最多 capacity 次突發，每 period 秒補滿"""
+    name: str
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_limits(spec: str) -> list:
+    """解析 "名稱:次數/秒數,..." 格式的限制 (例如 "burst:3/60,sustained:20/3600")，空字串表示不限制"""
+    limits = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, _, rate = item.partition(":")
+            capacity, _, period = rate.partition("/")
+            limit = Limit(name.strip(), int(capacity), float(period))
+        except ValueError:
+            raise ValueError(f"無效的速率限制設定: {item!r} (格式為 名稱:次數/秒數)")
+        if not limit.name or limit.capacity <= 0 or limit.period <= 0:
+            raise ValueError(f"無效的速率限制設定: {item!r} (格式為 名稱:次數/秒數)")
+        limits.append(limit)
+    return limits
+
+
+@dataclass
+class RateLimitResult:
+    """單次檢查結果 (多個限制時取最嚴格者)"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # bucket 補滿所需秒數
+    retry_after: float = 0.0  # 被拒絕時，下次可請求的秒數
+
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class MemoryBucketStore:
+    """行程內 token bucket"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self._buckets = TTLCache(maxsize=max_keys)  # key -> (tokens, 更新時間)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit):
+        """取用一個 token，回傳 (是否允許, 剩餘 tokens)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - updated_at) * limit.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # bucket 補滿後與新建無異，不必保留
+            self._buckets.set(key, (tokens, now), ttl=limit.period)
+        return allowed, tokens
+
+
+class RedisBucketStore:
+    """Redis 協定相容伺服器上的 token bucket (多 worker 共用)"""
+
+    TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis 需要安裝 redis 套件 (pip install redis)")
+            client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._client = client
+        self._take = self._client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key: str, limit: Limit):
+        allowed, tokens = self._take(keys=[f"ratelimit:{key}"], args=[limit.capacity, limit.rate, time.time()])
+        return bool(allowed), float(tokens)
+
+
+def create_bucket_store(backend: str = RATE_LIMIT_BACKEND):
+    """依設定建立 bucket 儲存後端"""
+    if backend == 'redis':
+        return RedisBucketStore()
+    if backend == 'memory':
+        return MemoryBucketStore()
+    raise ValueError(f"不支援的 RATE_LIMIT_BACKEND: {backend}")
+
+
+class RateLimiter:
+    """依端點規則檢查各身分的請求速率"""
+
+    def __init__(self, rules: dict, store=None, enabled: bool = RATE_LIMIT_ENABLED,
+                 bypass_token: str = RATE_LIMIT_BYPASS_TOKEN):
+        self.rules = rules  # 端點名稱 -> [Limit, ...]
+        self.store = store if store is not None else create_bucket_store()
+        self.enabled = enabled
+        self.bypass_token = bypass_token
+        self.rejected = 0
+
+    def bypassed(self, token: str) -> bool:
+        """請求是否帶有正確的略過 token (未設定 RATE_LIMIT_BYPASS_TOKEN 時一律為 False)"""
+        return bool(self.bypass_token) and bool(token) and hmac.compare_digest(token, self.bypass_token)
+
+    def hit(self, endpoint: str, identities: list) -> RateLimitResult:
+        """為每個身分 (如 'user:1'、'ip:1.2.3.4') 取用各限制的 token，任一不足即拒絕"""
+        limits = self.rules.get(endpoint, [])
+        if not self.enabled or not limits:
+            return None
+        result = None
+        for identity in identities:
+            for limit in limits:
+                try:
+                    allowed, tokens = self.store.take(f"{endpoint}:{limit.name}:{identity}", limit)
+                except Exception as e:
+                    # 儲存後端無法連線時不阻擋請求
+                    logger.warning("速率限制檢查失敗 (%s): %s", endpoint, e)
+                    return None
+                current = RateLimitResult(
+                    allowed=allowed,
+                    limit=limit.capacity,
+                    remaining=int(tokens),
+                    reset_after=(limit.capacity - tokens) / limit.rate,
+                    retry_after=0.0 if allowed else (1 - tokens) / limit.rate
+                )
+                if not allowed:
+                    self.rejected += 1
+                    return current
+                if result is None or current.remaining < result.remaining:
+                    result = current
+        return result
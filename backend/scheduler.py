@@ -0,0 +1,227 @@
+"""
+背景排程器
+定期執行維護工作 (例如清理過期檔案)，由 FastAPI lifespan 啟動與停止
+
+多個 uvicorn worker 或多台主機同時執行時，只有取得 leader 鎖的行程會執行排程工作：
+- PostgreSQL: pg_try_advisory_lock (以連線池之外的專用連線持有，連線中斷時自動釋放)
+- 其他資料庫: 本機鎖檔 (fcntl.flock，行程結束時自動釋放)
+
+可透過環境變數設定：
+- SCHEDULER_ENABLED:    是否啟用排程 (預設 1)
+- SCHEDULER_TICK:       檢查排程與 leader 鎖的間隔秒數
+- SCHEDULER_LOCK_FILE:  非 PostgreSQL 時使用的鎖檔路徑
+"""
+
+import os
+import socket
+import tempfile
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK', '5'))
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'slideai-scheduler.lock'))
+SCHEDULER_ADVISORY_LOCK_KEY = 41901  # pg advisory lock 的鍵值 (同一資料庫內唯一即可)
+
+logger = logging.getLogger(__name__)
+
+
+class AdvisoryLeaderLock:
+    """以 PostgreSQL advisory lock 選出 leader"""
+
+    def __init__(self, engine, key: int = SCHEDULER_ADVISORY_LOCK_KEY):
+        # leader 在整個行程期間持有一條連線；使用不經連線池的專用 engine，
+        # 不佔用請求的連線池 (production 每個 worker 只有 pool_size=2 + max_overflow=1)
+        self.engine = create_engine(engine.url, poolclass=NullPool)
+        self.key = key
+        self._conn = None
+
+    def acquire(self) -> bool:
+        """嘗試取得 (或確認仍持有) leader 鎖"""
+        if self._conn is not None:
+            try:
+                # 確認連線仍存活後立即結束交易，避免連線停留在 idle in transaction
+                # (佔住 snapshot，妨礙 VACUUM 並觸發 idle_in_transaction_session_timeout 中斷連線)
+                self._conn.execute(text("SELECT 1"))
+                self._conn.commit()
+                return True
+            except Exception:
+                # 連線中斷，鎖已隨之釋放
+                self._close()
+        conn = self.engine.connect()
+        try:
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not locked:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def release(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self._conn.commit()
+        except Exception:
+            pass
+        self._close()
+
+    def _close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+
+class FileLeaderLock:
+    """以本機鎖檔選出 leader (同一主機的多個 worker)"""
+
+    def __init__(self, path: str = SCHEDULER_LOCK_FILE):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        import fcntl
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        import fcntl
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def create_leader_lock(engine):
+    """依資料庫類型建立 leader 鎖"""
+    if engine.dialect.name == 'postgresql':
+        return AdvisoryLeaderLock(engine)
+    return FileLeaderLock()
+
+
+class ScheduledTask:
+    """排程工作與其執行統計"""
+
+    def __init__(self, name: str, interval: float, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn  # fn() 回傳本次處理的項目數
+        self.next_run = time.monotonic()
+        self.runs = 0
+        self.failures = 0
+        self.total_processed = 0
+        self.last_processed = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_error = None
+        self.running = False
+
+    def run(self):
+        self.running = True
+        started = time.perf_counter()
+        self.last_run_at = datetime.utcnow()
+        try:
+            processed = self.fn() or 0
+            self.last_processed = processed
+            self.total_processed += processed
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e) or e.__class__.__name__
+            logger.exception("排程工作失敗", extra={"task": self.name})
+        finally:
+            self.runs += 1
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.next_run = time.monotonic() + self.interval
+            self.running = False
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "running": self.running,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_processed": self.last_processed,
+            "total_processed": self.total_processed,
+            "last_error": self.last_error,
+            "next_run_in_seconds": max(0, round(self.next_run - time.monotonic(), 1))
+        }
+
+
+class Scheduler:
+    """單一背景執行緒依序執行到期的排程工作 (僅 leader 行程執行)"""
+
+    def __init__(self, leader_lock, tick: float = SCHEDULER_TICK, enabled: bool = SCHEDULER_ENABLED):
+        self.leader_lock = leader_lock
+        self.tick = tick
+        self.enabled = enabled
+        self.tasks = {}
+        self.is_leader = False
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_task(self, name: str, interval: float, fn):
+        """註冊每 interval 秒執行一次的工作"""
+        self.tasks[name] = ScheduledTask(name, interval, fn)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.leader_lock.release()
+        self.is_leader = False
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.is_leader = self.leader_lock.acquire()
+            except Exception as e:
+                logger.warning("取得排程 leader 鎖失敗: %s", e)
+                self.is_leader = False
+            if self.is_leader:
+                for task in self.tasks.values():
+                    if self._stop.is_set():
+                        break
+                    if time.monotonic() >= task.next_run:
+                        task.run()
+            self._stop.wait(self.tick)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "is_leader": self.is_leader,
+            "tasks": {name: task.stats() for name, task in self.tasks.items()}
+        }
@@ -9,6 +9,7 @@ import sys
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import User, Base
+from tokens import bump_token_version
 from dotenv import load_dotenv
 
 # 載入環境變數
@@ -79,6 +80,7 @@ def remove_admin_by_email(db_session, email):
         return True
     
     user.is_admin = False
+    bump_token_version(db_session, user.id)  # 使既有的管理員 token 失效
     db_session.commit()
     print(f"✅ 成功移除 {email} 的管理員權限")
     return True
@@ -0,0 +1,519 @@
+"""
+跨 worker 共用快取
+uvicorn --workers N 時，各行程自己的 TTLCache 會讓命中率隨 worker 數下降，
+同一份管理統計也會被每個 worker 各算一次。此模組提供可共用的快取層：
+- memory: 行程內 TTLCache (預設，單一 worker 或開發環境)
+- mmap:   同一主機的 worker 共用記憶體映射檔 (預設位於 /dev/shm)，固定大小的雜湊槽，
+          以 fcntl 區段鎖同步；刪除後所有 worker 立即可見
+- redis:  Redis 協定伺服器 (多台主機共用)；行程內另有短 TTL 的本機快取，
+          失效訊息以 pub/sub 廣播給所有 worker
+
+鍵值以命名空間區分 (例如 user:alice@example.com)，各命名空間有自己的 TTL 與命中統計。
+共用後端無法連線時視為未命中 (不影響請求)
+
+可透過環境變數設定：
+- CACHE_BACKEND:         memory、mmap 或 redis
+- CACHE_REDIS_URL:       redis 後端的連線網址
+- CACHE_VERSION:         快取版本，寫入 mmap 檔名與 redis 鍵前綴 (預設為程式碼內容的雜湊)；
+                         不同版本 (部署) 不共用，新版本不會讀到舊結構的值
+- CACHE_LOCAL_TTL:       redis 後端時本機快取的秒數 (漏接失效訊息時的最長延遲)
+- CACHE_MMAP_PATH:       mmap 檔案路徑 (實際檔名附加版本、槽數與大小；啟動時刪除其他版本的檔案)
+- CACHE_MMAP_SLOTS:      雜湊槽數
+- CACHE_MMAP_SLOT_SIZE:  每個槽的位元組數，超過的值不寫入共用快取
+
+共用後端的值以 JSON 保存 (datetime 另行標記，dataclass 轉為 dict)，不使用 pickle：
+能寫入 Redis 的人不應因此能在 API worker 執行程式碼。需要還原為特定型別的命名空間以 decode 指定
+"""
+
+import dataclasses
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+import anyio
+
+from cache import TTLCache, _MISSING
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/1')
+CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'slideai:cache:')
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', '5'))
+CACHE_MMAP_PATH = os.getenv('CACHE_MMAP_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'slideai-cache'))
+CACHE_MMAP_SLOTS = int(os.getenv('CACHE_MMAP_SLOTS', '2048'))
+CACHE_MMAP_SLOT_SIZE = int(os.getenv('CACHE_MMAP_SLOT_SIZE', '4096'))
+
+
+def _code_version() -> str:
+    """目前程式碼的版本 (後端所有 .py 檔內容的雜湊)，程式碼變更後快取自動分開"""
+    hasher = hashlib.blake2b(digest_size=6)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        with open(path, "rb") as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+CACHE_VERSION = os.getenv('CACHE_VERSION') or _code_version()
+
+INVALIDATION_CHANNEL = 'invalidate'
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"無法序列化的快取值: {type(value).__name__}")
+
+
+def _json_object_hook(obj: dict):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def dumps(value) -> bytes:
+    """序列化快取值 (JSON；tuple 還原為 list，dataclass 還原為 dict)"""
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes):
+    """還原 dumps 的結果"""
+    return json.loads(data, object_hook=_json_object_hook)
+
+
+class MmapBackend:
+    """同一主機多個行程共用的記憶體映射快取
+
+    檔案由固定大小的槽組成，每個槽為 (鍵雜湊, 過期時間, 長度, 命名空間) 標頭加上序列化後的值；
+    鍵雜湊決定起始槽，於其後 PROBES 個槽內尋找 (已滿時覆寫最早過期的項目)
+    """
+
+    MAGIC = b"SLDCACH2"
+    HEADER_SIZE = 64
+    ENTRY = struct.Struct("<QdII")  # 鍵雜湊 (0 表示空槽)、過期時間 (time.time())、值長度、命名空間雜湊
+    PROBES = 8
+    local_tier = False  # 讀取直接命中共用記憶體，不需要本機快取與失效廣播
+
+    def __init__(self, path: str = CACHE_MMAP_PATH, slots: int = CACHE_MMAP_SLOTS, slot_size: int = CACHE_MMAP_SLOT_SIZE,
+                 version: str = CACHE_VERSION):
+        if slots < self.PROBES or slot_size <= self.ENTRY.size:
+            raise ValueError("CACHE_MMAP_SLOTS 或 CACHE_MMAP_SLOT_SIZE 過小")
+        # 檔名包含版本與配置：不同版本或配置的行程不會共用 (避免讀到舊結構的物件，或截斷其他行程正在映射的檔案)
+        self.path = f"{path}-{version}-{slots}x{slot_size}"
+        self.version = version
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - self.ENTRY.size
+        self.oversize = 0  # 超過槽大小而未寫入的次數
+        self._lock = threading.Lock()  # fcntl 鎖屬於行程，同一行程的執行緒另以此鎖互斥
+        size = self.HEADER_SIZE + slots * slot_size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size != size or os.pread(self._fd, len(self.MAGIC), 0) != self.MAGIC:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, self.MAGIC, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.HEADER_SIZE, 0)
+        self._map = mmap.mmap(self._fd, size)
+        self._remove_stale(path)
+
+    def _remove_stale(self, base_path: str):
+        """刪除其他版本或配置的檔案 (仍在執行的舊版行程保有自己的映射，不受影響)"""
+        for stale in glob.glob(f"{glob.escape(base_path)}-*"):
+            if stale == self.path:
+                continue
+            try:
+                os.remove(stale)
+                logger.info("刪除舊版本的共用快取檔案 %s", stale)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _namespace_hash(key: str) -> int:
+        return zlib.crc32(key.partition(":")[0].encode("utf-8"))
+
+    def _hash(self, key: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+        return value or 1
+
+    def _window(self, key_hash: int):
+        """鍵的探測範圍 (連續的 PROBES 個槽，回傳第一個槽的 offset)"""
+        first = key_hash % (self.slots - self.PROBES + 1)
+        return self.HEADER_SIZE + first * self.slot_size
+
+    @contextmanager
+    def _locked(self, start: int, exclusive: bool):
+        """鎖定探測範圍 (行程間以 fcntl 區段鎖，行程內以執行緒鎖)"""
+        length = self.PROBES * self.slot_size
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _offsets(self, start: int):
+        return range(start, start + self.PROBES * self.slot_size, self.slot_size)
+
+    def get(self, key: str):
+        key_hash = self._hash(key)
+        start = self._window(key_hash)
+        with self._locked(start, exclusive=False):
+            for offset in self._offsets(start):
+                entry_hash, expires_at, length, _ = self.ENTRY.unpack_from(self._map, offset)
+                if entry_hash == key_hash:
+                    if expires_at <= time.time():
+                        return None
+                    data_start = offset + self.ENTRY.size
+                    return self._map[data_start:data_start + length]
+        return None
+
+    def set(self, key: str, data: bytes, ttl: float):
+        if len(data) > self.capacity:
+            self.oversize += 1
+            return
+        key_hash = self._hash(key)
+        start = self._window(key_hash)
+        now = time.time()
+        with self._locked(start, exclusive=True):
+            target, oldest, oldest_expires = None, None, None
+            for offset in self._offsets(start):
+                entry_hash, expires_at, _, _ = self.ENTRY.unpack_from(self._map, offset)
+                if entry_hash == key_hash:
+                    target = offset
+                    break
+                if target is None and (entry_hash == 0 or expires_at <= now):
+                    target = offset  # 第一個空槽 (仍繼續尋找相同的鍵)
+                if oldest_expires is None or expires_at < oldest_expires:
+                    oldest, oldest_expires = offset, expires_at
+            if target is None:
+                # 沒有空槽時覆寫最早過期的項目
+                target = oldest
+            data_start = target + self.ENTRY.size
+            self._map[data_start:data_start + len(data)] = data
+            self.ENTRY.pack_into(self._map, target, key_hash, now + ttl, len(data), self._namespace_hash(key))
+
+    def delete(self, key: str):
+        key_hash = self._hash(key)
+        start = self._window(key_hash)
+        with self._locked(start, exclusive=True):
+            for offset in self._offsets(start):
+                if self.ENTRY.unpack_from(self._map, offset)[0] == key_hash:
+                    self.ENTRY.pack_into(self._map, offset, 0, 0.0, 0, 0)
+
+    def publish(self, channel: str, message: str):
+        pass
+
+    def subscribe(self, channel: str, callback):
+        pass
+
+    def entry_counts(self, names) -> dict:
+        """各命名空間未過期的項目數 (不加鎖掃描所有槽標頭，為近似值)"""
+        hashes = {self._namespace_hash(f"{name}:"): name for name in names}
+        counts = dict.fromkeys(names, 0)
+        now = time.time()
+        for offset in range(self.HEADER_SIZE, self.HEADER_SIZE + self.slots * self.slot_size, self.slot_size):
+            entry_hash, expires_at, _, namespace_hash = self.ENTRY.unpack_from(self._map, offset)
+            if entry_hash and expires_at > now and namespace_hash in hashes:
+                counts[hashes[namespace_hash]] += 1
+        return counts
+
+    def stats(self) -> dict:
+        return {
+            "backend": "mmap", "path": self.path, "version": self.version,
+            "slots": self.slots, "slot_size": self.slot_size, "oversize": self.oversize
+        }
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class RedisBackend:
+    """Redis 協定後端 (任何相容 RESP 的伺服器皆可)"""
+
+    local_tier = True  # 每次讀取都需網路往返，另保留短 TTL 的本機快取
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_KEY_PREFIX, version: str = CACHE_VERSION,
+                 client=None, subscriber=None):
+        if client is None or subscriber is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("CACHE_BACKEND=redis 需要安裝 redis 套件 (pip install redis)")
+            client = client or redis.Redis.from_url(url, socket_timeout=0.5)
+            # 訂閱使用獨立連線 (長時間阻塞讀取，不套用 socket_timeout)
+            subscriber = subscriber or redis.Redis.from_url(url, health_check_interval=30)
+        self.url = url
+        self.version = version
+        self.channel_prefix = prefix  # 失效訊息不分版本 (部署期間新舊版本的本機快取都會失效)
+        self.prefix = f"{prefix}{version}:"  # 資料鍵分版本，舊版本的項目於 TTL 後自然過期
+        self._client = client
+        self._subscriber = subscriber
+        self._pubsub = None
+        self._thread = None
+
+    def get(self, key: str):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, data: bytes, ttl: float):
+        self._client.set(self.prefix + key, data, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def publish(self, channel: str, message: str):
+        self._client.publish(self.channel_prefix + channel, message)
+
+    def subscribe(self, channel: str, callback):
+        def handler(message):
+            callback(message["data"].decode("utf-8"))
+
+        def on_error(error, pubsub, thread):
+            logger.warning("快取失效訂閱中斷，重新連線: %s", error)
+            time.sleep(1)
+
+        self._pubsub = self._subscriber.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel_prefix + channel: handler})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=on_error)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis", "url": self.url.split("@")[-1], "version": self.version,
+            "subscribed": self._thread is not None and self._thread.is_alive()
+        }
+
+    def close(self):
+        if self._thread is not None:
+            # 背景執行緒結束時會自行關閉 pubsub 連線
+            self._thread.stop()
+            self._thread.join(timeout=2)
+            self._thread = None
+        elif self._pubsub is not None:
+            self._pubsub.close()
+        self._client.close()
+        self._subscriber.close()
+
+
+def create_cache_backend(backend: str = CACHE_BACKEND):
+    """依設定建立共用快取後端 (memory 時回傳 None，只使用行程內快取)"""
+    if backend == 'memory':
+        return None
+    if backend == 'mmap':
+        return MmapBackend()
+    if backend == 'redis':
+        return RedisBackend()
+    raise ValueError(f"不支援的 CACHE_BACKEND: {backend}")
+
+
+class CacheNamespace:
+    """命名空間：自己的 TTL、本機快取與命中統計；decode 將共用後端還原的 JSON 值轉回原本的型別"""
+
+    def __init__(self, cache, name: str, ttl: float, maxsize: int, decode=None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        backend = cache.backend
+        # memory: 本機快取即為全部；redis: 本機快取只保留 CACHE_LOCAL_TTL 秒；mmap: 直接讀取共用記憶體
+        if backend is None:
+            self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        elif backend.local_tier:
+            self.local = TTLCache(maxsize=maxsize, ttl=min(ttl, cache.local_ttl))
+        else:
+            self.local = None
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _shared(self, operation: str, *args):
+        """呼叫共用後端，失敗時記錄並視為未命中"""
+        try:
+            return getattr(self.cache.backend, operation)(*args)
+        except Exception as e:
+            self.cache.errors += 1
+            logger.warning("共用快取 %s 失敗 (%s): %s", operation, self.name, e)
+            return None
+
+    def get(self, key, default=None):
+        key = str(key)
+        if self.local is not None:
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+        if self.cache.backend is None:
+            self.misses += 1
+            return default
+        data = self._shared("get", f"{self.name}:{key}")
+        if data is None:
+            self.misses += 1
+            return default
+        try:
+            value = loads(data)
+            if self.decode is not None:
+                value = self.decode(value)
+        except Exception as e:
+            # 無法還原 (例如結構已變更) 時視為未命中，之後重新計算覆寫
+            self.cache.errors += 1
+            logger.warning("共用快取項目無法還原 (%s): %s", self.name, e)
+            self.misses += 1
+            return default
+        if self.local is not None:
+            self.local.set(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        key = str(key)
+        ttl = self.ttl if ttl is None else ttl
+        if self.local is not None:
+            self.local.set(key, value, min(ttl, self.local.ttl))
+        if self.cache.backend is not None:
+            try:
+                data = dumps(value)
+            except (TypeError, ValueError) as e:
+                self.cache.errors += 1
+                logger.warning("快取值無法序列化 (%s): %s", self.name, e)
+                return
+            self._shared("set", f"{self.name}:{key}", data, ttl)
+
+    def delete(self, key):
+        """使所有 worker 的快取項目失效"""
+        key = str(key)
+        if self.local is not None:
+            self.local.delete(key)
+        if self.cache.backend is not None:
+            self._shared("delete", f"{self.name}:{key}")
+            if self.remote:
+                self._shared("publish", INVALIDATION_CHANNEL, f"{self.name}:{key}")
+
+    @property
+    def remote(self) -> bool:
+        """共用後端是否需要網路往返 (redis)；mmap 與行程內快取不會阻塞"""
+        return self.cache.backend is not None and self.cache.backend.local_tier
+
+    async def aget(self, key, default=None):
+        """get 的非同步版本：本機快取未命中而需查詢 redis 時於執行緒池執行，不阻塞事件迴圈"""
+        if not self.remote:
+            return self.get(key, default)
+        value = self.local.get(str(key), _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        return await anyio.to_thread.run_sync(self.get, key, default)
+
+    async def aset(self, key, value, ttl: float = None):
+        """set 的非同步版本 (寫入 redis 時於執行緒池執行)"""
+        if not self.remote:
+            self.set(key, value, ttl)
+            return
+        await anyio.to_thread.run_sync(self.set, key, value, ttl)
+
+    def get_or_set(self, key, factory, ttl: float = None):
+        """取得快取值，不存在時以 factory() 計算並寫入；同一行程內同一 key 同時只計算一次"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        key = str(key)
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # 等待期間其他呼叫端可能已完成計算
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            try:
+                value = factory()
+                self.set(key, value, ttl)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def __len__(self):
+        """本機快取的項目數"""
+        return len(self.local) if self.local is not None else 0
+
+    def entries(self) -> int:
+        """目前的項目數 (共用後端可計算時為共用的項目數，否則為本機快取的項目數)"""
+        return self.cache.entry_counts().get(self.name, len(self))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "local_size": len(self),
+            "entries": self.entries()
+        }
+
+
+class SharedCache:
+    """共用快取：建立命名空間並處理其他 worker 廣播的失效訊息"""
+
+    def __init__(self, backend=None, local_ttl: float = CACHE_LOCAL_TTL):
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self.namespaces = {}
+        self.errors = 0
+        if backend is not None and backend.local_tier:
+            try:
+                backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+            except Exception as e:
+                # 無法訂閱時本機快取仍會在 CACHE_LOCAL_TTL 後過期
+                logger.warning("無法訂閱快取失效訊息: %s", e)
+
+    def namespace(self, name: str, ttl: float, maxsize: int = 1024, decode=None) -> CacheNamespace:
+        namespace = CacheNamespace(self, name, ttl, maxsize, decode)
+        self.namespaces[name] = namespace
+        return namespace
+
+    def entry_counts(self) -> dict:
+        """各命名空間的項目數 (共用後端不支援計算時為本機快取的項目數)"""
+        counts = {name: len(namespace) for name, namespace in self.namespaces.items()}
+        if self.backend is not None and hasattr(self.backend, "entry_counts"):
+            try:
+                counts.update(self.backend.entry_counts(list(self.namespaces)))
+            except Exception as e:
+                self.errors += 1
+                logger.warning("無法計算共用快取項目數: %s", e)
+        return counts
+
+    def _on_invalidate(self, message: str):
+        name, _, key = message.partition(":")
+        namespace = self.namespaces.get(name)
+        if namespace is not None and namespace.local is not None:
+            namespace.local.delete(key)
+
+    def stats(self) -> dict:
+        backend = self.backend.stats() if self.backend is not None else {"backend": "memory"}
+        return {
+            **backend,
+            "errors": self.errors,
+            "namespaces": {name: namespace.stats() for name, namespace in self.namespaces.items()}
+        }
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
@@ -0,0 +1,484 @@
+"""
+檔案儲存後端
+使用者檔案以「鍵」(相對路徑，例如 blobs/ab/<sha256>.pdf) 存取，不再綁定單一主機的磁碟：
+- local: 本機目錄 (預設 user_files)，單一主機或共用網路磁碟
+- s3:    S3 相容物件儲存 (AWS S3、MinIO 等)，多個 API 節點共用
+
+兩者提供相同介面：
+- writer(key) / put_file(key, src): 串流寫入 (S3 以 multipart upload 分段上傳，記憶體只保留一個分段)
+- read_range(key, start, length):   讀取部分內容 (HTTP Range)
+- presigned_url(key, ...):          有時效的下載網址 (local 以 HMAC 簽章、由 API 的 /api/storage 提供)
+- local_path(key):                  取得本機路徑 (S3 時下載到暫存檔)，供推論等需要檔案路徑的工作使用
+
+資料庫中既有的絕對路徑須位於 STORAGE_LOCAL_ROOT 之下，以相對於該目錄的路徑作為鍵
+(s3 時將 user_files 目錄原樣上傳到 bucket 即可)；根目錄之外的路徑與 .. 一律拒絕
+
+可透過環境變數設定：
+- STORAGE_BACKEND:         local 或 s3
+- STORAGE_LOCAL_ROOT:      local 的根目錄 (預設 ./user_files)
+- STORAGE_PART_SIZE:       multipart upload 的分段大小 (S3 最小 5MB)
+- STORAGE_PRESIGN_SECONDS: 預簽網址的有效秒數
+- STORAGE_SIGNING_KEY:     local 預簽網址的 HMAC 金鑰 (與 JWT 的 SECRET_KEY 分開；
+                           production 必須設定，development 未設定時每次啟動隨機產生)
+- S3_BUCKET / S3_PREFIX / S3_REGION / S3_ENDPOINT_URL / S3_ACCESS_KEY_ID / S3_SECRET_ACCESS_KEY
+- S3_PUBLIC_ENDPOINT_URL:  產生預簽網址時使用的端點 (API 以內部位址連線 MinIO 時，瀏覽器可連線的位址)
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from urllib.parse import quote, urlencode
+
+from health import disk_usage
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+STORAGE_LOCAL_ROOT = os.path.abspath(os.getenv('STORAGE_LOCAL_ROOT', os.path.join(os.getcwd(), "user_files")))
+STORAGE_PART_SIZE = int(os.getenv('STORAGE_PART_SIZE', str(8 * 1024 * 1024)))
+STORAGE_PRESIGN_SECONDS = int(os.getenv('STORAGE_PRESIGN_SECONDS', '300'))
+STORAGE_SIGNING_KEY = os.getenv('STORAGE_SIGNING_KEY', '')
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_PREFIX = os.getenv('S3_PREFIX', '').strip('/')
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+S3_PUBLIC_ENDPOINT_URL = os.getenv('S3_PUBLIC_ENDPOINT_URL') or None
+S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID') or None
+S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY') or None
+
+READ_CHUNK_SIZE = 256 * 1024       # 串流讀取每次回傳的大小
+MIN_PART_SIZE = 5 * 1024 * 1024    # S3 multipart 除最後一段外的最小分段
+SIGNED_URL_PREFIX = "/api/storage"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ObjectInfo:
+    """儲存物件的資訊"""
+    key: str
+    size: int
+    mtime: float   # 最後修改時間 (epoch 秒)
+    etag: str
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    """Content-Disposition (attachment 下載 / inline 直接播放；非 ASCII 檔名以 RFC 5987 編碼)"""
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'{disposition}; filename="{filename}"'
+    return f"{disposition}; filename*=utf-8''{quoted}"
+
+
+def _normalize_key(key: str) -> str:
+    """檢查並正規化相對鍵 (拒絕絕對路徑、.. 等跳出根目錄的路徑)"""
+    if not key or key.startswith(("/", "\\")) or "\x00" in key or os.path.isabs(key):
+        raise ValueError(f"無效的儲存鍵: {key}")
+    normalized = os.path.normpath(key).replace(os.sep, "/")
+    if normalized in ("", ".") or normalized == ".." or normalized.startswith("../"):
+        raise ValueError(f"無效的儲存鍵: {key}")
+    return normalized
+
+
+class LocalStorage:
+    """本機目錄儲存"""
+
+    name = "local"
+    local = True
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT, secret: str = None):
+        os.makedirs(root, exist_ok=True)
+        self.root = os.path.realpath(root)
+        self.spool_dir = self.root  # 上傳暫存與最終位置在同一檔案系統，移入時只需 rename
+        self._secret = (secret or "").encode()
+
+    def path(self, key: str) -> str:
+        """鍵對應的實體路徑；只允許根目錄之內 (含符號連結解析後)，否則拋出 ValueError"""
+        path = os.path.realpath(os.path.join(self.root, self.key_for(key)))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"儲存鍵超出根目錄: {key}")
+        return path
+
+    def key_for(self, path: str) -> str:
+        """實體路徑對應的鍵 (既有記錄的絕對路徑須位於根目錄之下，否則拋出 ValueError)"""
+        if os.path.isabs(path):
+            relative = os.path.relpath(os.path.realpath(path), self.root)
+            if relative == ".." or relative.startswith(".." + os.sep):
+                raise ValueError(f"路徑不在儲存根目錄之下: {path}")
+            path = relative
+        return _normalize_key(path)
+
+    @contextmanager
+    def writer(self, key: str):
+        """串流寫入；區塊正常結束才以 rename 取代目標 (讀取端不會看到寫到一半的檔案)"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                yield f
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def put_file(self, key: str, src_path: str) -> str:
+        """將本機檔案移入儲存 (src_path 會被移走)"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        return key
+
+    def stat(self, key: str):
+        try:
+            st = os.stat(self.path(key))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            return None
+        return ObjectInfo(key=key, size=st.st_size, mtime=st.st_mtime, etag=f"{st.st_mtime_ns:x}-{st.st_size:x}")
+
+    def exists(self, key: str) -> bool:
+        try:
+            return os.path.isfile(self.path(key))
+        except ValueError:
+            return False
+
+    def read_range(self, key: str, start: int = 0, length: int = None):
+        """以 READ_CHUNK_SIZE 逐段讀取 [start, start + length)"""
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining)
+                data = f.read(size)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def delete(self, key: str):
+        """刪除物件，回傳 True (已刪除)、False (失敗) 或 None (已不存在)"""
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("刪除檔案失敗 %s: %s", key, e)
+            return False
+        return True
+
+    def list(self, prefix: str = ""):
+        """逐一回傳根目錄 (或其下 prefix 目錄) 內的物件，略過以 . 開頭的暫存檔"""
+        for root, _, names in os.walk(os.path.join(self.root, prefix) if prefix else self.root):
+            for name in names:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield ObjectInfo(key=self.key_for(path), size=st.st_size, mtime=st.st_mtime, etag="")
+
+    @contextmanager
+    def local_path(self, key: str):
+        """本機路徑 (直接使用實體檔案)"""
+        yield self.path(key)
+
+    def _signature(self, key: str, expires: int, filename: str) -> str:
+        message = f"{key}\n{expires}\n{filename or ''}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def presigned_url(self, key: str, filename: str = None, content_type: str = None,
+                      expires_in: int = STORAGE_PRESIGN_SECONDS) -> str:
+        """以 HMAC 簽章的 API 下載網址 (不需登入，過期後失效)；未設定簽章金鑰或鍵無效時回傳 None"""
+        try:
+            key = self.key_for(key)
+            self.path(key)
+        except ValueError:
+            return None
+        if not self._secret:
+            return None
+        expires = int(time.time()) + expires_in
+        params = {"expires": expires, "sig": self._signature(key, expires, filename)}
+        if filename:
+            params["filename"] = filename
+        return f"{SIGNED_URL_PREFIX}/{quote(key)}?{urlencode(params)}"
+
+    def signed_key(self, key: str, expires: int, sig: str, filename: str = None):
+        """檢查預簽網址的簽章與期限，通過時回傳簽章涵蓋的鍵 (只應提供此鍵)，否則回傳 None
+
+        網址中的鍵必須已是正規化的相對鍵 (與 presigned_url 產生的相同)，絕對路徑與 .. 一律拒絕
+        """
+        if not self._secret or expires < time.time():
+            return None
+        try:
+            normalized = _normalize_key(key)
+        except ValueError:
+            return None
+        if normalized != key:
+            return None
+        if not hmac.compare_digest(self._signature(normalized, expires, filename), sig):
+            return None
+        return normalized
+
+    def usage(self) -> dict:
+        # 每個 worker 定期取樣，不走訪整個目錄樹；檔案數與總大小見 user_storage
+        return {"backend": self.name, **disk_usage(self.root)}
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "root": self.root}
+
+    def close(self):
+        pass
+
+
+class S3MultipartWriter:
+    """以 multipart upload 串流寫入 S3 物件
+
+    累積到 part_size 才上傳一個分段；未超過一個分段的小檔案在 commit 時以單次 PUT 上傳
+    """
+
+    def __init__(self, client, bucket: str, key: str, part_size: int = STORAGE_PART_SIZE, content_type: str = None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.content_type = content_type
+        self.size = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def _extra(self) -> dict:
+        return {"ContentType": self.content_type} if self.content_type else {}
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self._extra()
+            )["UploadId"]
+        number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=bytes(data)
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def commit(self):
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self._extra())
+        else:
+            if self._buffer:
+                self._upload_part(self._buffer)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer = bytearray()
+
+    def abort(self):
+        """放棄上傳 (已上傳的分段由 S3 刪除，不會留下不完整的物件)"""
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.warning("取消 multipart upload 失敗 %s: %s", self.key, e)
+
+
+class S3Storage:
+    """S3 相容物件儲存 (需安裝 boto3)"""
+
+    name = "s3"
+    local = False
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, access_key_id: str = S3_ACCESS_KEY_ID,
+                 secret_access_key: str = S3_SECRET_ACCESS_KEY, public_endpoint_url: str = S3_PUBLIC_ENDPOINT_URL,
+                 part_size: int = STORAGE_PART_SIZE, legacy_root: str = STORAGE_LOCAL_ROOT):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要安裝 boto3 套件 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要設定 S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.endpoint_url = endpoint_url
+        self.part_size = part_size
+        self.legacy_root = os.path.abspath(legacy_root)
+        # 推論等需要本機檔案的工作下載到此目錄；上傳內容也先暫存於此，計算雜湊後才上傳
+        self.spool_dir = os.path.join(tempfile.gettempdir(), "slideai-spool")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        options = {
+            "region_name": region,
+            "aws_access_key_id": access_key_id,
+            "aws_secret_access_key": secret_access_key,
+            "config": Config(signature_version="s3v4", retries={"max_attempts": 3, "mode": "standard"},
+                             max_pool_connections=32)
+        }
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, **options)
+        # 預簽網址只在本機計算簽章，使用瀏覽器可連線的端點
+        self._presign_client = (
+            boto3.client("s3", endpoint_url=public_endpoint_url, **options)
+            if public_endpoint_url else self.client
+        )
+
+    def key_for(self, path: str) -> str:
+        """記錄中的路徑對應的鍵 (既有絕對路徑以相對於 legacy_root 的路徑為鍵，根目錄之外拋出 ValueError)"""
+        if os.path.isabs(path):
+            relative = os.path.relpath(path, self.legacy_root)
+            if relative == ".." or relative.startswith(".." + os.sep):
+                raise ValueError(f"路徑不在儲存根目錄之下: {path}")
+            path = relative
+        return _normalize_key(path)
+
+    def _object_key(self, key: str) -> str:
+        key = self.key_for(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error) -> bool:
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    @contextmanager
+    def writer(self, key: str, content_type: str = None):
+        """multipart upload 串流寫入；區塊正常結束才完成上傳，例外時取消"""
+        writer = S3MultipartWriter(self.client, self.bucket, self._object_key(key), self.part_size, content_type)
+        try:
+            yield writer
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def put_file(self, key: str, src_path: str) -> str:
+        """以 multipart upload 上傳本機檔案，成功後刪除 src_path"""
+        with open(src_path, "rb") as f, self.writer(key) as out:
+            for block in iter(lambda: f.read(self.part_size), b""):
+                out.write(block)
+        os.remove(src_path)
+        return key
+
+    def stat(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ValueError:
+            return None
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return ObjectInfo(
+            key=key,
+            size=response["ContentLength"],
+            mtime=response["LastModified"].timestamp(),
+            etag=response.get("ETag", "").strip('"')
+        )
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def read_range(self, key: str, start: int = 0, length: int = None):
+        """以 Range GET 讀取 [start, start + length)，邊下載邊回傳"""
+        options = {}
+        if length is not None:
+            if length <= 0:
+                return
+            options["Range"] = f"bytes={start}-{start + length - 1}"
+        elif start:
+            options["Range"] = f"bytes={start}-"
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **options)["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        """刪除物件，回傳 True (已刪除) 或 False (失敗)；S3 刪除不存在的物件也視為成功"""
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            logger.warning("刪除物件失敗 %s: %s", key, e)
+            return False
+        return True
+
+    def list(self, prefix: str = ""):
+        """逐頁列出物件 (每頁最多 1000 筆)"""
+        base = f"{self.prefix}/" if self.prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base + prefix):
+            for item in page.get("Contents", []):
+                key = item["Key"][len(base):]
+                if os.path.basename(key).startswith("."):
+                    continue
+                yield ObjectInfo(
+                    key=key, size=item["Size"], mtime=item["LastModified"].timestamp(),
+                    etag=item.get("ETag", "").strip('"')
+                )
+
+    @contextmanager
+    def local_path(self, key: str):
+        """下載到暫存檔 (並行分段下載)，離開區塊時刪除"""
+        suffix = os.path.splitext(key)[1]
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.spool_dir)
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), path)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def presigned_url(self, key: str, filename: str = None, content_type: str = None,
+                      expires_in: int = STORAGE_PRESIGN_SECONDS) -> str:
+        """直接向物件儲存下載的預簽網址 (支援 Range，不經過 API)"""
+        params = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if filename:
+            params["ResponseContentDisposition"] = content_disposition(filename)
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self._presign_client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+    def usage(self) -> dict:
+        # 列出整個 bucket 的成本隨物件數增加，健康檢查只回報設定；用量見 user_storage
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "bucket": self.bucket, "prefix": self.prefix, "endpoint": self.endpoint_url}
+
+    def close(self):
+        self.client.close()
+
+
+def create_storage(backend: str = STORAGE_BACKEND, secret: str = STORAGE_SIGNING_KEY, production: bool = False):
+    """依設定建立儲存後端；secret 用於 local 預簽網址的簽章 (production 必須設定)"""
+    if backend == "s3":
+        return S3Storage()
+    if backend != "local":
+        raise ValueError(f"不支援的 STORAGE_BACKEND: {backend}")
+    if not secret:
+        if production:
+            raise RuntimeError("STORAGE_BACKEND=local 於 production 需要設定 STORAGE_SIGNING_KEY")
+        # 開發環境：每次啟動隨機產生 (重新啟動後舊的預簽網址失效；多個 worker 時請明確設定)
+        logger.warning("未設定 STORAGE_SIGNING_KEY，使用隨機產生的預簽網址金鑰")
+        secret = secrets.token_hex(32)
+    return LocalStorage(secret=secret)
+
@@ -0,0 +1,210 @@
+"""
+過期檔案清理與檔案系統/資料庫對帳
+- sweep_expired: 以 keyset (id > 上一批最後一筆) 分批取出過期記錄，每批以單一 UPDATE 標記、
+  批次釋放內容引用並 commit 一次；commit 後才以執行緒池並行刪除儲存物件
+  (刪除失敗的物件留在儲存中，由孤兒檔案對帳再次處理，不會出現記錄指向已刪除檔案的情況)
+- reconcile: 雙向對帳
+  - 記錄仍有效但儲存物件已不存在：標記為 expired 並釋放內容引用
+  - 儲存後端中沒有任何記錄引用的物件 (孤兒檔案)：刪除
+  只處理超過 SWEEP_GRACE_SECONDS 的記錄與檔案，避免與上傳中的請求競爭
+
+每次執行回傳 SweepReport (處理筆數、刪除檔案數、耗時與 files/sec)，最近一次結果見 stats()
+
+可透過環境變數設定：
+- SWEEP_DELETE_WORKERS: 並行刪除 (與檢查) 物件的執行緒數 (物件儲存的每次呼叫都是一次網路往返)
+- SWEEP_GRACE_SECONDS:  對帳時忽略最近建立的記錄與檔案的秒數
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from blobstore import release_blobs
+from quota import release_storage
+from models import UserFile, ProcessingJob, StoredBlob, UploadSession
+
+SWEEP_DELETE_WORKERS = int(os.getenv('SWEEP_DELETE_WORKERS', '8'))
+SWEEP_GRACE_SECONDS = int(os.getenv('SWEEP_GRACE_SECONDS', '3600'))
+
+# 標記過期時需要的欄位 (釋放實體檔案與儲存空間統計)
+EXPIRE_COLUMNS = (UserFile.id, UserFile.user_id, UserFile.file_type, UserFile.file_size, UserFile.file_path, UserFile.content_hash)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepReport:
+    """單次清理或對帳的結果"""
+    rows: int = 0            # 標記為 expired 的記錄數
+    batches: int = 0
+    files_deleted: int = 0   # 實際刪除的實體檔案數
+    files_failed: int = 0    # 刪除失敗 (留待下次對帳)
+    missing_rows: int = 0    # 實體檔案已不存在的記錄數
+    orphan_files: int = 0    # 沒有記錄引用而刪除的檔案數
+    seconds: float = 0.0
+
+    @property
+    def files_per_sec(self) -> float:
+        return round(self.files_deleted / self.seconds, 1) if self.seconds > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "seconds": round(self.seconds, 3), "files_per_sec": self.files_per_sec}
+
+
+class Sweeper:
+    """批次清理過期檔案並對帳儲存後端與資料庫"""
+
+    def __init__(self, storage, workers: int = SWEEP_DELETE_WORKERS, grace_seconds: int = SWEEP_GRACE_SECONDS):
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.grace_seconds = grace_seconds
+        self.last_reports = {}
+
+    def _delete_files(self, executor, paths, report: SweepReport):
+        paths = list(dict.fromkeys(path for path in paths if path))
+        results = list(executor.map(self.storage.delete, paths))
+        report.files_deleted += results.count(True)
+        report.files_failed += results.count(False)
+
+    def _expire_rows(self, db, rows) -> list:
+        """將記錄標記為 expired 並釋放內容引用與儲存空間 (不 commit)，回傳應刪除的儲存鍵"""
+        # 只釋放本次實際標記的記錄 (刪除端點可能同時已釋放同一筆)
+        file_ids = set(db.execute(
+            update(UserFile)
+            .where(UserFile.id.in_([row.id for row in rows]), UserFile.status != 'expired')
+            .values(status='expired')
+            .returning(UserFile.id)
+        ).scalars())
+        if not file_ids:
+            return []
+        rows = [row for row in rows if row.id in file_ids]
+        job_results = db.query(ProcessingJob.result_path, ProcessingJob.result_hash).filter(
+            ProcessingJob.file_id.in_(sorted(file_ids)),
+            ProcessingJob.result_path.isnot(None)
+        ).all()
+        release_storage(db, [(row.user_id, row.file_type, row.file_size) for row in rows])
+        entries = [(row.file_path, row.content_hash) for row in rows] + job_results
+        paths = [path for path, content_hash in entries if not content_hash]
+        paths.extend(release_blobs(db, [content_hash for _, content_hash in entries if content_hash]))
+        return paths
+
+    def _finish(self, kind: str, report: SweepReport, started: float) -> SweepReport:
+        report.seconds = time.perf_counter() - started
+        self.last_reports[kind] = {**report.as_dict(), "finished_at": datetime.utcnow().isoformat()}
+        if report.rows or report.files_deleted or report.files_failed:
+            logger.info("檔案清理完成", extra={"kind": kind, **report.as_dict()})
+        return report
+
+    def sweep_expired(self, db, batch_size: int, max_batches: int = None) -> SweepReport:
+        """分批清理過期檔案 (每批一次 commit)"""
+        started = time.perf_counter()
+        report = SweepReport()
+        now = datetime.utcnow()
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sweep") as executor:
+            while max_batches is None or report.batches < max_batches:
+                rows = db.query(*EXPIRE_COLUMNS).filter(
+                    UserFile.id > last_id,
+                    UserFile.expires_at < now,
+                    UserFile.status != 'expired'
+                ).order_by(UserFile.id).limit(batch_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                try:
+                    paths = self._expire_rows(db, rows)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    logger.exception("清理過期檔案失敗 (id %s-%s)", rows[0].id, rows[-1].id)
+                    raise
+                self._delete_files(executor, paths, report)
+                report.rows += len(rows)
+                report.batches += 1
+        return self._finish("expired", report, started)
+
+    def reconcile(self, db, batch_size: int, max_batches: int = None) -> SweepReport:
+        """雙向對帳：遺失實體檔案的記錄與沒有記錄引用的檔案"""
+        started = time.perf_counter()
+        report = SweepReport()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sweep") as executor:
+            self._reconcile_missing(db, executor, batch_size, max_batches, report)
+            self._reconcile_orphans(db, executor, report)
+        return self._finish("reconcile", report, started)
+
+    def _reconcile_missing(self, db, executor, batch_size: int, max_batches: int, report: SweepReport):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        last_id = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = db.query(*EXPIRE_COLUMNS).filter(
+                UserFile.id > last_id,
+                UserFile.status != 'expired',
+                UserFile.created_at < cutoff
+            ).order_by(UserFile.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            batches += 1
+            exists = executor.map(self.storage.exists, [row.file_path for row in rows])
+            missing = [row for row, found in zip(rows, exists) if not found]
+            if not missing:
+                continue
+            try:
+                paths = self._expire_rows(db, missing)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            logger.warning("檔案記錄的儲存物件已不存在，標記為過期", extra={
+                "count": len(missing), "file_ids": [row.id for row in missing][:20]
+            })
+            self._delete_files(executor, paths, report)
+            report.rows += len(missing)
+            report.missing_rows += len(missing)
+        report.batches += batches
+
+    def _referenced_keys(self, db) -> set:
+        """所有記錄引用中的儲存鍵 (既有絕對路徑轉為鍵)"""
+        queries = [
+            db.query(UserFile.file_path).filter(UserFile.status != 'expired'),
+            db.query(ProcessingJob.result_path).filter(ProcessingJob.result_path.isnot(None)),
+            db.query(StoredBlob.file_path),
+            db.query(UploadSession.temp_path)
+        ]
+        referenced = set()
+        for query in queries:
+            for path, in query.yield_per(1000):
+                try:
+                    referenced.add(self.storage.key_for(path))
+                except ValueError:
+                    continue  # 儲存根目錄之外的舊記錄，不對應任何物件
+        return referenced
+
+    def _reconcile_orphans(self, db, executor, report: SweepReport):
+        # 只刪除最後修改早於寬限時間的檔案 (讀取引用之後才建立的檔案不會被誤刪)
+        cutoff = time.time() - self.grace_seconds
+        referenced = self._referenced_keys(db)
+        db.rollback()  # 結束唯讀交易
+        orphans = [
+            item.key for item in self.storage.list()
+            if item.key not in referenced and item.mtime < cutoff
+        ]
+        if orphans:
+            logger.warning("刪除沒有記錄引用的檔案", extra={"count": len(orphans)})
+            deleted_before = report.files_deleted
+            self._delete_files(executor, orphans, report)
+            report.orphan_files += report.files_deleted - deleted_before
+
+    def stats(self) -> dict:
+        return {
+            "storage": self.storage.name,
+            "workers": self.workers,
+            "grace_seconds": self.grace_seconds,
+            "last": self.last_reports
+        }
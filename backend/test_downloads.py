@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+檔案內容回應測試
+Range 解析 (單段、open-ended、suffix、多段、超出範圍) 與 If-Range / If-None-Match 的回應狀態
+"""
+
+import pytest
+from starlette.requests import Request
+
+from downloads import RangeNotSatisfiable, parse_range, serve_object
+
+SIZE = 1000
+ETAG = '"abc123"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=900-", (900, 100)),
+    ("bytes=990-2000", (990, 10)),  # 終點超出檔案大小時截到檔尾
+    ("bytes=-100", (900, 100)),  # 最後 100 個位元組
+    ("bytes=-5000", (0, SIZE)),  # suffix 大於檔案時回傳完整內容
+    ("BYTES = 5-9", (5, 5)),
+])
+def test_parse_single_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=0-99,200-299",  # 多段 (含重疊) 一律忽略 Range
+    "bytes=0-499,100-199",
+    "items=0-9",
+    "bytes=abc-",
+    "bytes=10",
+    "bytes=50-10",  # 終點小於起點視為格式錯誤
+])
+def test_parse_ignored_range(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_parse_unsatisfiable_range(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+def make_request(headers: dict) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/download", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+def serve(headers: dict):
+    return serve_object(make_request(headers), storage=None, key="blob", size=SIZE, etag=ETAG,
+                        media_type="video/mp4", filename="clip.mp4")
+
+
+def test_serve_partial_content():
+    response = serve({"range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 900-999/1000"
+    assert response.headers["content-length"] == "100"
+
+
+def test_serve_unsatisfiable_range():
+    response = serve({"range": "bytes=1000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1000"
+
+
+def test_serve_if_range_mismatch_returns_full_content():
+    # 內容已變更：忽略 Range (含超出範圍的 Range)，回傳完整的新內容
+    for range_header in ("bytes=0-99", "bytes=1000-"):
+        response = serve({"range": range_header, "if-range": '"old"'})
+        assert response.status_code == 200
+        assert response.headers["content-length"] == str(SIZE)
+    assert serve({"range": "bytes=0-99", "if-range": ETAG}).status_code == 206
+
+
+def test_serve_not_modified():
+    response = serve({"if-none-match": f"W/{ETAG}", "range": "bytes=0-99"})
+    assert response.status_code == 304
+    assert response.headers["etag"] == ETAG
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+推論執行器測試
+逾時或崩潰時只終止該工作的行程，同時執行的其他推論不受影響
+"""
+
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from inference import InferenceRunner, InferenceTimeoutError
+
+
+def sleep_then_return(seconds: float, value):
+    time.sleep(seconds)
+    return value
+
+
+def crash():
+    os._exit(1)
+
+
+def fail():
+    raise ValueError("模型錯誤")
+
+
+def run_in_thread(runner, *args, **kwargs):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = runner.run(*args, **kwargs)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, outcome
+
+
+@pytest.fixture
+def runner():
+    runner = InferenceRunner(max_workers=2, max_pending=2, timeout=10, max_tasks_per_child=0)
+    yield runner
+    runner.shutdown()
+
+
+def test_timeout_does_not_affect_other_tasks(runner):
+    thread, outcome = run_in_thread(runner, sleep_then_return, 1.0, "ok")
+    with pytest.raises(InferenceTimeoutError):
+        runner.run(sleep_then_return, 30, "slow", timeout=0.3)
+    thread.join()
+    assert outcome == {"result": "ok"}
+    assert runner.timeouts == 1
+    # 被終止的行程已替換，之後的工作正常執行
+    assert runner.run(sleep_then_return, 0, 42) == 42
+
+
+def test_crash_does_not_affect_other_tasks(runner):
+    thread, outcome = run_in_thread(runner, sleep_then_return, 1.0, "ok")
+    time.sleep(0.2)
+    with pytest.raises(BrokenProcessPool):
+        runner.run(crash)
+    thread.join()
+    assert outcome == {"result": "ok"}
+    assert runner.crashes == 1
+    assert runner.run(sleep_then_return, 0, "again") == "again"
+
+
+def test_task_exception_keeps_worker(runner):
+    with pytest.raises(ValueError):
+        runner.run(fail)
+    assert len(runner._idle) == 1
+    assert runner.run(sleep_then_return, 0, 1) == 1
+    assert len(runner._idle) == 1
+
+
+def test_worker_recycled_after_max_tasks():
+    runner = InferenceRunner(max_workers=1, max_pending=0, timeout=10, max_tasks_per_child=2)
+    try:
+        first = runner.run(os.getpid)
+        assert runner.run(os.getpid) == first
+        assert runner._idle == []  # 第 2 個工作後回收
+        assert runner.run(os.getpid) != first
+        assert len(runner._idle) == 1
+    finally:
+        runner.shutdown()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+工作佇列測試
+租約 (心跳) 逾時的執行中工作會重新排入並再次執行
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from jobs import BaseJobQueue, InProcessJobQueue
+from models import ProcessingJob
+
+
+def add_job(session_factory, state: str, **fields):
+    db = session_factory()
+    try:
+        job = ProcessingJob(id=str(uuid.uuid4()), user_id=1, file_id=1,
+                            job_type="echo", state=state, **fields)
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def get_job(session_factory, job_id: str):
+    db = session_factory()
+    try:
+        return db.get(ProcessingJob, job_id)
+    finally:
+        db.close()
+
+
+def test_base_queue_is_abstract():
+    with pytest.raises(TypeError):
+        BaseJobQueue(sessionmaker())
+
+
+def test_memory_queue_requeues_expired_lease(session_factory):
+    queue = InProcessJobQueue(session_factory, workers=1)
+    expired = datetime.utcnow() - timedelta(seconds=queue.lease_seconds + 60)
+    # 上一個行程當機時留下的執行中工作
+    job_id = add_job(session_factory, "running", worker_id="crashed:1", started_at=expired, heartbeat_at=expired)
+    live_id = add_job(session_factory, "running", worker_id="other:2", started_at=expired, heartbeat_at=datetime.utcnow())
+
+    queue._heartbeat()
+    assert get_job(session_factory, job_id).state == "queued"
+    assert get_job(session_factory, live_id).state == "running"
+    assert queue._queue.get_nowait() == job_id
+
+    done = threading.Event()
+    queue.register("echo", lambda job, db: done.set())
+    queue._execute(job_id)
+    assert done.is_set()
+    assert get_job(session_factory, job_id).state == "done"
+
+
+def test_heartbeat_renews_lease_of_running_job(session_factory):
+    queue = InProcessJobQueue(session_factory, workers=1)
+    job_id = add_job(session_factory, "queued")
+    renewed = {}
+
+    def handler(job, db):
+        # 執行超過租約時間的工作：心跳更新後不會被重新排入
+        db.query(ProcessingJob).filter(ProcessingJob.id == job.id).update(
+            {"heartbeat_at": datetime.utcnow() - timedelta(seconds=queue.lease_seconds + 60)})
+        db.commit()
+        queue._heartbeat()
+        db.expire_all()
+        renewed["state"] = db.get(ProcessingJob, job.id).state
+
+    queue.register("echo", handler)
+    queue._execute(job_id)
+    assert renewed["state"] == "running"
+    assert queue._queue.empty()
+    assert get_job(session_factory, job_id).state == "done"
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+查詢次數測試
+計算管理端點實際送出的 SQL 數量，避免 N+1 查詢再次出現
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+import conftest  # noqa: F401 測試資料庫與儲存目錄 (直接執行本檔時同樣須在匯入 main 之前設定)
+import main
+from models import User, UserFile
+
+ADMIN = main.UserSnapshot(id=0, email="admin@example.com", is_admin=True)
+
+
+@contextmanager
+def count_queries(engine):
+    """記錄區塊內送出的 SQL 語句"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed_files(count: int):
+    """建立 count 個使用者，各有一個檔案記錄"""
+    db = main.SessionLocal()
+    try:
+        now = datetime.utcnow()
+        for i in range(count):
+            user = User(email=f"user{i}-{now.timestamp()}@example.com", hashed_password="x")
+            db.add(user)
+            db.flush()
+            db.add(UserFile(
+                user_id=user.id,
+                file_name=f"file{i}.mp4",
+                file_path=f"/nonexistent/file{i}.mp4",
+                file_type="video_abstract",
+                file_size=100,
+                status="completed",
+                analysis_result="摘要" * 1000,
+                expires_at=now + timedelta(days=7)
+            ))
+        db.commit()
+        return db.query(UserFile.id).order_by(UserFile.id.desc()).first()[0]
+    finally:
+        db.close()
+
+
+def test_recent_uploads_single_query():
+    seed_files(200)
+    db = main.SessionLocal()
+    try:
+        with count_queries(main.engine) as statements:
+            result = main.get_recent_uploads(limit=200, current_user=ADMIN, db=db)
+        uploads = result["recent_uploads"]
+        assert len(uploads) == 200
+        assert all(item["user_email"] != "Unknown" for item in uploads)
+        assert "analysis_result" not in uploads[0]
+        assert len(statements) == 1, statements
+        assert "analysis_result" not in statements[0]
+    finally:
+        db.close()
+
+
+def test_recent_uploads_include_result():
+    seed_files(5)
+    db = main.SessionLocal()
+    try:
+        with count_queries(main.engine) as statements:
+            result = main.get_recent_uploads(limit=5, include_result=True, current_user=ADMIN, db=db)
+        assert all(item["analysis_result"] for item in result["recent_uploads"])
+        assert len(statements) == 1, statements
+    finally:
+        db.close()
+
+
+def test_verify_upload_single_query():
+    file_id = seed_files(1)
+    db = main.SessionLocal()
+    try:
+        with count_queries(main.engine) as statements:
+            result = main.verify_file_upload(file_id=file_id, current_user=ADMIN, db=db)
+        assert result["user_info"]["email"].startswith("user0-")
+        assert result["verification"]["file_exists_in_fs"] is False
+        assert len(statements) == 1, statements
+    finally:
+        db.close()
+
+
+def test_sweep_expired_queries_per_batch():
+    """過期檔案清理每批固定查詢數，不隨檔案數增加"""
+    files_dir = tempfile.mkdtemp(dir=main.storage.root)
+    db = main.SessionLocal()
+    try:
+        user = User(email=f"sweep-{datetime.utcnow().timestamp()}@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        expired_at = datetime.utcnow() - timedelta(days=1)
+        for i in range(120):
+            path = os.path.join(files_dir, f"expired{i}.mp4")
+            open(path, "wb").close()
+            db.add(UserFile(
+                user_id=user.id,
+                file_name=f"expired{i}.mp4",
+                file_path=path,
+                file_type="video_abstract",
+                file_size=0,
+                status="completed",
+                expires_at=expired_at
+            ))
+        db.commit()
+
+        with count_queries(main.engine) as statements:
+            report = main.sweeper.sweep_expired(db, batch_size=50)
+        assert report.rows == 120
+        assert report.batches == 3
+        assert report.files_deleted == 120
+        assert os.listdir(files_dir) == []
+        # 每批：取出記錄、標記過期、扣除儲存空間 (executemany)、查詢工作產出；最後一次確認沒有剩餘
+        assert len(statements) == 4 * report.batches + 1, statements
+    finally:
+        db.close()
+
+
+def make_request(headers: dict = None):
+    from starlette.requests import Request
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": raw})
+
+
+def test_admin_stats_not_modified_without_queries():
+    """管理統計的 ETag 來自快照，相符時回應 304 且不查詢資料庫"""
+    seed_files(1)
+    main.stats_cache.delete("usage_statistics:" + main.usage_day().isoformat())
+    db = main.SessionLocal()
+    try:
+        response = main.admin_usage_statistics(request=make_request(), current_user=ADMIN, db=db)
+        etag = response.headers["etag"]
+        with count_queries(main.engine) as statements:
+            cached = main.admin_usage_statistics(request=make_request({"If-None-Match": etag}), current_user=ADMIN, db=db)
+        assert cached.status_code == 304
+        assert statements == []
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_recent_uploads_single_query()
+    test_recent_uploads_include_result()
+    test_verify_upload_single_query()
+    test_sweep_expired_queries_per_batch()
+    test_admin_stats_not_modified_without_queries()
+    print("🎉 查詢次數測試通過！")
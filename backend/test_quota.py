@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+儲存空間額度測試
+charge_storage 的條件式 UPDATE 使並發上傳不會超過上限；
+刪除與過期清理同時扣除檔案類型列與合計列；健康檢查的總用量讀取合計列
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import main
+from models import User, UserFile
+from quota import ALL_TYPES, charge_storage, get_storage_bytes, get_total_storage, get_user_storage
+from storage import LocalStorage
+from sweeper import Sweeper
+
+SIZE = 100
+QUOTA = 10 * SIZE
+
+
+def charge(session_factory, user_id: int = 1, file_type: str = "video_abstract", quota: int = QUOTA) -> bool:
+    db = session_factory()
+    try:
+        charged = charge_storage(db, user_id, file_type, SIZE, quota)
+        db.commit()
+        return charged
+    finally:
+        db.close()
+
+
+def test_concurrent_charges_do_not_exceed_quota(session_factory):
+    assert charge(session_factory)  # 先建立統計列，並發請求只會執行條件式 UPDATE
+    results = []
+    barrier = threading.Barrier(20)
+
+    def worker():
+        barrier.wait()
+        results.append(charge(session_factory))
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == QUOTA // SIZE - 1
+    db = session_factory()
+    try:
+        assert get_storage_bytes(db, 1) == QUOTA
+        assert get_user_storage(db, 1)["by_type"]["video_abstract"] == {"bytes": QUOTA, "file_count": QUOTA // SIZE}
+    finally:
+        db.close()
+
+
+def test_charge_rechecks_quota_after_stale_read(session_factory):
+    for _ in range(QUOTA // SIZE - 1):
+        assert charge(session_factory)
+
+    # 兩個請求都讀到「尚餘一個檔案的空間」，只有一個能完成扣除
+    first, second = session_factory(), session_factory()
+    try:
+        assert get_storage_bytes(first, 1) + SIZE <= QUOTA
+        assert get_storage_bytes(second, 1) + SIZE <= QUOTA
+        assert charge_storage(first, 1, "ppt_to_video", SIZE, QUOTA)
+        first.commit()
+        assert not charge_storage(second, 1, "video_abstract", SIZE, QUOTA)
+        second.commit()
+        summary = get_user_storage(second, 1)
+        assert summary["bytes"] == QUOTA
+        assert summary["by_type"]["video_abstract"]["bytes"] == QUOTA - SIZE  # 被拒絕時不變更類型列
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sweep_releases_type_and_total_rows(session_factory, tmp_path):
+    db = session_factory()
+    try:
+        expired = datetime.utcnow() - timedelta(days=1)
+        files = [("video_abstract", expired), ("video_abstract", expired),
+                 ("ppt_to_video", expired), ("ppt_to_video", datetime.utcnow() + timedelta(days=1))]
+        for i, (file_type, expires_at) in enumerate(files):
+            assert charge_storage(db, 1, file_type, SIZE, QUOTA)
+            db.add(UserFile(user_id=1, file_name="clip", file_path=f"{file_type}-{i}",
+                            file_type=file_type, file_size=SIZE, expires_at=expires_at))
+            db.commit()
+
+        report = Sweeper(LocalStorage(str(tmp_path))).sweep_expired(db, batch_size=2)
+        assert report.rows == 3
+        assert get_user_storage(db, 1) == {
+            "bytes": SIZE,
+            "file_count": 1,
+            "by_type": {
+                "video_abstract": {"bytes": 0, "file_count": 0},
+                "ppt_to_video": {"bytes": SIZE, "file_count": 1},
+            },
+        }
+        # 再次清理不會重複扣除
+        assert Sweeper(LocalStorage(str(tmp_path))).sweep_expired(db, batch_size=2).rows == 0
+        assert get_storage_bytes(db, 1) == SIZE
+    finally:
+        db.close()
+
+
+def test_delete_releases_type_and_total_rows(monkeypatch):
+    monkeypatch.setattr(main, "STORAGE_QUOTA_BYTES", QUOTA)
+    db = main.SessionLocal()
+    try:
+        user = User(email=f"quota-{datetime.utcnow().timestamp()}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        assert main.check_storage_quota(user, QUOTA, db)
+        assert not main.check_storage_quota(user, QUOTA + 1, db)
+
+        records = [main.create_file_record(user, "clip.mp4", f"quota/{user.id}-{i}.mp4", file_type, SIZE, db)
+                   for i, file_type in enumerate(("video_abstract", "ppt_to_video"))]
+        assert not main.check_storage_quota(user, QUOTA - SIZE, db)
+
+        main.release_file_storage(records[0], db)
+        db.commit()
+        summary = get_user_storage(db, user.id)
+        assert summary["bytes"] == SIZE and summary["file_count"] == 1
+        assert summary["by_type"]["video_abstract"] == {"bytes": 0, "file_count": 0}
+        assert summary["by_type"]["ppt_to_video"] == {"bytes": SIZE, "file_count": 1}
+        assert main.check_storage_quota(user, QUOTA - SIZE, db)
+        assert ALL_TYPES not in summary["by_type"]
+    finally:
+        db.close()
+
+
+def test_total_storage_sums_total_rows(session_factory):
+    db = session_factory()
+    try:
+        assert get_total_storage(db) == {"files": 0, "size_mb": 0.0, "users": 0}
+        for user_id, file_type in ((1, "video_abstract"), (1, "ppt_to_video"), (2, "video_abstract")):
+            assert charge_storage(db, user_id, file_type, 512 * 1024)
+        db.commit()
+        assert get_total_storage(db) == {"files": 3, "size_mb": 1.5, "users": 2}
+    finally:
+        db.close()
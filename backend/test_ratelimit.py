@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+請求速率限制測試
+token bucket 的突發上限與補充速率 (memory 與 redis Lua 腳本兩種後端)，以及端點規則設定
+"""
+
+import time
+
+import pytest
+
+import ratelimit
+from ratelimit import Limit, MemoryBucketStore, RateLimiter, RedisBucketStore, parse_limits
+
+
+class FakeClock:
+    """取代 time 模組，讓測試控制經過的時間"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    return fake
+
+
+def redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis 需要 lupa 才能執行 Lua 腳本
+    return RedisBucketStore(client=fakeredis.FakeRedis())
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, clock):
+    return MemoryBucketStore() if request.param == "memory" else redis_store()
+
+
+def take_all(store, key, limit, count):
+    return [store.take(key, limit)[0] for _ in range(count)]
+
+
+def test_burst_then_reject(store):
+    limit = Limit("burst", 3, 60)
+    assert take_all(store, "k", limit, 4) == [True, True, True, False]
+
+
+def test_refill_rate(store, clock):
+    limit = Limit("burst", 3, 60)  # 每 20 秒補充一個 token
+    take_all(store, "k", limit, 3)
+    clock.now += 19
+    assert store.take("k", limit)[0] is False
+    clock.now += 1
+    allowed, tokens = store.take("k", limit)
+    assert allowed is True
+    assert tokens == pytest.approx(0.0, abs=1e-6)
+
+
+def test_refill_caps_at_capacity(store, clock):
+    limit = Limit("burst", 3, 60)
+    take_all(store, "k", limit, 3)
+    clock.now += 3600
+    assert take_all(store, "k", limit, 4) == [True, True, True, False]
+
+
+def test_keys_are_independent(store):
+    limit = Limit("burst", 1, 60)
+    assert store.take("a", limit)[0] is True
+    assert store.take("b", limit)[0] is True
+    assert store.take("a", limit)[0] is False
+
+
+def test_limiter_rejects_on_any_identity(clock):
+    limiter = RateLimiter({"upload": [Limit("burst", 2, 60)]}, store=MemoryBucketStore(), enabled=True)
+    assert limiter.hit("upload", ["ip:1", "user:1"]).allowed
+    assert limiter.hit("upload", ["ip:1", "user:2"]).allowed
+    # 同一 IP 的第三次請求，即使換了使用者也被拒絕
+    result = limiter.hit("upload", ["ip:1", "user:3"])
+    assert not result.allowed
+    assert result.headers()["Retry-After"] == "30"
+    assert limiter.rejected == 1
+    assert limiter.hit("upload", ["ip:2", "user:4"]).allowed
+    assert limiter.hit("other", ["ip:1"]) is None
+
+
+def test_bypass_token():
+    limiter = RateLimiter({}, store=MemoryBucketStore(), bypass_token="secret")
+    assert limiter.bypassed("secret")
+    assert not limiter.bypassed("wrong")
+    assert not limiter.bypassed(None)
+    assert not RateLimiter({}, store=MemoryBucketStore(), bypass_token="").bypassed("")
+
+
+def test_parse_limits():
+    assert parse_limits("burst:3/60, sustained:20/3600") == [Limit("burst", 3, 60), Limit("sustained", 20, 3600)]
+    assert parse_limits("") == []
+    for spec in ("burst:3", "burst:x/60", "3/60", "burst:0/60"):
+        with pytest.raises(ValueError):
+            parse_limits(spec)
+
+
+def test_upload_init_does_not_use_upload_bucket(monkeypatch):
+    """前端重試建立分塊上傳時，不會在第 4 次就被直接上傳的限制 (每分鐘 3 次) 拒絕"""
+    import main
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main.rate_limiter, "store", MemoryBucketStore())
+    monkeypatch.setattr(main.rate_limiter, "enabled", True)
+    client = TestClient(main.app)
+    upload_burst = main.RATE_LIMIT_RULES["upload"][0].capacity
+    # 未登入的請求在通過速率限制後回應 401
+    statuses = [client.post("/api/uploads", json={}).status_code for _ in range(upload_burst + 1)]
+    assert 429 not in statuses
+    statuses = [client.post("/api/video-abstract").status_code for _ in range(upload_burst + 1)]
+    assert statuses[-1] == 429
+
+
+def test_revoked_admin_token_does_not_bypass(monkeypatch):
+    """管理員 token 的版本遞增 (降級或撤銷) 後不再略過速率限制"""
+    import main
+    from fastapi.testclient import TestClient
+    from models import User
+    monkeypatch.setattr(main.rate_limiter, "store", MemoryBucketStore())
+    monkeypatch.setattr(main.rate_limiter, "enabled", True)
+    db = main.SessionLocal()
+    try:
+        admin = User(email=f"ratelimit-admin-{time.time()}@example.com", hashed_password="x", is_admin=True)
+        db.add(admin)
+        db.commit()
+        headers = {"Authorization": f"Bearer {main.create_user_token(admin, db)}"}
+        client = TestClient(main.app)
+        upload_burst = main.RATE_LIMIT_RULES["upload"][0].capacity
+        statuses = [client.post("/api/video-abstract", headers=headers).status_code for _ in range(upload_burst + 1)]
+        assert 429 not in statuses
+
+        main.revoke_user_tokens(admin, db)
+        statuses = [client.post("/api/video-abstract", headers=headers).status_code for _ in range(upload_burst + 1)]
+        assert statuses[-1] == 429
+    finally:
+        db.close()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+排程器 leader 鎖測試
+持有 advisory lock 的連線在每次確認存活後不留在交易中
+"""
+
+from sqlalchemy import create_engine
+
+from scheduler import AdvisoryLeaderLock
+
+
+def test_liveness_check_does_not_leave_transaction_open(tmp_path):
+    lock = AdvisoryLeaderLock(create_engine(f"sqlite:///{tmp_path / 'scheduler.db'}"))
+    lock._conn = lock.engine.connect()  # 已取得鎖的連線 (advisory lock 僅 PostgreSQL 支援)
+    try:
+        for _ in range(3):
+            assert lock.acquire()
+            assert not lock._conn.in_transaction()
+    finally:
+        lock._close()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+共用快取測試
+mmap 後端的項目數、版本隔離、JSON 序列化與無法還原的項目；
+redis 後端 (fakeredis) 的讀寫、pub/sub 失效與非同步存取
+"""
+
+import os
+import pickle
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytest
+
+from sharedcache import MmapBackend, SharedCache
+
+
+@pytest.fixture
+def base_path():
+    return os.path.join(tempfile.mkdtemp(), "cache")
+
+
+def test_mmap_entry_counts(base_path):
+    cache = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="v1"))
+    users = cache.namespace("user", 60)
+    usage = cache.namespace("usage", 60)
+    for i in range(5):
+        users.set(f"u{i}", {"id": i})
+    usage.set("1:2026-01-01", 3)
+    usage.set("expired", 1, ttl=-1)
+    assert cache.entry_counts() == {"user": 5, "usage": 1}
+    users.delete("u0")
+    assert users.entries() == 4
+    # 其他 worker (另一個映射) 看到相同的項目數
+    other = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="v1"))
+    other.namespace("user", 60)
+    assert other.entry_counts()["user"] == 4
+    cache.close()
+    other.close()
+
+
+def test_mmap_versions_do_not_share(base_path):
+    old = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="old"))
+    old.namespace("user", 60).set("alice", "舊結構")
+    old_path = old.backend.path
+
+    new = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="new"))
+    assert new.namespace("user", 60).get("alice") is None
+    # 啟動時刪除其他版本的檔案，仍在執行的舊版行程繼續使用自己的映射
+    assert not os.path.exists(old_path)
+    assert old.namespaces["user"].get("alice") == "舊結構"
+    old.close()
+    new.close()
+
+
+def test_undecodable_entry_is_a_miss(base_path):
+    cache = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="v1"))
+    users = cache.namespace("user", 60)
+    cache.backend.set("user:alice", b"not json", 60)
+    assert users.get("alice") is None
+    assert users.misses == 1
+    assert cache.errors == 1
+    assert users.get_or_set("alice", lambda: "fresh") == "fresh"
+    assert users.get("alice") == "fresh"
+    cache.close()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    id: int
+    email: str
+    created_at: datetime = None
+
+
+def test_values_roundtrip_as_json(base_path):
+    cache = SharedCache(MmapBackend(base_path, slots=64, slot_size=512, version="v1"))
+    users = cache.namespace("user", 60, decode=lambda data: Snapshot(**data))
+    stats = cache.namespace("stats", 60)
+    snapshot = Snapshot(id=1, email="alice@example.com", created_at=datetime(2026, 1, 2, 3, 4, 5))
+    users.set("alice", snapshot)
+    stats.set("summary", ('W/"etag"', {"total": 3, "names": ["簡報"]}))
+    assert users.get("alice") == snapshot
+    assert stats.get("summary") == ['W/"etag"', {"total": 3, "names": ["簡報"]}]
+    assert cache.backend.get("user:alice").startswith(b"{")
+    cache.close()
+
+
+class Exploit:
+    def __reduce__(self):
+        return (os.system, ("touch /tmp/pwned",))
+
+
+def test_pickle_payload_is_not_executed(base_path, monkeypatch):
+    cache = SharedCache(MmapBackend(base_path, slots=64, slot_size=256, version="v1"))
+    users = cache.namespace("user", 60)
+    payload = pickle.dumps(Exploit())
+    calls = []
+    monkeypatch.setattr(os, "system", lambda command: calls.append(command))
+    cache.backend.set("user:alice", payload, 60)
+    assert users.get("alice") is None
+    assert calls == []
+    assert cache.errors == 1
+    cache.close()
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeServer()
+
+
+def redis_cache(server, version: str = "v1", local_ttl: float = 60) -> SharedCache:
+    """模擬一個 worker：各自的 redis 連線與本機快取，共用同一個伺服器"""
+    import fakeredis
+    from sharedcache import RedisBackend
+    backend = RedisBackend("redis://fake", version=version,
+                           client=fakeredis.FakeRedis(server=server),
+                           subscriber=fakeredis.FakeRedis(server=server))
+    return SharedCache(backend, local_ttl=local_ttl)
+
+
+def wait_for(condition, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def test_redis_get_set_delete(redis_server):
+    first, second = redis_cache(redis_server), redis_cache(redis_server)
+    users = first.namespace("user", 60, decode=lambda data: Snapshot(**data))
+    other_users = second.namespace("user", 60, decode=lambda data: Snapshot(**data))
+    snapshot = Snapshot(id=1, email="alice@example.com", created_at=datetime(2026, 1, 2))
+
+    assert other_users.get("alice") is None
+    users.set("alice", snapshot)
+    assert other_users.get("alice") == snapshot  # 由 redis 取得並存入本機快取
+    assert other_users.hits == 1 and other_users.misses == 1
+
+    users.delete("alice")
+    assert users.get("alice") is None
+    assert first.backend.get("user:alice") is None
+    first.close()
+    second.close()
+
+
+def test_redis_invalidation_reaches_other_workers(redis_server):
+    first, second = redis_cache(redis_server), redis_cache(redis_server)
+    usage = first.namespace("usage", 60)
+    other_usage = second.namespace("usage", 60)
+    assert wait_for(lambda: first.backend.stats()["subscribed"] and second.backend.stats()["subscribed"])
+
+    usage.set("1:2026-01-02", 3)
+    assert other_usage.get("1:2026-01-02") == 3
+    assert len(other_usage) == 1
+    # 另一個 worker 的本機快取收到 pub/sub 失效訊息後移除，之後讀取到新值
+    usage.delete("1:2026-01-02")
+    assert wait_for(lambda: len(other_usage) == 0)
+    usage.set("1:2026-01-02", 4)
+    assert other_usage.get("1:2026-01-02") == 4
+    first.close()
+    second.close()
+
+
+def test_redis_versions_do_not_share(redis_server):
+    old, new = redis_cache(redis_server, "old"), redis_cache(redis_server, "new")
+    old.namespace("user", 60).set("alice", {"id": 1})
+    assert new.namespace("user", 60).get("alice") is None
+    old.close()
+    new.close()
+
+
+def test_redis_errors_are_misses(redis_server, monkeypatch):
+    cache = redis_cache(redis_server)
+    users = cache.namespace("user", 60)
+
+    def unavailable(*args):
+        raise ConnectionError("redis unavailable")
+
+    monkeypatch.setattr(cache.backend, "get", unavailable)
+    monkeypatch.setattr(cache.backend, "set", unavailable)
+    assert users.get_or_set("alice", lambda: "fresh") == "fresh"
+    assert cache.errors == 3  # 兩次讀取 (取得鎖前後) 與一次寫入
+    cache.close()
+
+
+def test_redis_async_access_runs_off_the_event_loop(redis_server, monkeypatch):
+    anyio = pytest.importorskip("anyio")
+    cache = redis_cache(redis_server)
+    users = cache.namespace("user", 60)
+    threads = []
+    original_get = cache.backend.get
+
+    def recording_get(key):
+        threads.append(threading.get_ident())
+        return original_get(key)
+
+    monkeypatch.setattr(cache.backend, "get", recording_get)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        assert await users.aget("alice") is None
+        await users.aset("alice", {"id": 1})
+        assert await users.aget("alice") == {"id": 1}  # 本機快取命中，不查詢 redis
+        return loop_thread
+
+    loop_thread = anyio.run(main)
+    assert len(threads) == 1
+    assert threads[0] != loop_thread
+    cache.close()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+儲存後端與預簽網址測試
+確認 local 預簽網址只能取得簽章涵蓋的檔案，無法以絕對路徑或 .. 讀取根目錄之外的檔案；
+S3 後端以 moto 模擬的 bucket 測試讀寫、Range 讀取、刪除與預簽網址
+"""
+
+import hashlib
+import hmac
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit, unquote
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from storage import LocalStorage, S3Storage
+
+client = TestClient(main.app)
+
+
+def put(storage, key: str, data: bytes):
+    with storage.writer(key) as f:
+        f.write(data)
+
+
+def signed_request(url: str):
+    parts = urlsplit(url)
+    params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+    return unquote(parts.path[len("/api/storage/"):]), params
+
+
+def forge(key: str, expires: int, secret: str) -> str:
+    """以指定金鑰自行計算簽章 (模擬攻擊者知道或猜到金鑰)"""
+    return hmac.new(secret.encode(), f"{key}\n{expires}\n".encode(), hashlib.sha256).hexdigest()
+
+
+def test_presigned_url_roundtrip():
+    put(main.storage, "blobs/aa/video.mp4", b"0123456789")
+    url = main.storage.presigned_url("blobs/aa/video.mp4", "video.mp4")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b"0123456789"
+
+    response = client.get(url, headers={"Range": "bytes=2-4"})
+    assert response.status_code == 206
+    assert response.content == b"234"
+
+
+def test_presigned_url_rejects_tampering_and_expiry():
+    put(main.storage, "blobs/bb/a.mp4", b"a")
+    put(main.storage, "blobs/bb/b.mp4", b"b")
+    key, params = signed_request(main.storage.presigned_url("blobs/bb/a.mp4"))
+    assert client.get("/api/storage/blobs/bb/b.mp4", params=params).status_code == 403
+
+    expired = int(time.time()) - 1
+    assert main.storage.signed_key(key, expired, main.storage._signature(key, expired, None)) is None
+
+
+def test_signed_route_rejects_absolute_and_traversal():
+    expires = int(time.time()) + 60
+    secret = main.storage._secret.decode()
+    for key in ("/etc/passwd", "../../../../etc/passwd", "blobs/../../../etc/passwd"):
+        # 即使簽章以正確金鑰計算，也不提供根目錄之外或未正規化的鍵
+        for signed in (key, key.lstrip("/"), os.path.normpath(key)):
+            sig = forge(signed, expires, secret)
+            response = client.get(f"/api/storage/{key}", params={"expires": expires, "sig": sig})
+            assert response.status_code in (403, 404), (key, signed, response.status_code)
+            assert b"root:" not in response.content
+
+
+def test_signing_key_is_not_jwt_secret():
+    expires = int(time.time()) + 60
+    put(main.storage, "blobs/cc/c.mp4", b"c")
+    sig = forge("blobs/cc/c.mp4", expires, main.SECRET_KEY)
+    response = client.get("/api/storage/blobs/cc/c.mp4", params={"expires": expires, "sig": sig})
+    assert response.status_code == 403
+
+
+def test_local_path_stays_under_root():
+    root = tempfile.mkdtemp()
+    storage = LocalStorage(root, secret="s")
+    outside = tempfile.mkdtemp()
+    os.symlink(outside, os.path.join(storage.root, "link"))
+    for key in ("/etc/passwd", "../x", "a/../../x", os.path.join(outside, "x"), "link/x"):
+        with pytest.raises(ValueError):
+            storage.path(key)
+        assert storage.exists(key) is False
+        assert storage.stat(key) is None
+        assert storage.presigned_url(key) is None
+
+    # 根目錄之下的既有絕對路徑轉為相對鍵
+    put(storage, "legacy/file.mp4", b"x")
+    assert storage.key_for(os.path.join(storage.root, "legacy/file.mp4")) == "legacy/file.mp4"
+    assert storage.exists(os.path.join(storage.root, "legacy/file.mp4"))
+
+
+@pytest.fixture
+def s3_storage():
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        import boto3
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="slides")
+        storage = S3Storage(bucket="slides", prefix="app", endpoint_url=None, region="us-east-1",
+                            access_key_id="test", secret_access_key="test", public_endpoint_url=None,
+                            part_size=5 * 1024 * 1024, legacy_root=tempfile.mkdtemp())
+        yield storage
+        storage.close()
+
+
+def s3_file(data: bytes) -> str:
+    fd, path = tempfile.mkstemp(dir=tempfile.mkdtemp())
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_s3_put_read_delete(s3_storage):
+    data = bytes(range(256)) * 40
+    src = s3_file(data)
+    assert s3_storage.put_file("blobs/ab/clip.mp4", src) == "blobs/ab/clip.mp4"
+    assert not os.path.exists(src)  # 上傳後移除本機檔案
+    head = s3_storage.client.head_object(Bucket="slides", Key="app/blobs/ab/clip.mp4")
+    assert head["ContentLength"] == len(data)
+
+    assert s3_storage.exists("blobs/ab/clip.mp4")
+    assert s3_storage.stat("blobs/ab/clip.mp4").size == len(data)
+    assert b"".join(s3_storage.read_range("blobs/ab/clip.mp4")) == data
+    assert b"".join(s3_storage.read_range("blobs/ab/clip.mp4", 100, 50)) == data[100:150]
+    assert b"".join(s3_storage.read_range("blobs/ab/clip.mp4", len(data) - 10)) == data[-10:]
+    assert [item.key for item in s3_storage.list("blobs/")] == ["blobs/ab/clip.mp4"]
+    with s3_storage.local_path("blobs/ab/clip.mp4") as path:
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+    assert s3_storage.delete("blobs/ab/clip.mp4")
+    assert not s3_storage.exists("blobs/ab/clip.mp4")
+    assert s3_storage.stat("blobs/ab/clip.mp4") is None
+    assert s3_storage.delete("blobs/ab/clip.mp4")  # 不存在的物件也視為已刪除
+
+
+def test_s3_multipart_writer(s3_storage):
+    data = os.urandom(s3_storage.part_size + 1024)
+    with s3_storage.writer("results/video.mp4", content_type="video/mp4") as out:
+        for offset in range(0, len(data), 1024 * 1024):
+            out.write(data[offset:offset + 1024 * 1024])
+    assert b"".join(s3_storage.read_range("results/video.mp4")) == data
+
+    with pytest.raises(RuntimeError):
+        with s3_storage.writer("results/broken.mp4") as out:
+            out.write(data)
+            raise RuntimeError("中斷")
+    assert not s3_storage.exists("results/broken.mp4")  # 例外時取消，不留下不完整的物件
+
+
+def test_s3_presigned_url(s3_storage):
+    s3_storage.put_file("blobs/ab/clip.mp4", s3_file(b"video"))
+    url = s3_storage.presigned_url("blobs/ab/clip.mp4", filename="簡報.mp4", content_type="video/mp4", expires_in=60)
+    parts = urlsplit(url)
+    params = parse_qs(parts.query)
+    assert parts.path.endswith("/app/blobs/ab/clip.mp4")
+    assert params["X-Amz-Expires"] == ["60"]
+    assert params["X-Amz-Signature"]
+    assert params["response-content-type"] == ["video/mp4"]
+    assert "%E7%B0%A1%E5%A0%B1.mp4" in params["response-content-disposition"][0]
+
+    # moto 同時攔截 requests，以預簽網址直接下載 (含 Range)
+    requests = pytest.importorskip("requests")
+    response = requests.get(url, headers={"Range": "bytes=1-3"})
+    assert response.status_code == 206
+    assert response.content == b"ide"
+    assert response.headers["content-type"] == "video/mp4"
+
+
+def test_s3_rejects_keys_outside_root(s3_storage):
+    legacy = os.path.join(s3_storage.legacy_root, "user/1/old.mp4")
+    assert s3_storage.key_for(legacy) == "user/1/old.mp4"
+    for key in ("/etc/passwd", "../x", "a/../../x"):
+        with pytest.raises(ValueError):
+            s3_storage.key_for(key)
+        assert s3_storage.stat(key) is None
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+分塊上傳測試
+已接收區段的合併，以及 complete 的條件式領取與冪等性 (重複或並發呼叫只排入一個工作)
+相同內容的上傳共用同一個儲存物件，最後一個引用釋放時才刪除
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from models import ProcessingJob, StoredBlob, UploadSession, User, UserFile
+from uploads import merge_ranges, received_bytes
+
+CONTENT = b"chunked upload content"
+
+
+@pytest.mark.parametrize("ranges, new, expected", [
+    ([], (0, 10), [[0, 10]]),
+    ([[0, 10]], (10, 20), [[0, 20]]),  # 相鄰區段合併
+    ([[0, 10]], (5, 15), [[0, 15]]),  # 重疊
+    ([[0, 10], [20, 30]], (12, 18), [[0, 10], [12, 18], [20, 30]]),
+    ([[0, 10], [20, 30]], (5, 25), [[0, 30]]),  # 跨越多個區段
+    ([[20, 30]], (0, 10), [[0, 10], [20, 30]]),
+    ([[0, 30]], (5, 10), [[0, 30]]),  # 重送已接收的分塊
+])
+def test_merge_ranges(ranges, new, expected):
+    merged = merge_ranges(ranges, *new)
+    assert merged == expected
+    assert received_bytes(merged) == sum(end - start for start, end in expected)
+
+
+def create_user():
+    """建立一般使用者，回傳 UserSnapshot"""
+    db = main.SessionLocal()
+    try:
+        user = User(email=f"uploader-{datetime.utcnow().timestamp()}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        return main.UserSnapshot(id=user.id, email=user.email, is_admin=False)
+    finally:
+        db.close()
+
+
+def uploaded_session(user, content: bytes = CONTENT):
+    """建立已收到全部內容的分塊上傳，回傳 upload id"""
+    db = main.SessionLocal()
+    try:
+        req = main.UploadInitRequest(file_name="clip.mp4", file_size=len(content),
+                                     content_type="video/mp4", service_type="video_abstract")
+        upload_id = main.initiate_upload(req, current_user=user, db=db)["upload_id"]
+        session = db.get(UploadSession, upload_id)
+        with open(session.temp_path, "r+b") as f:
+            f.write(content)
+        session.received_ranges = json.dumps([[0, len(content)]])
+        db.commit()
+        return upload_id
+    finally:
+        db.close()
+
+
+def complete(upload_id, user):
+    db = main.SessionLocal()
+    try:
+        return main.complete_upload(upload_id, current_user=user, db=db)
+    finally:
+        db.close()
+
+
+def job_count(user):
+    db = main.SessionLocal()
+    try:
+        return db.query(ProcessingJob).filter(ProcessingJob.user_id == user.id).count()
+    finally:
+        db.close()
+
+
+def test_repeated_complete_returns_same_job():
+    user = create_user()
+    upload_id = uploaded_session(user)
+    first = complete(upload_id, user)
+    second = complete(upload_id, user)
+    assert second["job_id"] == first["job_id"]
+    assert job_count(user) == 1
+
+    db = main.SessionLocal()
+    try:
+        status = main.get_upload_status(upload_id, current_user=user, db=db)
+        assert status["status"] == 'completed'
+        assert status["job_id"] == first["job_id"]
+    finally:
+        db.close()
+
+
+def test_concurrent_complete_is_rejected_while_claimed():
+    user = create_user()
+    upload_id = uploaded_session(user)
+
+    # 另一個請求已取得完成權但尚未排入工作
+    db = main.SessionLocal()
+    try:
+        db.get(UploadSession, upload_id).status = 'completing'
+        db.commit()
+    finally:
+        db.close()
+    with pytest.raises(HTTPException) as exc:
+        complete(upload_id, user)
+    assert exc.value.status_code == 409
+    assert job_count(user) == 0
+
+
+def test_complete_after_lost_claim_returns_winner_job(monkeypatch):
+    user = create_user()
+    upload_id = uploaded_session(user)
+    winner = {}
+    original = main.check_storage_quota
+
+    def racing_quota_check(*args, **kwargs):
+        # 狀態檢查之後、領取之前，另一個 complete 搶先完成
+        monkeypatch.setattr(main, "check_storage_quota", original)
+        winner.update(complete(upload_id, user))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(main, "check_storage_quota", racing_quota_check)
+    result = complete(upload_id, user)
+    assert result["job_id"] == winner["job_id"]
+    assert job_count(user) == 1
+
+
+def blob_state(content: bytes):
+    """(ref_count, 物件是否存在)；內容沒有記錄時回傳 (0, False)"""
+    db = main.SessionLocal()
+    try:
+        blob = db.get(StoredBlob, hashlib.sha256(content).hexdigest())
+        if blob is None:
+            return 0, False
+        return blob.ref_count, main.storage.exists(blob.file_path)
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("failure, status_code", [
+    ("charge_storage", 413),  # 並發上傳在領取之後用完儲存空間
+    ("record_usage", 429),  # 並發請求在領取之後用完今日額度
+])
+def test_failed_complete_can_be_retried(monkeypatch, failure, status_code):
+    user = create_user()
+    content = f"retry after {failure}".encode()
+    upload_id = uploaded_session(user, content)
+    monkeypatch.setattr(main, failure, lambda *args, **kwargs: False)
+    with pytest.raises(HTTPException) as exc:
+        complete(upload_id, user)
+    assert exc.value.status_code == status_code
+    assert job_count(user) == 0
+    assert blob_state(content) == (0, False)  # 內容引用與新寫入的物件都已釋放
+
+    db = main.SessionLocal()
+    try:
+        status = main.get_upload_status(upload_id, current_user=user, db=db)
+        assert status["status"] == 'uploading'
+        assert status["job_id"] is None
+        assert status["complete"]
+        assert main.get_storage_bytes(db, user.id) == 0
+    finally:
+        db.close()
+
+    monkeypatch.undo()
+    result = complete(upload_id, user)
+    assert job_count(user) == 1
+    assert complete(upload_id, user)["job_id"] == result["job_id"]
+    assert blob_state(content) == (1, True)
+    db = main.SessionLocal()
+    try:
+        assert main.get_storage_bytes(db, user.id) == len(content)
+        assert not os.path.exists(db.get(UploadSession, upload_id).temp_path)
+    finally:
+        db.close()
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def test_streaming_upload_does_blocking_io_off_the_event_loop(monkeypatch):
+    user = create_user()
+    db = main.SessionLocal()
+    try:
+        token = main.create_user_token(db.get(User, user.id), db)
+    finally:
+        db.close()
+
+    # 儲存後端與快取失效 (redis 時為網路請求) 都不應在事件迴圈上執行；
+    # 行程內快取的讀取不阻塞，redis 讀取見 test_sharedcache.py
+    blocking_calls = []
+    for target, name in ((main.storage, "exists"), (main.storage, "delete"), (main.storage, "put_file"),
+                         (main.usage_cache, "delete")):
+        original = getattr(target, name)
+
+        def guarded(*args, __original=original, __name=name, **kwargs):
+            blocking_calls.append((__name, on_event_loop()))
+            return __original(*args, **kwargs)
+
+        monkeypatch.setattr(target, name, guarded)
+
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(2):  # 第二次為相同內容 (沿用既有物件)
+        response = client.post("/api/video-abstract", headers=headers,
+                               files={"file": ("clip.mp4", b"streamed content", "video/mp4")})
+        assert response.status_code == 202, response.text
+    assert job_count(user) == 2
+    assert blocking_calls
+    assert not [call for call in blocking_calls if call[1]]
+
+
+def test_identical_uploads_share_one_blob():
+    content = b"deduplicated upload content"
+    users = [create_user(), create_user()]
+    file_ids = [complete(uploaded_session(user, content), user)["file_id"] for user in users]
+    assert blob_state(content) == (2, True)
+
+    db = main.SessionLocal()
+    try:
+        paths = {db.get(UserFile, file_id).file_path for file_id in file_ids}
+        assert len(paths) == 1  # 兩筆記錄引用同一個物件
+
+        # 刪除第一個引用時保留物件
+        main.delete_user_file(file_ids[0], current_user=users[0], db=db)
+        assert blob_state(content) == (1, True)
+
+        # 最後一個引用過期後才刪除物件
+        db.get(UserFile, file_ids[1]).expires_at = datetime.utcnow() - timedelta(days=1)
+        db.commit()
+        main.cleanup_expired_files(db)
+        assert blob_state(content) == (0, False)
+        assert not main.storage.exists(paths.pop())
+    finally:
+        db.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+每日使用次數測試
+reserve_usage 的條件式 UPDATE 在達到每日上限時拒絕，且不受先前讀取到的舊計數影響
+"""
+
+from models import UsageRecord
+from usage import TOTAL_SERVICE, get_daily_usage, refund_usage, reserve_usage, usage_day
+
+LIMIT = 3
+
+
+def reserve(session_factory, user_id: int = 1, service_type: str = "video_abstract") -> bool:
+    db = session_factory()
+    try:
+        reserved = reserve_usage(db, user_id, service_type, LIMIT)
+        db.commit()
+        return reserved
+    finally:
+        db.close()
+
+
+def test_reserve_stops_at_daily_limit(session_factory):
+    assert [reserve(session_factory) for _ in range(LIMIT + 2)] == [True] * LIMIT + [False] * 2
+
+    db = session_factory()
+    try:
+        assert get_daily_usage(db, 1) == LIMIT
+        assert get_daily_usage(db, 1, "video_abstract") == LIMIT
+        assert db.query(UsageRecord).count() == LIMIT  # 被拒絕的請求不留下使用記錄
+        assert get_daily_usage(db, 2) == 0
+    finally:
+        db.close()
+
+
+def test_reserve_rechecks_limit_after_stale_read(session_factory):
+    for _ in range(LIMIT - 1):
+        assert reserve(session_factory)
+
+    # 兩個請求都讀到「尚餘一次」，只有一個能完成扣除
+    first, second = session_factory(), session_factory()
+    try:
+        assert get_daily_usage(first, 1) == get_daily_usage(second, 1) == LIMIT - 1
+        assert reserve_usage(first, 1, "ppt_to_video", LIMIT)
+        first.commit()
+        assert not reserve_usage(second, 1, "video_abstract", LIMIT)
+        second.commit()
+        assert get_daily_usage(second, 1, TOTAL_SERVICE) == LIMIT
+        assert get_daily_usage(second, 1, "video_abstract") == LIMIT - 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_refund_frees_a_slot(session_factory):
+    for _ in range(LIMIT):
+        assert reserve(session_factory)
+    db = session_factory()
+    try:
+        refund_usage(db, 1, "video_abstract", usage_day())
+        db.commit()
+    finally:
+        db.close()
+    assert reserve(session_factory)
+    assert not reserve(session_factory)
+
+
+def test_zero_limit_never_reserves(session_factory):
+    db = session_factory()
+    try:
+        assert not reserve_usage(db, 1, "video_abstract", 0)
+        db.commit()
+        assert get_daily_usage(db, 1) == 0
+    finally:
+        db.close()
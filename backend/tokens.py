@@ -0,0 +1,34 @@
+"""
+Token 版本管理
+access token 內帶有使用者的 token 版本 (ver)；密碼重設或權限變更時遞增版本，
+所有舊 token 隨即失效，不需要在每次請求時查詢使用者資料表
+
+函數只變更 session，由呼叫端 commit
+"""
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from models import TokenVersion
+
+
+def get_token_version(db, user_id: int) -> int:
+    """取得使用者目前的 token 版本 (未曾變更時為 0)"""
+    version = db.query(TokenVersion.version).filter(TokenVersion.user_id == user_id).scalar()
+    return version or 0
+
+
+def bump_token_version(db, user_id: int) -> int:
+    """遞增使用者的 token 版本，回傳新版本"""
+    result = db.execute(
+        update(TokenVersion)
+        .where(TokenVersion.user_id == user_id)
+        .values(version=TokenVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        try:
+            with db.begin_nested():
+                db.add(TokenVersion(user_id=user_id, version=1))
+        except IntegrityError:
+            return bump_token_version(db, user_id)
+    return get_token_version(db, user_id)
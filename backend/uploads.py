@@ -0,0 +1,236 @@
+"""
+串流上傳處理
+直接解析 multipart 請求串流，邊接收邊以非同步 I/O 寫入磁碟：
+- 不經過 SpooledTemporaryFile，也不需要先收完整個請求才檢查大小
+- 超過大小限制時立即中止並刪除已寫入的部分
+- 寫入同時計算 SHA-256 內容雜湊
+
+另提供可續傳分塊上傳 (resumable upload) 所需的工具函數
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+
+import anyio
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+MULTIPART_OVERHEAD = 64 * 1024  # multipart 邊界與標頭的預留大小
+
+
+@dataclass
+class IngestedFile:
+    """串流寫入完成的上傳檔案"""
+    file_name: str
+    content_type: str
+    file_path: str
+    file_size: int
+    sha256: str
+
+
+class _FilePartCollector:
+    """multipart 解析回呼，只收集指定欄位的檔案內容"""
+
+    def __init__(self, field_name: str, max_size: int, accept, type_error: str, size_error: str):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.accept = accept
+        self.type_error = type_error
+        self.size_error = size_error
+        self.file_name = None
+        self.content_type = None
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.pending = []  # 尚未寫入磁碟的資料
+        self.found = False
+        self.finished = False
+        self._capturing = False
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._capturing = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name != self.field_name or b"filename" not in options or self.found:
+            return
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+        # 在讀取檔案內容前先檢查檔案類型
+        if not self.accept(content_type):
+            raise HTTPException(status_code=400, detail=self.type_error)
+        self.file_name = options[b"filename"].decode("utf-8", "replace")
+        self.content_type = content_type
+        self.found = True
+        self._capturing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._capturing:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise HTTPException(status_code=400, detail=self.size_error)
+        self.hasher.update(chunk)
+        self.pending.append(chunk)
+
+    def on_part_end(self):
+        if self._capturing:
+            self.finished = True
+        self._capturing = False
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+
+async def ingest_upload(
+    request: Request,
+    files_dir: str,
+    max_size: int,
+    accept=lambda content_type: True,
+    type_error: str = "不支援的檔案類型",
+    size_error: str = "檔案過大",
+    field_name: str = "file"
+) -> IngestedFile:
+    """串流接收 multipart 上傳並寫入 files_dir，回傳檔案資訊"""
+    content_type_header = request.headers.get("content-type", "")
+    content_type, params = parse_options_header(content_type_header)
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="請以 multipart/form-data 上傳檔案")
+
+    # 依 Content-Length 提前拒絕過大的請求，不必接收內容
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=400, detail=size_error)
+
+    collector = _FilePartCollector(field_name, max_size, accept, type_error, size_error)
+    parser = MultipartParser(params[b"boundary"], collector.callbacks())
+
+    os.makedirs(files_dir, exist_ok=True)
+    file_path = None
+    out = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if collector.found and out is None:
+                file_extension = os.path.splitext(collector.file_name)[1]
+                file_path = os.path.join(files_dir, f"{uuid.uuid4()}{file_extension}")
+                out = await anyio.open_file(file_path, "wb")
+            for data in collector.pending:
+                await out.write(data)
+            collector.pending.clear()
+            if collector.finished:
+                # 已取得檔案，不再處理其餘欄位
+                break
+        if not collector.found:
+            raise HTTPException(status_code=400, detail="未找到上傳檔案")
+        if not collector.finished:
+            raise HTTPException(status_code=400, detail="上傳中斷，請重新上傳")
+        await out.aclose()
+    except BaseException:
+        if out is not None:
+            await out.aclose()
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+    return IngestedFile(
+        file_name=collector.file_name,
+        content_type=collector.content_type,
+        file_path=file_path,
+        file_size=collector.size,
+        sha256=collector.hasher.hexdigest()
+    )
+
+
+def preallocate_file(path: str, size: int):
+    """預先配置指定大小的暫存檔，分塊可直接寫入對應位置"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        if size > 0 and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+
+
+def link_file(path: str) -> str:
+    """建立暫存檔的硬連結 (檔案系統不支援時複製)，回傳新路徑
+
+    將連結移入儲存後原檔仍保留，完成失敗時可重試而不必重新上傳
+    """
+    link_path = f"{path}.{uuid.uuid4().hex}.staging"
+    try:
+        os.link(path, link_path)
+    except OSError:
+        shutil.copyfile(path, link_path)
+    return link_path
+
+
+def detach_file(path: str):
+    """檔案與其他路徑共用內容 (硬連結) 時複製一份獨立的內容，之後寫入不會影響另一個路徑"""
+    if os.stat(path).st_nlink <= 1:
+        return
+    copy_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(path, copy_path)
+    os.replace(copy_path, path)
+
+
+def merge_ranges(ranges: list, start: int, end: int) -> list:
+    """將 [start, end) 合併進已排序的區段列表"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def received_bytes(ranges: list) -> int:
+    """已接收的位元組數"""
+    return sum(end - start for start, end in ranges)
+
+
+async def write_chunk(request: Request, path: str, offset: int, total_size: int) -> int:
+    """將請求內容串流寫入預配置檔案的 offset 位置，回傳寫入的位元組數"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and offset + int(content_length) > total_size:
+        raise HTTPException(status_code=400, detail="分塊超出檔案大小")
+
+    written = 0
+    async with await anyio.open_file(path, "r+b") as out:
+        await out.seek(offset)
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if offset + written + len(chunk) > total_size:
+                raise HTTPException(status_code=400, detail="分塊超出檔案大小")
+            await out.write(chunk)
+            written += len(chunk)
+    return written
+
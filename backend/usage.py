@@ -0,0 +1,143 @@
+"""
+每日使用次數計數
+daily_usage_counters 以 (使用者, UTC 日期, 服務類型) 為主鍵保存當日使用次數，
+另以 service_type='all' 保存當日合計；檢查額度只需讀取一列，不隨 usage_records 成長而變慢
+
+reserve_usage 以單一條件式 UPDATE (count < 上限) 同時完成檢查與遞增，
+並發請求不會同時通過額度檢查
+
+函數只變更 session，由呼叫端 commit
+"""
+
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import update, delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from models import DailyUsageCounter, UsageRecord
+
+TOTAL_SERVICE = 'all'  # 當日合計列的服務類型
+
+
+def usage_day() -> date:
+    """目前的計數日期 (UTC，與 usage_records.usage_date 一致)"""
+    return datetime.utcnow().date()
+
+
+def daily_usage_statement(user_id: int, service_type: str = TOTAL_SERVICE, day: date = None):
+    """使用者某日使用次數的主鍵查詢 (同步與非同步 session 共用)"""
+    return select(DailyUsageCounter.count).where(
+        DailyUsageCounter.user_id == user_id,
+        DailyUsageCounter.usage_date == (day or usage_day()),
+        DailyUsageCounter.service_type == service_type
+    )
+
+
+def get_daily_usage(db, user_id: int, service_type: str = TOTAL_SERVICE, day: date = None) -> int:
+    """取得使用者某日的使用次數"""
+    return db.execute(daily_usage_statement(user_id, service_type, day)).scalar() or 0
+
+
+async def get_daily_usage_async(db, user_id: int, service_type: str = TOTAL_SERVICE, day: date = None) -> int:
+    """get_daily_usage 的非同步版本 (AsyncSession)"""
+    return (await db.execute(daily_usage_statement(user_id, service_type, day))).scalar() or 0
+
+
+def _increment(db, user_id: int, day: date, service_type: str, limit: int = None) -> bool:
+    """遞增計數；指定 limit 時只有 count < limit 才遞增，回傳是否成功"""
+    query = update(DailyUsageCounter).where(
+        DailyUsageCounter.user_id == user_id,
+        DailyUsageCounter.usage_date == day,
+        DailyUsageCounter.service_type == service_type
+    )
+    if limit is not None:
+        query = query.where(DailyUsageCounter.count < limit)
+    result = db.execute(query.values(count=DailyUsageCounter.count + 1))
+    if result.rowcount == 1:
+        return True
+    if limit is not None:
+        exists = db.query(DailyUsageCounter.count).filter(
+            DailyUsageCounter.user_id == user_id,
+            DailyUsageCounter.usage_date == day,
+            DailyUsageCounter.service_type == service_type
+        ).first()
+        if exists or limit <= 0:
+            # 已達上限
+            return False
+    try:
+        with db.begin_nested():
+            db.add(DailyUsageCounter(user_id=user_id, usage_date=day, service_type=service_type, count=1))
+    except IntegrityError:
+        # 其他請求同時建立了同一列
+        return _increment(db, user_id, day, service_type, limit)
+    return True
+
+
+def reserve_usage(db, user_id: int, service_type: str, limit: int) -> bool:
+    """檢查並記錄一次使用，超過每日上限時回傳 False (不變更任何資料)"""
+    day = usage_day()
+    if not _increment(db, user_id, day, TOTAL_SERVICE, limit):
+        return False
+    _increment(db, user_id, day, service_type)
+    db.add(UsageRecord(user_id=user_id, service_type=service_type, usage_date=datetime.utcnow()))
+    return True
+
+
+def refund_usage(db, user_id: int, service_type: str, day: date):
+    """退回一次使用 (處理失敗時)"""
+    for counter_service in (TOTAL_SERVICE, service_type):
+        db.execute(
+            update(DailyUsageCounter)
+            .where(
+                DailyUsageCounter.user_id == user_id,
+                DailyUsageCounter.usage_date == day,
+                DailyUsageCounter.service_type == counter_service,
+                DailyUsageCounter.count > 0
+            )
+            .values(count=DailyUsageCounter.count - 1)
+        )
+    day_start = datetime.combine(day, datetime.min.time())
+    record_id = db.query(UsageRecord.id).filter(
+        UsageRecord.user_id == user_id,
+        UsageRecord.service_type == service_type,
+        UsageRecord.usage_date >= day_start,
+        UsageRecord.usage_date < day_start + timedelta(days=1)
+    ).order_by(UsageRecord.usage_date.desc()).limit(1).scalar()
+    if record_id is not None:
+        db.execute(delete(UsageRecord).where(UsageRecord.id == record_id))
+
+
+def daily_usage_summary(db, day: date = None) -> dict:
+    """某日各服務的使用次數與活躍使用者數 (單一查詢)"""
+    rows = db.query(
+        DailyUsageCounter.service_type,
+        func.coalesce(func.sum(DailyUsageCounter.count), 0),
+        func.count(DailyUsageCounter.user_id).filter(DailyUsageCounter.count > 0)
+    ).filter(
+        DailyUsageCounter.usage_date == (day or usage_day())
+    ).group_by(DailyUsageCounter.service_type).all()
+    return {service_type: {"count": total, "users": users} for service_type, total, users in rows}
+
+
+def backfill_usage_counters(db) -> int:
+    """由既有 usage_records 重建計數表 (部署新表時執行一次)，回傳建立的列數"""
+    db.execute(delete(DailyUsageCounter))
+    usage_day_expr = func.date(UsageRecord.usage_date)
+    rows = db.query(
+        UsageRecord.user_id,
+        usage_day_expr,
+        UsageRecord.service_type,
+        func.count(UsageRecord.id)
+    ).group_by(UsageRecord.user_id, usage_day_expr, UsageRecord.service_type).all()
+
+    totals = {}
+    counters = []
+    for user_id, day, service_type, count in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        counters.append(DailyUsageCounter(user_id=user_id, usage_date=day, service_type=service_type, count=count))
+        totals[(user_id, day)] = totals.get((user_id, day), 0) + count
+    for (user_id, day), count in totals.items():
+        counters.append(DailyUsageCounter(user_id=user_id, usage_date=day, service_type=TOTAL_SERVICE, count=count))
+    db.add_all(counters)
+    return len(counters)
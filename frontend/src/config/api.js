@@ -30,6 +30,8 @@ export const API_ENDPOINTS = {
   USER_FILES: "/api/user/files",
   USER_FILES_EXPIRING: "/api/user/files/expiring",
   USER_FILES_DELETE: "/api/user/files",
+  JOBS: "/api/jobs",
+  UPLOADS: "/api/uploads",
   
   ADMIN_USER_COUNT: "/api/admin/user-count",
   ADMIN_USER_TOTAL: "/api/admin/user-total",
@@ -149,3 +151,98 @@ export const clearExpiredCache = () => {
 
 // 定期清理快取（每10分鐘）
 setInterval(clearExpiredCache, 10 * 60 * 1000);
+
+// 輪詢背景工作直到完成（不使用快取）
+export const waitForJob = async (jobId, { interval = 2000, timeout = 10 * 60 * 1000 } = {}) => {
+  const token = localStorage.getItem("token");
+  const url = getApiEndpoint(`${API_ENDPOINTS.JOBS}/${jobId}`);
+  const deadline = Date.now() + timeout;
+
+  while (Date.now() < deadline) {
+    const res = await fetch(url, {
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok) throw new Error(data.detail || `HTTP error! status: ${res.status}`);
+    if (data.status === "completed") return data;
+    if (data.status !== "processing") throw new Error(data.error || "處理失敗");
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+  throw new Error("處理逾時，請稍後至檔案管理查看結果");
+};
+
+// 依 X-Next-Cursor 標頭逐頁取得完整列表（不使用快取）
+export const fetchAllPages = async (endpoint, { limit = 200 } = {}) => {
+  const token = localStorage.getItem("token");
+  const items = [];
+  let cursor = null;
+
+  do {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`${getApiEndpoint(endpoint)}?${params}`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+    });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok) throw new Error(data.detail || `HTTP error! status: ${res.status}`);
+    items.push(...data);
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+
+  return items;
+};
+
+// 可續傳的分塊上傳：中斷時查詢已接收區段並只補傳缺少的部分
+export const uploadResumable = async (file, serviceType, { retries = 3, onProgress } = {}) => {
+  const token = localStorage.getItem("token");
+  const authHeaders = { Authorization: `Bearer ${token}` };
+  const request = async (endpoint, options = {}) => {
+    const res = await fetch(getApiEndpoint(endpoint), {
+      ...options,
+      headers: { ...authHeaders, ...options.headers },
+    });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok) throw new Error(data.detail || `HTTP error! status: ${res.status}`);
+    return data;
+  };
+
+  let upload = await request(API_ENDPOINTS.UPLOADS, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      file_name: file.name,
+      file_size: file.size,
+      content_type: file.type,
+      service_type: serviceType,
+    }),
+  });
+  const uploadUrl = `${API_ENDPOINTS.UPLOADS}/${upload.upload_id}`;
+  const chunkSize = upload.chunk_size;
+
+  for (let attempt = 0; !upload.complete; attempt++) {
+    // 依已接收區段找出缺少的部分
+    let offset = 0;
+    const missing = [];
+    for (const [start, end] of [...upload.received_ranges, [file.size, file.size]]) {
+      if (start > offset) missing.push([offset, start]);
+      offset = Math.max(offset, end);
+    }
+    try {
+      for (const [start, end] of missing) {
+        for (let pos = start; pos < end; pos += chunkSize) {
+          upload = await request(`${uploadUrl}?offset=${pos}`, {
+            method: "PUT",
+            headers: { "Content-Type": "application/octet-stream" },
+            body: file.slice(pos, Math.min(pos + chunkSize, end)),
+          });
+          if (onProgress) onProgress(upload.received_bytes / upload.total_size);
+        }
+      }
+    } catch (error) {
+      if (attempt >= retries) throw error;
+      upload = await request(uploadUrl);
+    }
+  }
+
+  return request(`${uploadUrl}/complete`, { method: "POST" });
+};